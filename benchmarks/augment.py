@@ -0,0 +1,162 @@
+import os
+import tempfile
+
+from aquda.spacy import docs, neighbours, symspell, wordnet
+from aquda.text import processor, query
+
+from . import fakes
+
+# Number of input queries, and of words with a vector in the synthetic model
+SIZES = [1_000, 10_000, 100_000]
+VOCAB = 20_000
+
+class SpacyAugment(object):
+    params = [['lemma', 'syn-repl', 'spelling'], SIZES]
+    param_names = ['augmentor', 'queries']
+    # Every sample starts with empty synonym caches
+    number = 1
+    repeat = 3
+    timeout = 1200
+
+    def setup(self, augmentor: str, n: int):
+        words = fakes.make_words(VOCAB)
+        self.nlp = fakes.make_nlp(words)
+        self.queries = fakes.make_queries(n, words)
+        if augmentor == 'spelling':
+            self.tmp = tempfile.TemporaryDirectory()
+            symspell.register(self.nlp, symspell.build(self.nlp, self.tmp.name, True))
+        self.aug = processor.SpacyAugmentor({'en': self.nlp}, {query.from_str(augmentor)})
+
+    def teardown(self, augmentor: str, n: int):
+        if augmentor == 'spelling':
+            symspell.clear()
+            self.tmp.cleanup()
+
+    def augment(self):
+        for output in self.aug.process_batch(self.queries, 1, False, True, None):
+            self.aug.records_of(output)
+
+    def time_augment(self, augmentor: str, n: int):
+        self.augment()
+
+    def peakmem_augment(self, augmentor: str, n: int):
+        self.augment()
+
+    def track_queries_per_second(self, augmentor: str, n: int) -> float:
+        return fakes.throughput(self.augment, n)
+    track_queries_per_second.unit = 'queries/s'
+
+class SimilarOf(object):
+    params = [['brute-force', 'index'], [1_000, 10_000]]
+    param_names = ['search', 'tokens']
+    timeout = 600
+
+    def setup(self, search: str, n: int):
+        words = fakes.make_words(VOCAB)
+        self.nlp = fakes.make_nlp(words)
+        self.tokens = words[:n]
+        neighbours.INDEXES.clear()
+        if search == 'index':
+            self.tmp = tempfile.TemporaryDirectory()
+            neighbours.register(self.nlp, neighbours.build(self.nlp, os.path.join(self.tmp.name, 'index'), 10, True))
+
+    def teardown(self, search: str, n: int):
+        neighbours.INDEXES.clear()
+        if search == 'index':
+            self.tmp.cleanup()
+
+    def time_similar_of(self, search: str, n: int):
+        wordnet.similar_of(self.nlp, self.tokens, num = 4)
+
+    def peakmem_similar_of(self, search: str, n: int):
+        wordnet.similar_of(self.nlp, self.tokens, num = 4)
+
+    def track_tokens_per_second(self, search: str, n: int) -> float:
+        return fakes.throughput(lambda: wordnet.similar_of(self.nlp, self.tokens, num = 4), n)
+    track_tokens_per_second.unit = 'tokens/s'
+
+def misspelled(text: str) -> str:
+    tokens = text.split(' ')
+    for i, m in symspell.misspellings(tokens, 1):
+        tokens[i] = m
+    return ' '.join(tokens)
+
+# Spelling variants of parsed queries, half of them misspelled, without the Spacy pipeline.
+# Cold starts with no corrections memoized, warm with those of an earlier pass
+class Spelling(object):
+    params = [['cold', 'warm'], SIZES]
+    param_names = ['memo', 'queries']
+    number = 1
+    repeat = 3
+    timeout = 600
+
+    def setup(self, memo: str, n: int):
+        words = fakes.make_words(VOCAB)
+        self.nlp = fakes.make_nlp(words)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.index = symspell.build(self.nlp, self.tmp.name, True)
+        symspell.register(self.nlp, self.index)
+        texts = [q.original for q in fakes.make_queries(n, words)]
+        self.texts = [t if i % 2 == 0 else misspelled(t) for i, t in enumerate(texts)]
+        self.docs = list(self.nlp.pipe(self.texts))
+        if memo == 'warm':
+            self.spelling()
+
+    def teardown(self, memo: str, n: int):
+        symspell.clear()
+        self.tmp.cleanup()
+
+    def spelling(self):
+        for text, doc in zip(self.texts, self.docs):
+            wordnet.spelling('en', self.nlp, text, doc)
+
+    def run(self, memo: str):
+        if memo == 'cold':
+            self.index.memo.clear()
+        self.spelling()
+
+    def time_spelling(self, memo: str, n: int):
+        self.run(memo)
+
+    def track_queries_per_second(self, memo: str, n: int) -> float:
+        return fakes.throughput(lambda: self.run(memo), n)
+    track_queries_per_second.unit = 'queries/s'
+
+# Parsing queries with the pipeline, or reading them from the doc cache: cold stores them, warm reads them
+class Parse(object):
+    params = [['pipe', 'cold', 'warm'], SIZES]
+    param_names = ['parse', 'queries']
+    number = 1
+    repeat = 3
+    timeout = 600
+
+    def setup(self, parse: str, n: int):
+        words = fakes.make_words(VOCAB)
+        self.nlp = fakes.make_nlp(words)
+        self.texts = [q.original for q in fakes.make_queries(n, words)]
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = docs.path_of(self.tmp.name)
+        if parse == 'warm':
+            self.parse(parse)
+
+    def teardown(self, parse: str, n: int):
+        self.tmp.cleanup()
+
+    def parse(self, parse: str):
+        if parse == 'pipe':
+            for _ in self.nlp.pipe(self.texts):
+                pass
+            return
+        if parse == 'cold' and os.path.exists(self.path):
+            os.remove(self.path)
+        cache = docs.DocCache(self.path)
+        for _ in cache.pipe(self.nlp, self.texts):
+            pass
+        cache.close()
+
+    def time_parse(self, parse: str, n: int):
+        self.parse(parse)
+
+    def track_queries_per_second(self, parse: str, n: int) -> float:
+        return fakes.throughput(lambda: self.parse(parse), n)
+    track_queries_per_second.unit = 'queries/s'
@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+import numpy as np
+import spacy
+from spacy.language import Language
+from spacy.vectors import Vectors
+
+from aquda.text import query, storage
+
+# Offline stand-ins for OpenAI API and Spacy `_lg` models, so that benchmarks
+# need neither network nor downloaded models.
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'be', 'do', 'fu', 'gi', 'ha', 'je', 'po', 'zu']
+
+def make_words(n: int, seed: int = 0) -> list[str]:
+    rng = np.random.default_rng(seed)
+    words = set()
+    while len(words) < n:
+        words.add(''.join(rng.choice(SYLLABLES, size = rng.integers(2, 5))))
+    return sorted(words)
+
+def make_queries(n: int, words: list[str], lang: str = 'en', seed: int = 0) -> list[query.Query]:
+    rng = np.random.default_rng(seed)
+    words = np.array(words)
+    return [query.Query(original = ' '.join(rng.choice(words, size = rng.integers(3, 7))), lang = lang)
+            for _ in range(n)]
+
+def write_queries(path: str, queries: list[query.Query], fmt: str | None = None):
+    with storage.open_writer(path, fmt) as writer:
+        for q in queries:
+            writer.write(q)
+
+# Stands for the tagger and lemmatizer of a real pipeline
+@Language.component('aquda_bench_tagger')
+def bench_tagger(doc: object) -> object:
+    for token in doc:
+        token.tag_ = 'NN'
+        token.lemma_ = token.lower_.rstrip('s')
+    return doc
+
+# A blank pipeline with random unit word vectors for `words`
+def make_nlp(words: list[str], dim: int = 64, lang: str = 'en', seed: int = 0) -> object:
+    nlp = spacy.blank(lang)
+    nlp.add_pipe('aquda_bench_tagger')
+    rng = np.random.default_rng(seed)
+    data = rng.standard_normal((len(words), dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis = 1, keepdims = True)
+    keys = [nlp.vocab.strings.add(w) for w in words]
+    nlp.vocab.vectors = Vectors(strings = nlp.vocab.strings, data = data, keys = keys)
+    nlp.meta['name'] = f'bench_{len(words)}_{dim}'
+    return nlp
+
+# Chat completions of the OpenAI API in the QuerySet/QueryVariantSet schema,
+# served by an in-process HTTP transport so that the real client is exercised
+
+VARIANTS_PER_QUERY = 5
+# Share of the queries asked for which are generated, as the API often returns fewer
+GEN_YIELD = 0.8
+
+def completion_of(request: object) -> dict:
+    body = json.loads(request.content)
+    prompt = body['messages'][-1]['content']
+    schema = body['response_format']['json_schema']['name']
+    if schema == 'QuerySet':
+        num = int(re.search(r'Generate (\d+)', prompt).group(1))
+        # Different prompts give different queries
+        shard = hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:8]
+        content = {'queries': [{'original': f'query {shard} {i}', 'lang': 'en'}
+                               for i in range(int(num * GEN_YIELD))]}
+    elif schema == 'PackedVariantSet':
+        content = {'queries': [{'index': int(i), 'variants': [
+            {'text': f'{original} {j}', 'lang': 'en', 'variant_type': query.VariantType.HYPERNYM.value}
+            for j in range(VARIANTS_PER_QUERY)
+        ]} for i, original in re.findall(r'^\[(\d+)\] "(.*)"$', prompt, re.MULTILINE)]}
+    else:
+        original = re.search(r'from "(.*?)"', prompt).group(1)
+        content = {'queries': [{'original': original, 'lang': 'en', 'variants': [
+            {'text': f'{original} {i}', 'lang': 'en', 'variant_type': query.VariantType.HYPERNYM.value}
+            for i in range(VARIANTS_PER_QUERY)
+        ]}]}
+    return {
+        'id': 'chatcmpl-bench',
+        'object': 'chat.completion',
+        'created': 0,
+        'model': body['model'],
+        'choices': [{
+            'index': 0,
+            'finish_reason': 'stop',
+            'message': {'role': 'assistant', 'content': json.dumps(content)}
+        }],
+        'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(json.dumps(content)) // 4,
+                  'total_tokens': (len(prompt) + len(json.dumps(content))) // 4}
+    }
+
+def create_client(latency: float = 0.0) -> object:
+    import httpx
+    from openai import OpenAI
+
+    def handle(request: object) -> object:
+        time.sleep(latency)
+        return httpx.Response(200, json = completion_of(request))
+
+    return OpenAI(api_key = 'bench', base_url = 'http://bench.invalid/v1', max_retries = 0,
+                  http_client = httpx.Client(transport = httpx.MockTransport(handle)))
+
+def create_async_client(latency: float = 0.0) -> object:
+    import httpx
+    from openai import AsyncOpenAI
+
+    async def handle(request: object) -> object:
+        await asyncio.sleep(latency)
+        return httpx.Response(200, json = completion_of(request))
+
+    return AsyncOpenAI(api_key = 'bench', base_url = 'http://bench.invalid/v1', max_retries = 0,
+                       http_client = httpx.AsyncClient(transport = httpx.MockTransport(handle)))
+
+# Items per second of one call, for asv `track_` benchmarks
+def throughput(call: object, items: int) -> float:
+    start = time.perf_counter()
+    call()
+    return items / (time.perf_counter() - start)
@@ -0,0 +1,56 @@
+import os
+import tempfile
+
+from aquda.cli import engine
+from aquda.text import query, storage
+
+from . import fakes
+
+SIZES = [1_000, 10_000, 100_000]
+EXTENSIONS = {'json': '.json', 'jsonl': '.jsonl', 'columnar': '.cols'}
+
+# Reading and writing query files, as -aug and -merge stream them
+class QueryFiles(object):
+    params = [list(EXTENSIONS), SIZES]
+    param_names = ['format', 'queries']
+    timeout = 600
+
+    def setup(self, fmt: str, n: int):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.queries = fakes.make_queries(n, fakes.make_words(5_000))
+        self.input = os.path.join(self.tmp.name, 'input' + EXTENSIONS[fmt])
+        self.output = os.path.join(self.tmp.name, 'output' + EXTENSIONS[fmt])
+        fakes.write_queries(self.input, self.queries)
+        # Half of the second file repeats the first one
+        self.other = os.path.join(self.tmp.name, 'other' + EXTENSIONS[fmt])
+        fakes.write_queries(self.other, self.queries[:n // 2] + fakes.make_queries(n // 2, fakes.make_words(5_000, seed = 1)))
+
+    def teardown(self, fmt: str, n: int):
+        self.tmp.cleanup()
+
+    def read(self):
+        for _ in storage.read(self.input, query.Query):
+            pass
+
+    def time_read(self, fmt: str, n: int):
+        self.read()
+
+    def peakmem_read(self, fmt: str, n: int):
+        self.read()
+
+    def time_write(self, fmt: str, n: int):
+        fakes.write_queries(self.output, self.queries)
+
+    def time_merge(self, fmt: str, n: int):
+        engine.run_merger(True, False, [self.input, self.other], self.output)
+
+    def peakmem_merge(self, fmt: str, n: int):
+        engine.run_merger(True, False, [self.input, self.other], self.output)
+
+    def track_read_queries_per_second(self, fmt: str, n: int) -> float:
+        return fakes.throughput(self.read, n)
+    track_read_queries_per_second.unit = 'queries/s'
+
+    def track_merge_queries_per_second(self, fmt: str, n: int) -> float:
+        return fakes.throughput(lambda: engine.run_merger(True, False, [self.input, self.other], self.output), 2 * n)
+    track_merge_queries_per_second.unit = 'queries/s'
@@ -0,0 +1,81 @@
+import os
+
+from aquda.openai import agent, shards
+from aquda.text import dedup, processor, query
+
+from . import fakes
+
+SIZES = [1_000, 10_000, 100_000]
+# Seconds the fake API takes to answer a request
+LATENCY = float(os.environ.get('AQUDA_BENCH_LATENCY', '0.005'))
+CONCURRENCY = 64
+
+# Queries per request of the packed mode
+PACK_SIZE = 20
+
+# The request loop of -aug --engine=openai against a fake API
+class OpenAIAugment(object):
+    params = [['sequential', 'concurrent', 'packed'], SIZES]
+    param_names = ['mode', 'queries']
+    number = 1
+    repeat = 1
+    timeout = 3600
+
+    def setup(self, mode: str, n: int):
+        if mode == 'sequential' and n > 10_000:
+            # Hours of latency alone, skipped
+            raise NotImplementedError()
+        os.environ.setdefault(agent.OPENAI_MODEL, 'gpt-bench')
+        self.queries = fakes.make_queries(n, fakes.make_words(5_000))
+        vtypes = {query.VariantType.HYPERNYM}
+        if mode == 'sequential':
+            self.aug = processor.OpenAIAugmentor(fakes.create_client(LATENCY), vtypes, {'en'})
+        elif mode == 'concurrent':
+            self.aug = processor.AsyncOpenAIAugmentor(vtypes, {'en'}, CONCURRENCY, 0,
+                                                      create_client = lambda: fakes.create_async_client(LATENCY))
+        else:
+            self.aug = processor.PackedOpenAIAugmentor(vtypes, {'en'}, CONCURRENCY, 0, PACK_SIZE,
+                                                       create_client = lambda: fakes.create_async_client(LATENCY))
+
+    def augment(self):
+        for completion in self.aug.process_batch(self.queries, 5, False, True, None):
+            self.aug.parse_output(completion)
+
+    def time_augment(self, mode: str, n: int):
+        self.augment()
+
+    def peakmem_augment(self, mode: str, n: int):
+        self.augment()
+
+    def track_queries_per_second(self, mode: str, n: int) -> float:
+        return fakes.throughput(self.augment, n)
+    track_queries_per_second.unit = 'queries/s'
+
+# Sharded -gen against a fake API which returns 80% of the queries asked for
+class OpenAIGenerate(object):
+    params = [SIZES]
+    param_names = ['queries']
+    number = 1
+    repeat = 1
+    timeout = 3600
+
+    def setup(self, n: int):
+        os.environ.setdefault(agent.OPENAI_MODEL, 'gpt-bench')
+
+    def generate(self, n: int) -> int:
+        out = []
+        with dedup.SeenSet() as seen:
+            shards.gen_queries({'en'}, n, 'shoes', 50, CONCURRENCY, shards.default_budget({'en'}, n, 50),
+                               0, False, True, seen, out.append,
+                               create_client = lambda: fakes.create_async_client(LATENCY))
+        return len(out)
+
+    def time_generate(self, n: int):
+        self.generate(n)
+
+    def peakmem_generate(self, n: int):
+        self.generate(n)
+
+    def track_queries_per_second(self, n: int) -> float:
+        return fakes.throughput(lambda: self.generate(n), n)
+    track_queries_per_second.unit = 'queries/s'
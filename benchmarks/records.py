@@ -0,0 +1,79 @@
+import io
+import timeit
+import tracemalloc
+
+from aquda.text import query, records, storage
+
+# Variants of one query, as synonym replacement makes them
+VARIANTS_PER_QUERY = 24
+
+def make_pydantic(n: int) -> list[query.QueryVariant]:
+    out = []
+    for i in range(n):
+        qv = query.QueryVariant(original = f'best gifts for kids {i}', lang = 'en', variants = [])
+        for j in range(VARIANTS_PER_QUERY):
+            qv.variants.append(query.VariantElement(
+                text = f'best gift {j} for kids {i}', lang = 'en', variant_type = query.VariantType.SYN_REPL))
+        out.append(qv)
+    return out
+
+def make_records(n: int) -> list[records.QueryVariant]:
+    out = []
+    for i in range(n):
+        qv = records.QueryVariant(f'best gifts for kids {i}', 'en', [])
+        for j in range(VARIANTS_PER_QUERY):
+            qv.variants.append(records.VariantElement(
+                f'best gift {j} for kids {i}', 'en', query.VariantType.SYN_REPL))
+        out.append(qv)
+    return out
+
+# As written to a JSON Lines file, records without going through pydantic
+def write(made: list[query.QueryVariant | records.QueryVariant]) -> str:
+    f = io.StringIO()
+    with storage.JsonlWriter(f, False) as writer:
+        for record in made:
+            writer.write(record)
+    return f.getvalue()
+
+MAKERS = {
+    'pydantic': make_pydantic,
+    'records': make_records,
+    'pydantic+write': lambda n: write(make_pydantic(n)),
+    'records+write': lambda n: write(make_records(n))
+}
+
+# https://asv.readthedocs.io/en/stable/writing_benchmarks.html#parameterized-benchmarks
+class Variants(object):
+    params = [list(MAKERS), [1_000, 10_000]]
+    param_names = ['representation', 'queries']
+
+    def time_make(self, representation: str, n: int):
+        MAKERS[representation](n)
+
+    def peakmem_make(self, representation: str, n: int):
+        MAKERS[representation](n)
+
+    def track_allocated_bytes(self, representation: str, n: int) -> int:
+        return allocated(MAKERS[representation], n)
+    track_allocated_bytes.unit = 'bytes'
+
+# Bytes still allocated by what `make` returns
+def allocated(make: object, n: int) -> int:
+    tracemalloc.start()
+    try:
+        out = make(n)
+        size, _ = tracemalloc.get_traced_memory()
+        del out
+        return size
+    finally:
+        tracemalloc.stop()
+
+def check(n: int = 10_000, repeat: int = 5):
+    for name, make in MAKERS.items():
+        elapsed = min(timeit.repeat(lambda: make(n), number = 1, repeat = repeat))
+        size = allocated(make, n)
+        print(f'{name:>18}: {n * VARIANTS_PER_QUERY / elapsed:>12,.0f} variants/s, '
+              f'{size / (n * VARIANTS_PER_QUERY):>6.0f} bytes/variant')
+
+if __name__ == '__main__':
+    check()
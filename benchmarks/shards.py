@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from aquda.text import checkpoint
+
+from . import fakes
+
+# Shards of one -aug run go to other processes and machines, each with its own hash seed.
+# The output of a shard must not depend on it, or the merged output would not either
+SEEDS = ['1', '2', '3']
+SHARDS = 2
+QUERIES = 2_000
+VOCAB = 2_000
+
+AUGMENT = '''
+import sys
+from benchmarks import fakes  # registers the pipeline component of the synthetic model
+from aquda.cli import engine
+engine.run_cli(sys.argv[1:])
+'''
+
+# The synthetic model and a spacy.conf pointing to it, in `root`
+def prepare(root: str) -> str:
+    words = fakes.make_words(VOCAB)
+    model = os.path.join(root, 'model')
+    fakes.make_nlp(words).to_disk(model)
+    with open(os.path.join(root, 'spacy.conf'), 'w') as f:
+        json.dump({'langs': {'en': {'model': model}}}, f)
+    path = os.path.join(root, 'input.jsonl')
+    fakes.write_queries(path, fakes.make_queries(QUERIES, words))
+    return path
+
+# Checksum of the output of `shard`, augmented in a fresh interpreter with PYTHONHASHSEED `seed`
+def augment_shard(root: str, input_path: str, shard: int, seed: str) -> str:
+    output = os.path.join(root, f'shard-{shard}-seed-{seed}.jsonl')
+    paths = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.environ.get('PYTHONPATH', '')]
+    env = os.environ | {'PYTHONHASHSEED': seed, 'PYTHONPATH': os.pathsep.join(p for p in paths if p)}
+    subprocess.run([sys.executable, '-c', AUGMENT, '-aug', '--read', input_path, '--write', output,
+                    '-e', 'spacy', '-alemma', '-asyn-repl', '--shard', f'{shard}/{SHARDS}', '-s'],
+                   cwd = root, env = env, check = True, capture_output = True)
+    return checkpoint.load(checkpoint.path_of(output)).output_digest
+
+def check():
+    with tempfile.TemporaryDirectory() as root:
+        input_path = prepare(root)
+        for shard in range(SHARDS):
+            digests = {seed: augment_shard(root, input_path, shard, seed) for seed in SEEDS}
+            print(f'Shard {shard}/{SHARDS}: {digests}')
+            assert len(set(digests.values())) == 1, \
+                f'Output of shard {shard}/{SHARDS} differs by PYTHONHASHSEED: {digests}'
+
+if __name__ == '__main__':
+    check()
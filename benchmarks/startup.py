@@ -0,0 +1,46 @@
+import json
+import subprocess
+import sys
+
+# Modes which use neither Spacy nor OpenAI (e.g. -merge, --help)
+# must import the CLI within this budget (seconds)
+IMPORT_BUDGET = 1.0
+
+# Must not be imported by the CLI until a run mode needs them
+HEAVY_MODULES = ['spacy', 'thinc', 'numpy', 'openai', 'httpx', 'IPython']
+
+IMPORT_CLI = '''
+import json, sys, time
+start = time.perf_counter()
+from aquda.cli import engine
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(sys.modules)}))
+'''
+
+def import_cli() -> dict:
+    # A fresh interpreter, nothing is imported yet
+    out = subprocess.run([sys.executable, '-c', IMPORT_CLI],
+                         check = True, capture_output = True, text = True)
+    return json.loads(out.stdout)
+
+# https://asv.readthedocs.io/en/stable/writing_benchmarks.html#raw-timing-benchmarks
+def timeraw_import_cli() -> str:
+    return 'from aquda.cli import engine'
+
+def time_help():
+    subprocess.run([sys.executable, '-m', 'aquda', '--help'], check = True, capture_output = True)
+
+def track_heavy_modules_imported() -> int:
+    modules = set(import_cli()['modules'])
+    return len([m for m in HEAVY_MODULES if m in modules])
+
+def check(runs: int = 5):
+    results = [import_cli() for _ in range(runs)]
+    elapsed = min(r['elapsed'] for r in results)
+    heavy = [m for m in HEAVY_MODULES if m in results[0]['modules']]
+    print(f'CLI import: {elapsed:.3f}s (budget {IMPORT_BUDGET:.3f}s), heavy modules: {heavy}')
+    assert len(heavy) == 0, f'Heavy modules imported at startup: {heavy}'
+    assert elapsed < IMPORT_BUDGET, f'CLI import took {elapsed:.3f}s, over the budget of {IMPORT_BUDGET:.3f}s'
+
+if __name__ == '__main__':
+    check()
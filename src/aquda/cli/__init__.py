@@ -1 +1,7 @@
-from .engine import run_cli
+# The engine is imported on first use, so that other modules can use
+# e.g. `cli.colour` without importing the whole CLI (and its imports in turn)
+def __getattr__(name: str) -> object:
+    if name == 'run_cli':
+        from .engine import run_cli
+        return run_cli
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
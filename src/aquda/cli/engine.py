@@ -1,29 +1,131 @@
+from __future__ import annotations
+
 import click
-import IPython
+import hashlib
+import itertools
 import os
 import sys
-from pydantic_core import from_json
-from typing import Any
+from typing import Any, TYPE_CHECKING
+
+from . import colour, metrics, run_modes
+from ..openai import cache
+from ..spacy import conf
+from ..text import query, storage, checkpoint, dedup
 
-from . import colour, run_modes
-from ..openai import agent
-from ..text import query, processor
+# Heavy dependencies (openai, spacy, numpy, IPython) are imported
+# only by the run modes which need them, to keep the CLI startup fast
+if TYPE_CHECKING:
+    from ..openai import batch
 
 @click.command()
 @click.option('-gen', is_flag=True, default=False, help='Data generation mode')
 @click.option('-aug', is_flag=True, default=False, help='Data augmentation mode')
 @click.option('-validate', is_flag=True, default=False, help='Data validation mode')
 @click.option('-merge', is_flag=True, default=False, help='Merge 2 or more JSON data files')
+@click.option('-index', is_flag=True, default=False,
+              help='Build and verify the nearest-neighbour index of Spacy word vectors of each language')
+@click.option('-convert', is_flag=True, default=False,
+              help='Convert a query file between formats, e.g. JSON to columnar')
+@click.option('-serve', is_flag=True, default=False,
+              help='Serve -gen, -aug and -validate over HTTP or a Unix socket, with the Spacy models of each language loaded once')
+@click.option('--server', type=str, default=None,
+              help='Address of the server, http://<host>:<port> or unix://<path>. With -serve, the address to listen on '
+                   '(default http://127.0.0.1:8765). With -gen, -aug and -validate, run them on that server instead')
+@click.option('--batch-wait', type=float, default=0.005, show_default=True,
+              help='Seconds a request waits for others to augment them in one Spacy batch of --batch-size. Only used by -serve')
 @click.option('--size', type=int, default=10, help='Size of dataset to generate or augment per language')
 @click.option('--read', type=str, default=None, help='Specify an input query JSON file to process (UTF-8)')
 @click.option('--write', type=str, default=None, help='Specify an output JSON file to write to (UTF-8)')
+@click.option('--read-format', type=click.Choice(storage.FORMATS), default=None,
+              help='Format of the --read file. Defaults to jsonl for *.jsonl files, columnar for *.cols directories, otherwise json')
+@click.option('--write-format', type=click.Choice(storage.FORMATS), default=None,
+              help='Format of the --write file. Defaults to jsonl for *.jsonl files, columnar for *.cols directories, otherwise json')
+@click.option('--resume', is_flag=True, default=False,
+              help='Continue an interrupted -aug run from the manifest next to --write')
+@click.option('--shard', type=str, default=None,
+              help='Augment only shard i of N (0 <= i < N, e.g. 0/4) of the input, selected by a stable hash of '
+                   'the language and text of each query. Merge the outputs of all shards with -merge --sharded. Only used by -aug')
+@click.option('--chunk-size', type=int, default=1000, show_default=True,
+              help='Number of queries read, augmented and written at a time. Only used by -aug and -validate')
 @click.option('--no-prompt-prefix', type=bool, default=False, is_flag=True,
               help='Do not add custom prefix text to my topic. Only used by -gen')
-@click.option('-e', '--engine', type=click.Choice(['openai', 'spacy']), 
+@click.option('-e', '--engine', type=click.Choice(['openai', 'spacy', 'hybrid']), 
               default='spacy',
-              help='Augmentation engine to use.' )
+              help='Augmentation engine to use. Hybrid runs the augmentors Spacy supports locally, '
+                   'and only the others with OpenAI.' )
 @click.option('-a', '--augmentor', multiple=True, type=click.Choice(query.PARAMS), 
               default=['lemma'], help='A linguistic technique to use for data augmentation.')
+@click.option('--batch-size', type=int, default=256, show_default=True,
+              help='Number of queries per batch streamed through the Spacy pipeline. Only used by -aug')
+@click.option('--n-process', type=int, default=1, show_default=True,
+              help='Number of processes for the Spacy pipeline (-1 for all cores). Only used by -aug')
+@click.option('--workers', type=int, default=0, show_default=True,
+              help='Number of worker processes per language, each with a warm Spacy model '
+                   'sharing the word vectors (0 to run in this process). Only used by -aug with --engine=spacy, '
+                   'and by -validate as the total number of worker processes')
+@click.option('--concurrency', type=int, default=1, show_default=True,
+              help='Maximum number of OpenAI requests in flight. Only used by -gen, and -aug with --engine=openai')
+@click.option('--max-retries', type=int, default=5, show_default=True,
+              help='Retries of a rate-limited or failed OpenAI request. Only used by -gen, and -aug with --concurrency > 1')
+@click.option('--pack-size', type=int, default=1, show_default=True,
+              help='Number of queries augmented per OpenAI request (1 to send each on its own). '
+                   'Queries left out of an answer are sent again in smaller packs. Only used by -aug with --engine=openai, not with --batch')
+@click.option('--shard-size', type=int, default=50, show_default=True,
+              help='Number of queries asked for per request, --size is split into as many requests as needed. Only used by -gen')
+@click.option('--max-requests', type=int, default=0, show_default=True,
+              help='Maximum number of requests to reach --size in all languages, '
+                   'as some return fewer queries or duplicates (0 for twice the number of shards, plus 2 per language). Only used by -gen')
+@click.option('--batch', 'use_batch', is_flag=True, default=False,
+              help='Use OpenAI Batch API (50% cheaper, completes within 24h). Requests are split into batches '
+                   'of up to 50,000 requests and 200 MB. The completion cache is not used, and -aug keeps no manifest '
+                   'for --resume, resume with --batch-id instead. Only used by -gen and -aug')
+@click.option('--batch-id', type=str, default=None,
+              help='Resume polling and collecting submitted batches (comma-separated IDs, as printed on submission) '
+                   'instead of submitting new ones. Implies --batch')
+@click.option('--batch-transport', type=click.Choice(['openai', 'local']), default='openai', show_default=True,
+              help='Where to run the batch. `local` sends requests one by one to OPENAI_BASE_URL')
+@click.option('--batch-dir', type=str, default='.aquda-batches', show_default=True,
+              help='Directory to keep batches of the `local` transport')
+@click.option('--poll-interval', type=float, default=30, show_default=True,
+              help='Seconds between batch status checks')
+@click.option('--cache-dir', type=str, default=cache.DEFAULT_DIR, show_default=True,
+              help='Directory of the on-disk caches of OpenAI completions and of parsed queries')
+@click.option('--no-cache', is_flag=True, default=False,
+              help='Always call OpenAI API, do not read or write cached completions')
+@click.option('--cache-max-mb', type=float, default=1024, show_default=True,
+              help='Evict least recently used completions when the cache grows beyond this size')
+@click.option('--cache-max-age-days', type=float, default=30, show_default=True,
+              help='Evict completions older than this')
+@click.option('--doc-cache', is_flag=True, default=False,
+              help='Keep the queries parsed by Spacy in --cache-dir, to parse each query only once across runs. '
+                   'Only used by -aug with --engine=spacy or hybrid')
+@click.option('--synonym-cache-size', type=int, default=conf.SYNONYM_CACHE_SIZE, show_default=True,
+              help='Number of tokens per language to keep synonyms of in memory. Only used by -asyn-repl')
+@click.option('--index-type', type=click.Choice(['neighbours', 'synsets', 'spelling']), multiple=True,
+              default=['neighbours'], show_default=True,
+              help='Index to build: nearest neighbours of word vectors (for -asyn-repl), '
+                   'WordNet hypernyms and hyponyms (for -ahypernym and -ahyponym with --engine=spacy), '
+                   'or symmetric deletes of the model vocabulary (for -aspelling with --engine=spacy). Only used by -index')
+@click.option('--top-k', type=int, default=10, show_default=True,
+              help='Number of nearest neighbours to keep per word vector. Only used by -index')
+@click.option('--index-block', type=int, default=256, show_default=True,
+              help='Number of word vectors compared with all others at a time when building the neighbour index. '
+                   'Peak memory grows with it, by 12 bytes per vector of the model for each one. Only used by -index')
+@click.option('--verify', type=int, default=100, show_default=True,
+              help='Number of random word vectors to check against brute-force search (0 to skip). Only used by -index')
+@click.option('--similarity', type=float, default=0.8, show_default=True,
+              help='Minimum estimated Jaccard similarity of character shingles of near-duplicates. Only used by -validate')
+@click.option('--report', type=str, default=None,
+              help='Write the validation report to this JSON file. Only used by -validate')
+@click.option('--metrics-out', type=str, default=None,
+              help='Write timings, counters, token usage and estimated cost of the run to this JSON file')
+@click.option('--profile', type=str, default=None,
+              help='Profile the run with cProfile and dump the stats to this file. Worker processes are not profiled')
+@click.option('--keep-duplicates', is_flag=True, default=False,
+              help='Keep queries with the same language and text as an earlier one. Only used by -merge')
+@click.option('--sharded', is_flag=True, default=False,
+              help='Merge the outputs of all shards of one -aug --shard run, in shard order, after checking their manifests. '
+                   'Only used by -merge')
 @click.option('-m', '--minput', type=str, default=[], multiple=True,
               help='Specify files to read and merge. Must be multiple.')
 @click.option('-t', '--topic', default='sport', help='Context or topic to generate queries')
@@ -33,41 +135,113 @@ from ..text import query, processor
               multiple=True,
               help='Language to process')
 def run_cli(
-    gen: bool, aug: bool, validate: bool, merge: bool,
+    gen: bool, aug: bool, validate: bool, merge: bool, index: bool, convert: bool, serve: bool,
+    server: str | None,
+    batch_wait: float,
     lang: list[str], silence: bool,
     topic: str,
     read: str | None,
     write: str | None,
+    read_format: str | None,
+    write_format: str | None,
+    chunk_size: int,
+    resume: bool,
+    shard: str | None,
     minput: list[str],
     engine: str,
     augmentor: list[str],
     debug: bool,
     size: int,
-    no_prompt_prefix: bool) -> int:
-    run_mode = get_run_mode(gen, aug, validate, merge)
-
-    lang = set(lang)
-    augmentor = set(map(query.from_str, augmentor))
-
+    no_prompt_prefix: bool,
+    batch_size: int,
+    n_process: int,
+    workers: int,
+    concurrency: int,
+    max_retries: int,
+    pack_size: int,
+    shard_size: int,
+    max_requests: int,
+    use_batch: bool,
+    batch_id: str | None,
+    batch_transport: str,
+    batch_dir: str,
+    poll_interval: float,
+    cache_dir: str,
+    no_cache: bool,
+    cache_max_mb: float,
+    cache_max_age_days: float,
+    doc_cache: bool,
+    synonym_cache_size: int,
+    index_type: list[str],
+    top_k: int,
+    index_block: int,
+    verify: int,
+    keep_duplicates: bool,
+    sharded: bool,
+    similarity: float,
+    report: str | None,
+    metrics_out: str | None,
+    profile: str | None) -> int:
+    run_mode = get_run_mode(gen, aug, validate, merge, index, convert, serve)
     if run_mode == run_modes.RunMode.UNKNOWN:
         return -1
-    elif run_mode == run_modes.RunMode.GENERATOR:
-        return run_generator(lang, silence, debug, size, topic, write, no_prompt_prefix)
-    elif run_mode == run_modes.RunMode.AUGMENTOR:
-        # Only translation with LLM takes language parameter
-        if 'transl' not in augmentor or engine != 'openai':
-            print(f'{colour.HIGHLIGHTED_GREY_LIGHT}WARNING:{colour.DEFAULT} Language parameter will be ignored. The languages from the input query dataset will be used.')
-        return run_augmentor(silence, debug, size, read, write, engine, augmentor, lang)
-    elif run_mode == run_modes.RunMode.VALIDATOR:
-        return run_validator(lang, silence, debug)
-    elif run_mode == run_modes.RunMode.MERGER:
-        return run_merger(silence, debug, minput, write)
-    return 0
+    # Timings and the profile cover the whole run, also when it fails
+    with metrics.recording(metrics_out, profile, silence, run_mode.name):
+        lang = set(lang)
+        if server is not None and run_mode in run_modes.REMOTE:
+            if resume or use_batch or batch_id is not None or shard is not None:
+                raise ValueError('--resume, --batch and --shard are not supported with --server')
+            return run_client(run_mode, server, silence, size, topic, lang, read, write, engine,
+                              list(augmentor), no_prompt_prefix, read_format, write_format, chunk_size,
+                              shard_size, max_requests, report, similarity)
+        augmentor = set(map(query.from_str, augmentor))
+        transport, batch_ids = None, None
+        if use_batch or batch_id is not None:
+            from ..openai import batch
+            transport = batch.create_transport(batch_transport, batch_dir)
+            batch_ids = batch.parse_ids(batch_id) if batch_id is not None else None
+        uses_openai = run_mode in {run_modes.RunMode.GENERATOR, run_modes.RunMode.SERVER} or \
+            (run_mode == run_modes.RunMode.AUGMENTOR and engine in {'openai', 'hybrid'})
+        completion_cache = cache.create(cache_dir, cache_max_mb, cache_max_age_days) \
+            if uses_openai and not no_cache else None
+        if completion_cache is not None:
+            metrics.add_source('completion_cache', completion_cache.stats)
+
+        if run_mode == run_modes.RunMode.GENERATOR:
+            return run_generator(lang, silence, debug, size, topic, write, no_prompt_prefix,
+                                 transport, batch_ids, poll_interval, completion_cache, write_format,
+                                 shard_size, concurrency, max_requests, max_retries)
+        elif run_mode == run_modes.RunMode.AUGMENTOR:
+            # Only translation with LLM takes language parameter
+            if query.VariantType.TRANSL not in augmentor or engine == 'spacy':
+                print(f'{colour.HIGHLIGHTED_GREY_LIGHT}WARNING:{colour.DEFAULT} Language parameter will be ignored. The languages from the input query dataset will be used.')
+            return run_augmentor(silence, debug, size, read, write, engine, augmentor, lang,
+                                 batch_size, n_process, workers, concurrency, max_retries,
+                                 transport, batch_ids, poll_interval, completion_cache,
+                                 read_format, write_format, chunk_size, resume, synonym_cache_size,
+                                 pack_size, cache_dir if doc_cache else None,
+                                 checkpoint.parse_shard(shard) if shard is not None else None)
+        elif run_mode == run_modes.RunMode.VALIDATOR:
+            return run_validator(silence, debug, read, write, report, similarity, workers,
+                                 read_format, write_format, chunk_size)
+        elif run_mode == run_modes.RunMode.MERGER:
+            if sharded:
+                return run_shard_merger(silence, minput, write, write_format)
+            return run_merger(silence, debug, minput, write, read_format, write_format, keep_duplicates)
+        elif run_mode == run_modes.RunMode.INDEXER:
+            return run_indexer(lang, silence, top_k, write, verify, set(index_type), index_block)
+        elif run_mode == run_modes.RunMode.CONVERTER:
+            return run_converter(silence, read, write, read_format, write_format)
+        elif run_mode == run_modes.RunMode.SERVER:
+            return run_server(lang, silence, server, batch_size, batch_wait, concurrency, max_retries,
+                              pack_size, completion_cache, synonym_cache_size)
+        return 0
 
-def get_run_mode(gen: bool, aug: bool, validate: bool, merge: bool) -> run_modes.RunMode:
+def get_run_mode(gen: bool, aug: bool, validate: bool, merge: bool,
+                 index: bool = False, convert: bool = False, serve: bool = False) -> run_modes.RunMode:
     # One and only mode must be true
-    if sum([gen, aug, validate, merge]) != 1:
-        sys.stderr.write(f'{colour.RED}ERROR: Run mode must be one of [-gen, -aug, -validate, -merge]{colour.DEFAULT}')
+    if sum([gen, aug, validate, merge, index, convert, serve]) != 1:
+        sys.stderr.write(f'{colour.RED}ERROR: Run mode must be one of [-gen, -aug, -validate, -merge, -index, -convert, -serve]{colour.DEFAULT}')
         return run_modes.RunMode.UNKNOWN
     if gen:
         return run_modes.RunMode.GENERATOR
@@ -77,78 +251,249 @@ def get_run_mode(gen: bool, aug: bool, validate: bool, merge: bool) -> run_modes
         return run_modes.RunMode.VALIDATOR
     if merge:
         return run_modes.RunMode.MERGER
+    if index:
+        return run_modes.RunMode.INDEXER
+    if convert:
+        return run_modes.RunMode.CONVERTER
+    if serve:
+        return run_modes.RunMode.SERVER
 
 def run_generator(lang: list[str], silence: bool, debug: bool, size: int, 
                   topic: str, output_path: str | None,
-                  no_prompt_prefix: bool) -> query.QuerySet:
-    client = agent.create()
+                  no_prompt_prefix: bool,
+                  transport: batch.Transport | None = None,
+                  batch_ids: list[str] | None = None,
+                  poll_interval: float = 30,
+                  completion_cache: cache.CompletionCache | None = None,
+                  write_format: str | None = None,
+                  shard_size: int = 50,
+                  concurrency: int = 1,
+                  max_requests: int = 0,
+                  max_retries: int = 5) -> int:
+    from ..openai import agent, batch, shards
+
     if not silence:
         print(f'Model to use: {os.environ.get(agent.OPENAI_MODEL)}')
         print(f'Generating {size} queries in {lang}')
 
-    completion = agent.gen_queries(client, lang, size, topic, debug, silence, no_prompt_prefix)
-    # taotodo handle failure
-    out = completion.choices[0].message.parsed
+    if transport is not None:
+        failed = []
+        out = batch.gen_queries(transport, lang, size, topic, debug, silence, no_prompt_prefix, failed,
+                                batch_ids, poll_interval)
+        if debug:
+            print(f'{colour.CYAN}Running run_generator, try inspecting out{colour.DEFAULT}')
+            import IPython
+            IPython.embed()
+        # Written to stdout without output path
+        with storage.open_writer(output_path, write_format) as writer:
+            for q in out.queries:
+                writer.write(q)
+        metrics.count('gen.queries', writer.count)
+        batch.check_failed(failed, output_path)
+        return writer.count
+
+    budget = max_requests if max_requests > 0 else shards.default_budget(lang, size, shard_size)
+    if not silence:
+        print(f'Up to {budget} requests of {shard_size} queries, {concurrency} at a time')
+
+    # Queries are written as they arrive, the keys of those written so far are kept on disk.
+    # Progress is not shown when the queries go to stdout
+    tmp_dir = os.path.dirname(os.path.abspath(os.path.expanduser(output_path))) \
+        if output_path is not None else None
+    with storage.open_writer(output_path, write_format) as writer, \
+         dedup.SeenSet(tmp_dir = tmp_dir) as seen:
+        targets = shards.gen_queries(lang, size, topic, shard_size, concurrency, budget, max_retries,
+                                     no_prompt_prefix, silence or output_path is None, seen,
+                                     writer.write, completion_cache)
+    metrics.count('gen.queries', writer.count)
+
+    for t in targets:
+        if t.accepted < t.size:
+            print(f'{colour.HIGHLIGHTED_GREY_LIGHT}WARNING:{colour.DEFAULT} Only {t.accepted} of {t.size} queries '
+                  f'in {t.lang} within {budget} requests, raise --max-requests for more')
     if debug:
-        print(f'{colour.CYAN}Running run_generator, try inspecting out{colour.DEFAULT}')
+        print(f'{colour.CYAN}Running run_generator, try inspecting targets{colour.DEFAULT}')
+        import IPython
         IPython.embed()
-    
-    # JSONify the response
-    out_json = out.model_dump_json(indent = 2)
-    print(out_json)
-    if output_path is not None:
-        output_path = os.path.expanduser(output_path)
-        with open(output_path, 'w') as f:
-            f.write(out_json)
-    return out
+    if completion_cache is not None and not silence:
+        completion_cache.print_stats()
+    return writer.count
 
 def run_augmentor(silence: bool, debug: bool, size: int, 
                   input_path: str, output_path: str | None, 
                   engine: str, augmentor: set[query.VariantType],
-                  lang: list[str] | None) -> query.QuerySet:
+                  lang: list[str] | None,
+                  batch_size: int = 256, n_process: int = 1,
+                  workers: int = 0,
+                  concurrency: int = 1, max_retries: int = 5,
+                  transport: batch.Transport | None = None,
+                  batch_ids: list[str] | None = None,
+                  poll_interval: float = 30,
+                  completion_cache: cache.CompletionCache | None = None,
+                  read_format: str | None = None,
+                  write_format: str | None = None,
+                  chunk_size: int = 1000,
+                  resume: bool = False,
+                  synonym_cache_size: int = conf.SYNONYM_CACHE_SIZE,
+                  pack_size: int = 1,
+                  doc_cache_dir: str | None = None,
+                  shard: tuple[int, int] | None = None) -> int:
     input_path = os.path.expanduser(input_path)
 
     if not os.path.exists(input_path):
         raise FileNotFoundError(f'File not found: {input_path}')
     if not silence:
         print(f'Augmenting query file: {input_path} with {engine}')
-    
-    with open(input_path, 'r') as f:
-        qs = query.QuerySet.model_validate(from_json(f.read()))
 
     # Collect all available languages of the input queries
-    # and create augmentator of all those
-    input_langs = set(map(lambda q: q.lang, qs.queries))
+    # and create augmentator of all those.
+    # The input is streamed, this first pass only keeps the languages
+    input_langs = set(q.lang for q in storage.read(input_path, query.Query, read_format))
     if not silence:
         print(f'Languages to use: {input_langs}')
 
-    aug = processor.get(engine, augmentor, input_langs, silence)
-
     if debug:
-        print(f'{colour.CYAN}Running run_augmentor, try inspecting qs{colour.DEFAULT}')
+        print(f'{colour.CYAN}Running run_augmentor, try inspecting input_langs{colour.DEFAULT}')
+        import IPython
         IPython.embed()
 
-    # Process each query
-    qvs = query.QueryVariantSet(queries = [])
-    for q in qs.queries:
-        completion = aug.process(q, size, debug, silence, lang)
-        out = aug.parse_output(completion)
-        if debug:
-            print(f'{colour.CYAN}Augmenting query: {colour.DEFAULT}{q}')
-            IPython.embed()
-        qvs.queries += out.queries 
+    if shard is not None and output_path is None:
+        raise ValueError('Requiring an output path via `--write` argument for the output of the shard.')
 
-    out_json = qvs.model_dump_json(indent = 2)
-    print(out_json)
+    if transport is not None:
+        from ..openai import batch
+        if shard is not None:
+            raise ValueError('--shard is not supported with --batch')
+        if engine != 'openai':
+            raise ValueError(f'Batch API is only available with --engine=openai (Got {engine} instead)')
+        # Batches are resumed by their IDs instead of the manifest,
+        # and their requests do not go through the completion cache
+        if resume:
+            raise ValueError('--resume is not supported with --batch, resume with --batch-id instead')
+        failed = []
+        with storage.open_writer(output_path, write_format) as writer:
+            queries = storage.read(input_path, query.Query, read_format)
+            for qv in batch.augment_queries(transport, queries, augmentor, size, debug, silence, lang, failed,
+                                            batch_ids, poll_interval):
+                metrics.count('augment.variants', len(qv.variants))
+                writer.write(qv)
+        batch.check_failed(failed, output_path)
+        return writer.count
 
-    if output_path is not None:
-        output_path = os.path.expanduser(output_path)
-        with open(output_path, 'w') as f:
-            f.write(out_json)
+    # The manifest keeps track of the committed chunks of the output
+    manifest = None
+    manifest_path = checkpoint.path_of(output_path) if output_path is not None else None
+    if manifest_path is not None:
+        manifest = checkpoint.create(input_path, engine, augmentor, size,
+                                     storage.format_of(output_path, write_format),
+                                     *(shard or (0, 1)),
+                                     models_of(engine, input_langs) if shard is not None else None)
+    if resume:
+        if manifest_path is None:
+            raise ValueError('Requiring an output path via `--write` argument to resume.')
+        committed = checkpoint.load(manifest_path)
+        if committed is not None:
+            checkpoint.check(committed, manifest)
+            manifest = committed
+        if manifest.complete:
+            if not silence:
+                print(f'{colour.CYAN}Already complete:{colour.DEFAULT} {output_path}')
+            return manifest.records
+        if not silence:
+            print(f'{colour.CYAN}Resuming after {manifest.queries} queries:{colour.DEFAULT} {output_path}')
+
+    inputs = storage.read(input_path, query.Query, read_format)
+    if shard is not None:
+        # Only the queries of the shard, all others are read past
+        source = checkpoint.ShardReader(inputs, *shard)
+        inputs = iter(source)
+    digest = hashlib.sha256()
+    if resume and manifest.queries > 0:
+        # Skip the finished queries, they must be the same as when committed
+        for q in itertools.islice(inputs, manifest.queries):
+            checkpoint.update(digest, q)
+        if digest.hexdigest() != manifest.digest:
+            raise ValueError(f'Cannot resume, the input has changed since the checkpoint: {input_path}')
+        writer = storage.open_writer(output_path, write_format, manifest.offset, manifest.records)
+    else:
+        # Written to stdout without output path
+        writer = storage.open_writer(output_path, write_format)
+
+    doc_cache_path = None
+    if doc_cache_dir is not None and engine in {'spacy', 'hybrid'}:
+        from ..spacy import docs
+        doc_cache_path = docs.path_of(doc_cache_dir)
+
+    with writer:
+        from ..text import processor
+        aug = processor.get(engine, augmentor, input_langs, silence, concurrency, max_retries,
+                            completion_cache, synonym_cache_size, workers, pack_size,
+                            doc_cache_path = doc_cache_path)
+        if engine in {'spacy', 'hybrid'} and workers == 0:
+            from ..spacy import wordnet
+            metrics.add_source('synonym_caches', wordnet.cache_stats)
+
+        # Worker pools of the augmentor are shut down also when a chunk fails
+        try:
+            # Process queries chunk by chunk, outputs come in the same order as the input
+            for chunk in itertools.batched(inputs, chunk_size):
+                chunk = list(chunk)
+                with metrics.timer('augment.process_batch'):
+                    completions = aug.process_batch(chunk, size, debug, silence, lang,
+                                                    batch_size=batch_size, n_process=n_process)
+                metrics.count('augment.queries', len(chunk))
+                for q, completion in zip(chunk, completions):
+                    out = aug.records_of(completion)
+                    if debug:
+                        print(f'{colour.CYAN}Augmenting query: {colour.DEFAULT}{q}')
+                        import IPython
+                        IPython.embed()
+                    for qv in out:
+                        metrics.count('augment.variants', len(qv.variants))
+                        writer.write(qv)
+                    checkpoint.update(digest, q)
+
+                if manifest is None:
+                    writer.flush()
+                    continue
+                # Commit the chunk, only then it is skipped when resuming
+                manifest.offset = writer.sync()
+                manifest.queries += len(chunk)
+                manifest.records = writer.count
+                manifest.digest = digest.hexdigest()
+                checkpoint.save(manifest, manifest_path)
+        finally:
+            aug.close()
+
+    if manifest is not None:
+        if shard is not None:
+            manifest.source_queries = source.count
+            manifest.source_digest = source.digest.hexdigest()
+            manifest.output_digest = checkpoint.checksum_of(output_path)
+            if not silence:
+                print(f'{colour.CYAN}Shard {shard[0]}/{shard[1]}:{colour.DEFAULT} '
+                      f'{manifest.queries} of {source.count} queries')
+        manifest.complete = True
+        checkpoint.save(manifest, manifest_path)
+
+    if engine in {'spacy', 'hybrid'} and not silence:
+        from ..spacy import wordnet
+        for lng, stats in wordnet.cache_stats().items():
+            print(f'{colour.CYAN}Synonym cache [{lng}]:{colour.DEFAULT} {stats["hits"]} hits, '
+                  f'{stats["misses"]} misses, {stats["evictions"]} evicted, {stats["size"]}/{stats["maxsize"]} tokens')
 
-    return qvs
+    packed = aug.remote if isinstance(aug, processor.HybridAugmentor) else aug
+    if isinstance(packed, processor.PackedOpenAIAugmentor) and not silence:
+        packed.print_stats()
+    if doc_cache_path is not None and not silence:
+        docs.print_stats(doc_cache_path)
+    if completion_cache is not None and not silence:
+        completion_cache.print_stats()
+    return writer.count
 
-def run_merger(silence: bool, debug: bool, minput: list[str], write: str | None):
+def run_merger(silence: bool, debug: bool, minput: list[str], write: str | None,
+               read_format: str | None = None, write_format: str | None = None,
+               keep_duplicates: bool = False) -> int:
     if minput is None or len(minput) < 2:
         raise ValueError('Requiring 2 or more files to read from (via `-m` or `--merge` argument).')
     
@@ -159,23 +504,242 @@ def run_merger(silence: bool, debug: bool, minput: list[str], write: str | None)
         print(f'{colour.CYAN}Merging files:{colour.DEFAULT} {', '.join(minput)}')
         print(f'{colour.CYAN}and write into:{colour.DEFAULT} {write}')
 
-    merged = None
-    for path in minput:
-        with open(path, 'r') as f:
-            q = query.QuerySet.model_validate(from_json(f.read()))
-            if not silence:
-                print(f'Merging {len(q.queries)} queries')
-            if merged is None:
-                merged = q
-            else:
-                merged.queries += q.queries
-    
+    # Inputs are streamed one after another, the first occurrence of a query is kept.
+    # Keys of the queries seen so far are kept on disk next to the output
     path = os.path.expanduser(write)
-    with open(path, 'w') as f:
-        f.write(merged.model_dump_json(indent = 2))
+    with storage.open_writer(path, write_format) as writer, \
+         dedup.SeenSet(tmp_dir = os.path.dirname(os.path.abspath(path))) as seen:
+        for input_path in minput:
+            read, duplicates = 0, 0
+            for q in storage.read(input_path, query.Query, read_format):
+                read += 1
+                if not seen.add(q):
+                    duplicates += 1
+                    if not keep_duplicates:
+                        continue
+                writer.write(q)
+            seen.commit()
+            metrics.count('merge.queries', read)
+            metrics.count('merge.duplicates', duplicates)
+            if not silence:
+                print(f'Merging {read} queries from {input_path}, {duplicates} duplicates ' + \
+                      ('kept' if keep_duplicates else 'dropped'))
     
     if not silence:
-        print(f'Merged output written to {path}')
+        print(f'Merged {writer.count} queries into {path}')
+    return writer.count
+
+# Spacy model of each language, and the OpenAI model, which the engine augments with
+def models_of(engine: str, langs: set[str]) -> dict[str, str]:
+    models = dict()
+    if engine in {'spacy', 'hybrid'}:
+        config = conf.load()
+        models |= {lng: config.langs[lng].model for lng in sorted(langs)}
+    if engine in {'openai', 'hybrid'}:
+        from ..openai import agent
+        models['openai'] = agent.get_model()
+    return models
+
+# Outputs of all shards of one -aug --shard run, concatenated in shard order
+def run_shard_merger(silence: bool, minput: list[str], write: str | None,
+                     write_format: str | None = None) -> int:
+    if minput is None or len(minput) < 1:
+        raise ValueError('Requiring the outputs of all shards to read from (via `-m` or `--merge` argument).')
+    if write is None:
+        raise ValueError('Requiring an output path via `--write` argument.')
+
+    shards = checkpoint.check_shards(minput)
+    if not silence:
+        print(f'{colour.CYAN}Merging {len(shards)} shards of {shards[0][1].source_queries} queries '
+              f'into:{colour.DEFAULT} {write}')
+
+    with storage.open_writer(write, write_format) as writer:
+        for path, manifest in shards:
+            read = 0
+            for r in storage.read(path, query.Record, manifest.format):
+                read += 1
+                writer.write(r.output(r.variants))
+            if read != manifest.records:
+                raise ValueError(f'Shard {manifest.shard} holds {read} records, {manifest.records} in its manifest: {path}')
+            metrics.count('merge.queries', read)
+            if not silence:
+                print(f'Merging {read} records of shard {manifest.shard} from {path}')
+
+    if not silence:
+        print(f'Merged {writer.count} records into {write}')
+    return writer.count
+
+def run_converter(silence: bool, input_path: str | None, output_path: str | None,
+                  read_format: str | None = None, write_format: str | None = None) -> int:
+    if input_path is None or output_path is None:
+        raise ValueError('Requiring an input path via `--read` and an output path via `--write` argument.')
+    input_format = storage.format_of(input_path, read_format)
+    output_format = storage.format_of(output_path, write_format)
+    if not silence:
+        print(f'{colour.CYAN}Converting {input_format}:{colour.DEFAULT} {input_path}')
+        print(f'{colour.CYAN}into {output_format}:{colour.DEFAULT} {output_path}')
+
+    # Queries and queries with variants are written back as the same kind
+    with storage.open_writer(output_path, output_format) as writer:
+        for r in storage.read(input_path, query.Record, input_format):
+            writer.write(r.output(r.variants))
+
+    if not silence:
+        print(f'Converted {writer.count} queries')
+    return writer.count
+
+def run_indexer(lang: set[str], silence: bool, top_k: int,
+                output_path: str | None, verify: int,
+                index_types: set[str] | None = None, block: int = 256):
+    index_types = index_types or {'neighbours'}
+    config = conf.load()
+    if 'synsets' in index_types:
+        run_synset_indexer(lang, silence, output_path, config)
+    if not index_types & {'neighbours', 'spelling'}:
+        return
+
+    from ..spacy import neighbours, wordnet
+    for lng in sorted(lang):
+        model = config.langs[lng].model
+        nlp = wordnet.create(model, silence)
+        if 'spelling' in index_types:
+            run_spelling_indexer(lng, nlp, silence, output_path, config)
+        if 'neighbours' not in index_types:
+            continue
+
+        # --write is the parent directory of the indexes, one per model
+        if output_path is not None:
+            path = os.path.join(os.path.expanduser(output_path), model)
+        else:
+            path = os.path.expanduser(config.langs[lng].neighbours or neighbours.default_path(model))
+
+        if not silence:
+            print(f'{colour.CYAN}Building neighbour index of {model}:{colour.DEFAULT} {path}')
+        index = neighbours.build(nlp, path, top_k, silence, block)
+
+        if verify > 0:
+            recall = neighbours.verify(nlp, index, top_k, verify)
+            print(f'{colour.CYAN}Recall@{top_k} of {model} on {verify} vectors:{colour.DEFAULT} {recall:.4f}')
+        if output_path is not None:
+            print(f'Set "neighbours": "{path}" to language "{lng}" in spacy.conf to use the index')
+
+def run_spelling_indexer(lng: str, nlp: object, silence: bool, output_path: str | None,
+                         config: conf.Conf):
+    from ..spacy import symspell
+
+    model = config.langs[lng].model
+    # --write is the parent directory of the indexes, one per model
+    if output_path is not None:
+        path = os.path.join(os.path.expanduser(output_path), 'spelling', os.path.basename(os.path.normpath(model)))
+    else:
+        path = os.path.expanduser(config.langs[lng].spelling or symspell.default_path(model))
+
+    if not silence:
+        print(f'{colour.CYAN}Building spelling index of {model}:{colour.DEFAULT} {path}')
+    symspell.build(nlp, path, silence)
+    if output_path is not None:
+        print(f'Set "spelling": "{path}" to language "{lng}" in spacy.conf to use the index')
+
+def run_synset_indexer(lang: set[str], silence: bool, output_path: str | None, config: conf.Conf):
+    from ..spacy import synsets
+
+    for lng in sorted(lang):
+        # --write is the parent directory of the indexes, one per language
+        if output_path is not None:
+            path = os.path.join(os.path.expanduser(output_path), lng)
+        elif lng in config.langs:
+            path = os.path.expanduser(config.langs[lng].synsets or synsets.default_path(lng))
+        else:
+            path = synsets.default_path(lng)
 
-def run_validator(lang: list[str], silence: bool, debug: bool, size: int):
-    pass
\ No newline at end of file
+        if not silence:
+            print(f'{colour.CYAN}Building WordNet index of {lng}:{colour.DEFAULT} {path}')
+        synsets.build(lng, path, silence)
+        if output_path is not None:
+            print(f'Set "synsets": "{path}" to language "{lng}" in spacy.conf to use the index')
+
+def run_server(lang: set[str], silence: bool, address: str | None, batch_size: int, batch_wait: float,
+               concurrency: int, max_retries: int, pack_size: int,
+               completion_cache: cache.CompletionCache | None = None,
+               synonym_cache_size: int = conf.SYNONYM_CACHE_SIZE) -> int:
+    from ..server import app, protocol
+
+    service = app.Service(lang, silence, batch_size, batch_wait, concurrency, max_retries, pack_size,
+                          completion_cache, synonym_cache_size)
+    app.serve(address or protocol.DEFAULT_ADDRESS, service, silence)
+    if completion_cache is not None and not silence:
+        completion_cache.print_stats()
+    return 0
+
+# -gen, -aug and -validate on the server at `address`, the files are read and written here
+def run_client(run_mode: run_modes.RunMode, address: str, silence: bool, size: int, topic: str,
+               lang: set[str], input_path: str | None, output_path: str | None, engine: str,
+               augmentors: list[str], no_prompt_prefix: bool,
+               read_format: str | None = None, write_format: str | None = None, chunk_size: int = 1000,
+               shard_size: int = 50, max_requests: int = 0,
+               report_path: str | None = None, similarity: float = 0.8) -> int:
+    from ..server import client
+
+    if run_mode == run_modes.RunMode.GENERATOR:
+        return client.generate_file(address, silence, size, topic, sorted(lang), output_path, no_prompt_prefix,
+                                    write_format, shard_size, max_requests)
+    elif run_mode == run_modes.RunMode.AUGMENTOR:
+        if input_path is None:
+            raise ValueError('Requiring an input path via `--read` argument.')
+        # Only translation takes the language parameter, the languages of the queries are used otherwise
+        return client.augment_file(address, silence, size, input_path, output_path, engine, augmentors,
+                                   sorted(lang) if 'transl' in augmentors else None,
+                                   read_format, write_format, chunk_size)
+    elif run_mode == run_modes.RunMode.VALIDATOR:
+        return client.validate_file(address, silence, input_path, output_path, report_path, similarity,
+                                    read_format, write_format)
+    raise ValueError(f'{run_mode.name} does not run on a server, only -gen, -aug and -validate do')
+
+def run_validator(silence: bool, debug: bool, input_path: str | None, output_path: str | None,
+                  report_path: str | None = None, similarity: float = 0.8, workers: int = 0,
+                  read_format: str | None = None, write_format: str | None = None,
+                  chunk_size: int = 1000) -> int:
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    from ..text import validate
+
+    if input_path is None:
+        raise ValueError('Requiring an input path via `--read` argument.')
+    input_path = os.path.expanduser(input_path)
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f'File not found: {input_path}')
+    if not silence:
+        print(f'Validating query file: {input_path}')
+
+    # Queries which pass all checks are written to --write, if given
+    pool = ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context('spawn')) \
+        if workers > 0 else None
+    writer = storage.open_writer(output_path, write_format) if output_path is not None else None
+    try:
+        report = validate.run(input_path, read_format, writer, similarity, chunk_size,
+                              pool, 2 * workers)
+    finally:
+        if writer is not None:
+            writer.close()
+        if pool is not None:
+            pool.shutdown()
+
+    if report_path is not None:
+        with open(os.path.expanduser(report_path), 'w', encoding = 'utf-8') as f:
+            f.write(report.model_dump_json(indent = 2))
+
+    if debug:
+        print(f'{colour.CYAN}Validated, try inspecting `report`{colour.DEFAULT}')
+        import IPython
+        IPython.embed()
+
+    if not silence:
+        print(f'{colour.CYAN}Queries:{colour.DEFAULT} {report.queries}, {report.dropped_queries} dropped, '
+              f'issues: {report.query_issues}')
+        print(f'{colour.CYAN}Variants:{colour.DEFAULT} {report.variants}, {report.dropped_variants} dropped, '
+              f'issues: {report.variant_issues}')
+        for cluster in report.clusters[:5]:
+            print(f'{colour.CYAN}Near-duplicates ({len(cluster)}):{colour.DEFAULT} {colour.GREY_DARK}{cluster[:5]}{colour.DEFAULT}')
+        if output_path is not None:
+            print(f'Valid queries written to {output_path}')
+    return report.dropped_queries + report.dropped_variants
@@ -0,0 +1,233 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from . import colour
+
+# Timers, counters and token usage of a run, written as a JSON report with `--metrics-out`.
+# Only the standard library is used here, it is imported at CLI startup.
+
+# Estimated USD per 1M tokens: (input, cached input, output), matched by the longest prefix
+# of the model name, e.g. gpt-4o-mini-2024-07-18 is priced as gpt-4o-mini.
+# https://platform.openai.com/docs/pricing
+PRICES: dict[str, tuple[float, float, float]] = {
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4.1': (2.00, 0.50, 8.00),
+    'gpt-4.1-mini': (0.40, 0.10, 1.60),
+    'gpt-4.1-nano': (0.10, 0.025, 0.40),
+    'gpt-5': (1.25, 0.125, 10.00),
+    'gpt-5-mini': (0.25, 0.025, 2.00),
+    'gpt-5-nano': (0.05, 0.005, 0.40),
+    'o3-mini': (1.10, 0.55, 4.40),
+    'o4-mini': (1.10, 0.275, 4.40)
+}
+# Batch API is half the price
+BATCH_DISCOUNT = 0.5
+
+def price_of(model: str) -> tuple[float, float, float] | None:
+    matches = [name for name in PRICES if model.startswith(name)]
+    return PRICES[max(matches, key = len)] if len(matches) > 0 else None
+
+def cost_of(model: str, batch: bool, prompt_tokens: int, cached_tokens: int,
+            completion_tokens: int) -> float | None:
+    price = price_of(model)
+    if price is None:
+        return None
+    # Cached tokens are part of the prompt tokens, at a lower price
+    cost = ((prompt_tokens - cached_tokens) * price[0] + cached_tokens * price[1] + \
+            completion_tokens * price[2]) / 1e6
+    return cost * BATCH_DISCOUNT if batch else cost
+
+def usage_of(usage: object | dict | None) -> tuple[int, int, int]:
+    # (prompt, cached, completion) tokens of the usage of a completion,
+    # either the client model or a plain dict as in batch results
+    if usage is None:
+        return 0, 0, 0
+    if isinstance(usage, dict):
+        details = usage.get('prompt_tokens_details') or {}
+        return usage.get('prompt_tokens') or 0, details.get('cached_tokens') or 0, \
+            usage.get('completion_tokens') or 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return usage.prompt_tokens or 0, getattr(details, 'cached_tokens', None) or 0, \
+        usage.completion_tokens or 0
+
+class Metrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> [count, total seconds, max seconds]
+        self.timers: dict[str, list[float]] = dict()
+        self.counters: dict[str, int] = dict()
+        # (model, batch) -> [requests, prompt, cached, completion tokens]
+        self.usage: dict[tuple[str, bool], list[int]] = dict()
+        # Stats collected from elsewhere when reporting, e.g. caches
+        self.sources: dict[str, Callable[[], object]] = dict()
+
+    def add_time(self, name: str, seconds: float, count: int = 1):
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += count
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    # Each item of a lazy iterable is timed as it is produced, e.g. records read or docs parsed
+    def timed_iter(self, name: str, items: Iterable) -> Iterator:
+        items = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_usage(self, model: str, usage: object | dict | None, batch: bool = False):
+        prompt, cached, completion = usage_of(usage)
+        with self.lock:
+            total = self.usage.setdefault((model, batch), [0, 0, 0, 0])
+            total[0] += 1
+            total[1] += prompt
+            total[2] += cached
+            total[3] += completion
+
+    def add_source(self, name: str, stats: Callable[[], object]):
+        self.sources[name] = stats
+
+    # Everything measured so far, which is then reset. Sent back from worker processes
+    def drain(self) -> dict:
+        with self.lock:
+            out = {'timers': self.timers, 'counters': self.counters, 'usage': self.usage}
+            self.timers, self.counters, self.usage = dict(), dict(), dict()
+        return out
+
+    def merge(self, drained: dict):
+        with self.lock:
+            for name, (count, total, longest) in drained['timers'].items():
+                timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+                timer[0] += count
+                timer[1] += total
+                timer[2] = max(timer[2], longest)
+            for name, n in drained['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for key, values in drained['usage'].items():
+                total = self.usage.setdefault(key, [0, 0, 0, 0])
+                for i, v in enumerate(values):
+                    total[i] += v
+
+    def report(self) -> dict:
+        with self.lock:
+            usage = []
+            for (model, batch), (requests, prompt, cached, completion) in sorted(self.usage.items()):
+                usage.append({
+                    'model': model,
+                    'batch': batch,
+                    'requests': requests,
+                    'prompt_tokens': prompt,
+                    'cached_tokens': cached,
+                    'completion_tokens': completion,
+                    'cost_usd': cost_of(model, batch, prompt, cached, completion)
+                })
+            costs = [u['cost_usd'] for u in usage]
+            return {
+                # Timers of concurrent work (e.g. OpenAI requests in flight) add up to more than the run
+                'timers': {
+                    name: {'count': count, 'total': total, 'mean': total / count if count > 0 else 0.0,
+                           'max': longest}
+                    for name, (count, total, longest) in sorted(self.timers.items())
+                },
+                'counters': dict(sorted(self.counters.items())),
+                'usage': usage,
+                # Unknown when any model has no price
+                'cost_usd': sum(costs) if None not in costs else None,
+                **{name: stats() for name, stats in self.sources.items()}
+            }
+
+# Metrics of this process
+METRICS = Metrics()
+
+def timer(name: str) -> object:
+    return METRICS.timer(name)
+
+def timed_iter(name: str, items: Iterable) -> Iterator:
+    return METRICS.timed_iter(name, items)
+
+def count(name: str, n: int = 1):
+    METRICS.count(name, n)
+
+def add_usage(model: str, usage: object | dict | None, batch: bool = False):
+    METRICS.add_usage(model, usage, batch)
+
+def add_source(name: str, stats: Callable[[], object]):
+    METRICS.add_source(name, stats)
+
+# Decorator, timing every call of a function
+def timed(name: str) -> Callable:
+    def decorate(f: Callable) -> Callable:
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                METRICS.add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+# The whole run, profiled with cProfile if `profile_path` is given.
+# The report is written to `metrics_path` when the run ends, also when it fails
+@contextmanager
+def recording(metrics_path: str | None, profile_path: str | None, silence: bool,
+              run_mode: str) -> Iterator[Metrics]:
+    profiler = None
+    if profile_path is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    started = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield METRICS
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            path = os.path.expanduser(profile_path)
+            profiler.dump_stats(path)
+            if not silence:
+                print(f'{colour.CYAN}Profile written to:{colour.DEFAULT} {path} (view with `python -m pstats {path}`)')
+        if metrics_path is not None:
+            path = os.path.expanduser(metrics_path)
+            with open(path, 'w', encoding = 'utf-8') as f:
+                json.dump({
+                    'run_mode': run_mode,
+                    'argv': sys.argv[1:],
+                    'started_at': started.isoformat(),
+                    'elapsed': elapsed,
+                    'error': error,
+                    **METRICS.report()
+                }, f, indent = 2, default = str)
+            if not silence:
+                print(f'{colour.CYAN}Metrics written to:{colour.DEFAULT} {path}')
@@ -6,3 +6,9 @@ class RunMode(Enum):
     AUGMENTOR = 2
     VALIDATOR = 8
     MERGER = 16
+    INDEXER = 32
+    CONVERTER = 64
+    SERVER = 128
+
+# Run modes which run on the server given by --server
+REMOTE = {RunMode.GENERATOR, RunMode.AUGMENTOR, RunMode.VALIDATOR}
@@ -1,3 +1,8 @@
-from .agent import create, gen_queries, augment_query
+# Submodules are imported on first use, `openai` is slow to import
+__all__ = ['create', 'create_async', 'gen_queries', 'gen_queries_async', 'augment_query', 'augment_query_async']
 
-__all__ = [create, gen_queries, augment_query]
+def __getattr__(name: str) -> object:
+    if name in __all__:
+        from . import agent
+        return getattr(agent, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,24 +1,47 @@
+import asyncio
 import os
+import random
+from collections.abc import Awaitable, Callable
 from functools import partial
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError
+from pydantic import BaseModel
 from typing import Any
 
 from ..text import query
-from ..cli import colour
+from ..cli import colour, metrics
 
 OPENAI_KEY = "OPENAI_API_KEY"
 OPENAI_MODEL = "OPENAI_API_MODEL"
 
+# HTTP statuses worth retrying: rate limit and transient server errors
+RETRY_STATUSES = {408, 409, 429}
+
 def create() -> object:
     return OpenAI(
         # It's default auth method, but wanna make it obvious.
         api_key = os.environ.get(OPENAI_KEY),
     )
 
+def create_async() -> object:
+    # Retries are done by `with_retry` so that they back off with jitter
+    # and don't hold a concurrency slot while sleeping in the client.
+    # NOTE: The base URL can be pointed to a local server via env var OPENAI_BASE_URL
+    return AsyncOpenAI(
+        api_key = os.environ.get(OPENAI_KEY),
+        max_retries = 0
+    )
+
+def get_model() -> str:
+    model = os.environ.get(OPENAI_MODEL)
+    if model is None:
+        # No we don't decide the fallback model for anyone
+        raise ValueError(f'Missing model name in env var: {OPENAI_MODEL}')
+    return model
+
 def make_prompts(lang: str, num: int, topic: str, debug: bool, silence: bool, no_prompt_prefix: bool = False) -> list[dict[str, str]]:
     # just simple prompt
     content = topic if no_prompt_prefix \
-        else f'Generate {num} sample search queries in {', '.join(lang)} language the real user would use to search for {topic}'
+        else f'Generate {num} sample search queries in {', '.join(sorted(lang))} language the real user would use to search for {topic}'
     if not silence:
         print(f'{colour.CYAN}{colour.BOLD}Prompt:{colour.DEFAULT} {content}')
     return [{
@@ -26,14 +49,49 @@ def make_prompts(lang: str, num: int, topic: str, debug: bool, silence: bool, no
         'content': content
     }]
 
+# Kinds of search queries, one per shard of a large generation (see `shards`),
+# so that shards of the same language ask for different queries
+SUB_INTENTS = [
+    'informational queries, e.g. questions and how-tos',
+    'navigational queries for specific brands, shops or products',
+    'transactional queries of users ready to buy',
+    'comparisons between products or options',
+    'queries with specific attributes like size, colour, material or model',
+    'price-conscious queries with budgets, deals or discounts',
+    'queries for an occasion, season or audience',
+    'queries describing a problem or need rather than a product',
+    'short queries of one or two words',
+    'long and detailed queries'
+]
+
+def make_shard_prompts(lang: str, num: int, topic: str, shard: int,
+                       no_prompt_prefix: bool = False) -> list[dict[str, str]]:
+    intent = SUB_INTENTS[shard % len(SUB_INTENTS)]
+    round = shard // len(SUB_INTENTS)
+    if no_prompt_prefix:
+        content = topic
+    else:
+        content = f'Generate {num} sample search queries in {lang} language the real user would use to search for {topic}, ' + \
+                  f'focusing on {intent}'
+    # Also keeps repeated prompts apart in the completion cache
+    if no_prompt_prefix and shard > 0:
+        content += f' (set {shard + 1})'
+    elif round > 0:
+        content += f'. This is set {round + 1} of them, avoid the most common queries'
+    return [{
+        'role': 'developer',
+        'content': content
+    }]
+
 def make_augmenting_prompts(num: int, orig: str, vtypes: set[query.VariantType], 
                             debug: bool, silence: bool, lang: set[str] | None) -> list[dict[str, str]]:
     
-    # Some command, i.e. translation, requires language parameter
+    # Some command, i.e. translation, requires language parameter.
+    # Prompts are in a fixed order, they are part of the completion cache key
     make_str = partial(query.to_str, lang)
 
     variants = ''.join(map(make_str, vtypes)) if len(vtypes) == 1 \
-        else ', '.join([f'[{i+1}] {make_str(v)}' for i, v in enumerate(vtypes)]) + ' randomly'
+        else ', '.join([f'[{i+1}] {make_str(v)}' for i, v in enumerate(query.ordered(vtypes))]) + ' randomly'
     content = f'Generate {num} additional search queries from "{orig}" by applying {variants}'
     
     if not silence:
@@ -43,30 +101,112 @@ def make_augmenting_prompts(num: int, orig: str, vtypes: set[query.VariantType],
         'content': content
     }]
 
+# One prompt for all `queries`, listed by index
+def make_packed_prompts(num: int, queries: list[query.Query], vtypes: set[query.VariantType],
+                        debug: bool, silence: bool, lang: set[str] | None) -> list[dict[str, str]]:
+    make_str = partial(query.to_str, lang)
+
+    variants = ''.join(map(make_str, vtypes)) if len(vtypes) == 1 \
+        else ', '.join([f'[{i+1}] {make_str(v)}' for i, v in enumerate(query.ordered(vtypes))]) + ' randomly'
+    listed = '\n'.join([f'[{i}] "{q.original}"' for i, q in enumerate(queries)])
+    content = f'For each of the following search queries, generate {num} additional search queries by applying {variants}. ' + \
+              f'Answer with the index of each query:\n{listed}'
+
+    if not silence:
+        print(f'{colour.CYAN}{colour.BOLD}Prompt:{colour.DEFAULT} {content}')
+    return [{
+        'role': 'developer',
+        'content': content
+    }]
+
+def parse(client: object, model: str, messages: list[dict[str, str]],
+          response_format: type[BaseModel], cache: object | None = None) -> object:
+    key = cache.key(model, messages, response_format) if cache is not None else None
+    if cache is not None:
+        completion = cache.get(key, response_format)
+        if completion is not None:
+            return completion
+    with metrics.timer('openai.request'):
+        completion = client.beta.chat.completions.parse(
+            model = model,
+            messages = messages,
+            response_format = response_format
+        )
+    metrics.add_usage(model, completion.usage)
+    if cache is not None:
+        cache.put(key, completion)
+    return completion
+
 def gen_queries(client: object, lang: str, num: int, topic: str,
-                debug: bool, silence: bool, no_prompt_prefix: bool) -> list[query.Query]:
+                debug: bool, silence: bool, no_prompt_prefix: bool,
+                cache: object | None = None) -> list[query.Query]:
     # https://platform.openai.com/docs/api-reference/introduction
-    model = os.environ.get(OPENAI_MODEL)
-    if model is None:
-        # No we don't decide the fallback model for anyone
-        raise ValueError(f'Missing model name in env var: {OPENAI_MODEL}')
-    completion = client.beta.chat.completions.parse(
-        model = model,
-        messages = make_prompts(lang, num, topic, debug, silence, no_prompt_prefix),
-        response_format = query.QuerySet
-    )
-    return completion
+    model = get_model()
+    return parse(client, model,
+                 make_prompts(lang, num, topic, debug, silence, no_prompt_prefix),
+                 query.QuerySet, cache)
 
 def augment_query(client: object, orig: query.Query, typs: set[query.VariantType], 
-                  num: int, debug: bool, silence: bool, lang: set[str] | None) -> list[query.QueryVariant]:
-    model = os.environ.get(OPENAI_MODEL)
-    if model is None:
-        # No we don't decide the fallback model for anyone
-        raise ValueError(f'Missing model name in env var: {OPENAI_MODEL}')
-    completion = client.beta.chat.completions.parse(
-        model = model,
-        messages = make_augmenting_prompts(num, orig.original, typs, debug, silence, lang),
-        response_format = query.QueryVariantSet
-    )
+                  num: int, debug: bool, silence: bool, lang: set[str] | None,
+                  cache: object | None = None) -> list[query.QueryVariant]:
+    model = get_model()
+    return parse(client, model,
+                 make_augmenting_prompts(num, orig.original, typs, debug, silence, lang),
+                 query.QueryVariantSet, cache)
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, APIConnectionError):
+        # Includes timeouts
+        return True
+    if isinstance(e, APIStatusError):
+        return e.status_code in RETRY_STATUSES or e.status_code >= 500
+    return False
+
+async def with_retry(call: Callable[[], Awaitable[Any]], retries: int,
+                     base_delay: float = 1.0, max_delay: float = 60.0) -> Any:
+    # Exponential backoff with full jitter
+    # https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            metrics.count('openai.retries')
+            await asyncio.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+async def parse_async(client: object, model: str, messages: list[dict[str, str]],
+                      response_format: type[BaseModel], retries: int,
+                      cache: object | None = None) -> object:
+    key = cache.key(model, messages, response_format) if cache is not None else None
+    if cache is not None:
+        completion = cache.get(key, response_format)
+        if completion is not None:
+            return completion
+    # Timed with retries, while other requests are in flight
+    with metrics.timer('openai.request'):
+        completion = await with_retry(
+            lambda: client.beta.chat.completions.parse(
+                model = model,
+                messages = messages,
+                response_format = response_format
+            ),
+            retries
+        )
+    metrics.add_usage(model, completion.usage)
+    if cache is not None:
+        cache.put(key, completion)
     return completion
 
+async def gen_queries_async(client: object, messages: list[dict[str, str]],
+                            retries: int = 5, cache: object | None = None) -> object:
+    model = get_model()
+    return await parse_async(client, model, messages, query.QuerySet, retries, cache)
+
+async def augment_query_async(client: object, orig: query.Query, typs: set[query.VariantType],
+                              num: int, debug: bool, silence: bool, lang: set[str] | None,
+                              retries: int = 5, cache: object | None = None) -> list[query.QueryVariant]:
+    model = get_model()
+    return await parse_async(client, model,
+                             make_augmenting_prompts(num, orig.original, typs, debug, silence, lang),
+                             query.QueryVariantSet, retries, cache)
@@ -0,0 +1,331 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections.abc import Callable, Iterable, Iterator
+from pydantic import BaseModel
+
+from . import agent
+from ..text import query
+from ..cli import colour, metrics
+
+# https://platform.openai.com/docs/guides/batch
+ENDPOINT = '/v1/chat/completions'
+COMPLETION_WINDOW = '24h'
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+# Limits of one batch, larger runs are split into several
+MAX_REQUESTS = 50_000
+MAX_BYTES = 200_000_000
+
+class Transport(object):
+    # Upload the request JSONL file and start the batch, returns the batch ID
+    def submit(self, path: str) -> str:
+        pass
+
+    # One of the batch statuses, e.g. `validating`, `in_progress`, `completed`
+    def status(self, batch_id: str) -> str:
+        pass
+
+    # Content of the output JSONL file of a completed batch,
+    # followed by the error file of the requests which failed
+    def results(self, batch_id: str) -> str:
+        pass
+
+    # Custom IDs of the requests of a submitted batch, in its input file
+    def custom_ids(self, batch_id: str) -> list[str]:
+        pass
+
+class OpenAITransport(Transport):
+    def __init__(self, client: object):
+        self.client = client
+
+    def submit(self, path: str) -> str:
+        with open(path, 'rb') as f:
+            uploaded = self.client.files.create(file = f, purpose = 'batch')
+        batch = self.client.batches.create(
+            input_file_id = uploaded.id,
+            endpoint = ENDPOINT,
+            completion_window = COMPLETION_WINDOW
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    # Failed requests only go to the error file, there is no output file when all of them failed
+    def results(self, batch_id: str) -> str:
+        batch = self.client.batches.retrieve(batch_id)
+        file_ids = [i for i in (batch.output_file_id, batch.error_file_id) if i is not None]
+        return '\n'.join(self.client.files.content(i).text for i in file_ids)
+
+    def custom_ids(self, batch_id: str) -> list[str]:
+        batch = self.client.batches.retrieve(batch_id)
+        return custom_ids_of(self.client.files.content(batch.input_file_id).text.splitlines())
+
+# Runs a batch locally, one request at a time, e.g. against a stub.
+# Batches are kept under `root` so they can be resumed by ID.
+class LocalTransport(Transport):
+    def __init__(self, root: str, respond: Callable[[dict], dict]):
+        self.root = os.path.expanduser(root)
+        self.respond = respond
+
+    def submit(self, path: str) -> str:
+        with open(path, 'rb') as f:
+            batch_id = f'batch_local_{hashlib.sha1(f.read()).hexdigest()[:24]}'
+        os.makedirs(os.path.join(self.root, batch_id), exist_ok = True)
+        shutil.copyfile(path, os.path.join(self.root, batch_id, 'input.jsonl'))
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        batch_dir = os.path.join(self.root, batch_id)
+        if not os.path.exists(batch_dir):
+            raise FileNotFoundError(f'Batch not found: {batch_id}')
+        output_path = os.path.join(batch_dir, 'output.jsonl')
+        if not os.path.exists(output_path):
+            self.run(batch_dir, output_path)
+        return 'completed'
+
+    def results(self, batch_id: str) -> str:
+        with open(os.path.join(self.root, batch_id, 'output.jsonl'), 'r') as f:
+            return f.read()
+
+    def custom_ids(self, batch_id: str) -> list[str]:
+        with open(os.path.join(self.root, batch_id, 'input.jsonl'), 'r') as f:
+            return custom_ids_of(f)
+
+    def run(self, batch_dir: str, output_path: str):
+        lines = []
+        with open(os.path.join(batch_dir, 'input.jsonl'), 'r') as f:
+            for line in f:
+                request = json.loads(line)
+                lines.append(json.dumps({
+                    'id': f'batch_req_{request["custom_id"]}',
+                    'custom_id': request['custom_id'],
+                    'response': {'status_code': 200, 'body': self.respond(request['body'])},
+                    'error': None
+                }))
+        # Write the whole output at once, so a partial run is never seen as completed
+        with open(output_path + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(output_path + '.tmp', output_path)
+
+# Structured outputs in strict mode require every property and allow no other
+def strict_schema(schema: dict) -> dict:
+    if schema.get('type') == 'object':
+        schema['additionalProperties'] = False
+        schema['required'] = list(schema.get('properties', {}))
+    for key in ('properties', '$defs'):
+        for sub in schema.get(key, {}).values():
+            strict_schema(sub)
+    if isinstance(schema.get('items'), dict):
+        strict_schema(schema['items'])
+    for key in ('anyOf', 'allOf'):
+        for sub in schema.get(key, []):
+            strict_schema(sub)
+    return schema
+
+# The `json_schema` response format of a model, as sent by the client for structured outputs
+def response_format_of(model: type[BaseModel]) -> dict:
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': model.__name__,
+            'schema': strict_schema(model.model_json_schema()),
+            'strict': True
+        }
+    }
+
+def make_request(custom_id: str, model: str, messages: list[dict[str, str]],
+                 response_format: type[BaseModel]) -> dict:
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': ENDPOINT,
+        'body': {
+            'model': model,
+            'messages': messages,
+            'response_format': response_format_of(response_format)
+        }
+    }
+
+# Stable across runs of the same input, and sortable by input order
+def augment_custom_id(index: int, q: query.Query) -> str:
+    digest = hashlib.sha1(f'{q.lang}\0{q.original}'.encode('utf-8')).hexdigest()[:12]
+    return f'aug-{index:08d}-{digest}'
+
+def gen_custom_id(lang: str) -> str:
+    return f'gen-{lang}'
+
+# Of the lines of a request JSONL file
+def custom_ids_of(lines: Iterable[str]) -> list[str]:
+    return [json.loads(line)['custom_id'] for line in lines if line.strip()]
+
+# Request files of one batch each, written as the requests come
+# and cut before reaching either limit
+def write_requests(requests: Iterable[dict], max_requests: int, max_bytes: int) -> Iterator[str]:
+    f = None
+    for r in requests:
+        line = (json.dumps(r, ensure_ascii = False) + '\n').encode('utf-8')
+        if len(line) > max_bytes:
+            raise ValueError(f'Request {r["custom_id"]} does not fit in a batch ({len(line)} bytes)')
+        if f is not None and (count == max_requests or size + len(line) > max_bytes):
+            f.close()
+            yield path
+            f = None
+        if f is None:
+            fd, path = tempfile.mkstemp(prefix = 'aquda-batch-', suffix = '.jsonl')
+            f = os.fdopen(fd, 'wb')
+            count, size = 0, 0
+        f.write(line)
+        count += 1
+        size += len(line)
+    if f is not None:
+        f.close()
+        yield path
+
+# Each batch is submitted once its request file is complete.
+# Returns the custom IDs of the requests of each batch, by batch ID
+def submit(transport: Transport, requests: Iterable[dict], silence: bool) -> dict[str, list[str]]:
+    submitted = dict()
+    for path in write_requests(requests, MAX_REQUESTS, MAX_BYTES):
+        batch_id = transport.submit(path)
+        with open(path, 'r', encoding = 'utf-8') as f:
+            submitted[batch_id] = custom_ids_of(f)
+        os.remove(path)
+        # Always shown, even in silence mode, the IDs are needed for resuming
+        print(f'{colour.CYAN}Submitted batch:{colour.DEFAULT} {batch_id} '
+              f'(resume with --batch-id={",".join(submitted)})')
+    return submitted
+
+def poll(transport: Transport, batch_id: str, interval: float, silence: bool) -> str:
+    while True:
+        status = transport.status(batch_id)
+        if not silence:
+            print(f'{colour.CYAN}Batch {batch_id}:{colour.DEFAULT} {status}')
+        if status in TERMINAL_STATUSES:
+            return status
+        time.sleep(interval)
+
+# Parsed results by custom ID, the custom IDs of failed and refused requests are added to `failed`
+def collect(transport: Transport, batch_id: str, response_format: type[BaseModel],
+            failed: list[str]) -> dict[str, BaseModel]:
+    parsed = dict()
+    for line in transport.results(batch_id).splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get('response') or {}
+        if result.get('error') is not None or response.get('status_code') != 200:
+            print(f'{colour.RED}Failed request {result["custom_id"]}:{colour.DEFAULT} {result.get("error") or response}')
+            failed.append(result['custom_id'])
+            continue
+        # Failed requests are not billed, refused ones are
+        metrics.add_usage(response['body'].get('model', ''), response['body'].get('usage'), batch = True)
+        message = response['body']['choices'][0]['message']
+        if message.get('content') is None:
+            print(f'{colour.RED}Refused request {result["custom_id"]}:{colour.DEFAULT} {message.get("refusal")}')
+            failed.append(result['custom_id'])
+            continue
+        parsed[result['custom_id']] = response_format.model_validate_json(message['content'])
+    return parsed
+
+# Parsed results of one batch after another, in the order they were submitted
+def run(transport: Transport, requests: Callable[[], Iterable[dict]], batch_ids: list[str] | None,
+        interval: float, silence: bool, response_format: type[BaseModel],
+        failed: list[str]) -> Iterator[dict[str, BaseModel]]:
+    # Requests are only built when there are no batches to resume,
+    # the custom IDs of resumed ones are read back from their input files
+    submitted = dict()
+    if batch_ids is None:
+        submitted = submit(transport, requests(), silence)
+        batch_ids = list(submitted)
+    elif not silence:
+        print(f'{colour.CYAN}Resuming batches:{colour.DEFAULT} {", ".join(batch_ids)}')
+
+    for batch_id in batch_ids:
+        status = poll(transport, batch_id, interval, silence)
+        if status != 'completed':
+            raise RuntimeError(f'Batch {batch_id} ended with status: {status}')
+        start = len(failed)
+        parsed = collect(transport, batch_id, response_format, failed)
+        # Requests without any result line count as failed too
+        collected = set(parsed) | set(failed[start:])
+        custom_ids = submitted[batch_id] if batch_id in submitted else transport.custom_ids(batch_id)
+        missing = [i for i in custom_ids if i not in collected]
+        if len(missing) > 0:
+            print(f'{colour.RED}Missing results of batch {batch_id}:{colour.DEFAULT} {len(missing)} requests')
+            failed.extend(missing)
+        yield parsed
+
+# Comma-separated IDs of --batch-id
+def parse_ids(batch_id: str) -> list[str]:
+    return [i.strip() for i in batch_id.split(',') if i.strip()]
+
+def failed_path_of(output_path: str) -> str:
+    return f'{os.path.expanduser(output_path)}.failed.txt'
+
+# The output is written without the results of failed and refused requests.
+# Their custom IDs go next to it, one per line, and the run fails
+def check_failed(failed: list[str], output_path: str | None):
+    path = failed_path_of(output_path) if output_path is not None else None
+    if len(failed) == 0:
+        # Left from an earlier run of the same output
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+        return
+    if path is None:
+        raise RuntimeError(f'{len(failed)} batch requests failed or were refused: {", ".join(failed)}')
+    with open(path, 'w') as f:
+        f.write('\n'.join(failed) + '\n')
+    raise RuntimeError(f'{len(failed)} batch requests failed or were refused, their custom IDs are in {path}')
+
+def gen_queries(transport: Transport, lang: set[str], num: int, topic: str,
+                debug: bool, silence: bool, no_prompt_prefix: bool, failed: list[str],
+                batch_ids: list[str] | None = None, interval: float = 30) -> query.QuerySet:
+    model = agent.get_model()
+
+    # One request per language
+    def requests() -> Iterable[dict]:
+        for lng in sorted(lang):
+            yield make_request(gen_custom_id(lng), model,
+                               agent.make_prompts([lng], num, topic, debug, silence, no_prompt_prefix),
+                               query.QuerySet)
+
+    parsed = dict()
+    for part in run(transport, requests, batch_ids, interval, silence, query.QuerySet, failed):
+        parsed.update(part)
+    return query.QuerySet(
+        queries = [q for custom_id in sorted(parsed) for q in parsed[custom_id].queries]
+    )
+
+# The queries are streamed into the request files, and the augmented ones come back
+# one batch at a time, so neither is held in memory as a whole
+def augment_queries(transport: Transport, queries: Iterable[query.Query], typs: set[query.VariantType],
+                    num: int, debug: bool, silence: bool, lang: set[str] | None, failed: list[str],
+                    batch_ids: list[str] | None = None, interval: float = 30) -> Iterator[query.QueryVariant]:
+    model = agent.get_model()
+
+    def requests() -> Iterable[dict]:
+        for i, q in enumerate(queries):
+            metrics.count('augment.queries')
+            yield make_request(augment_custom_id(i, q), model,
+                               agent.make_augmenting_prompts(num, q.original, typs, debug, silence, lang),
+                               query.QueryVariantSet)
+
+    for parsed in run(transport, requests, batch_ids, interval, silence, query.QueryVariantSet, failed):
+        # custom IDs are ordered by input index, and each batch follows the previous one
+        for custom_id in sorted(parsed):
+            yield from parsed[custom_id].queries
+
+def create_transport(name: str, root: str) -> Transport:
+    if name == 'openai':
+        return OpenAITransport(agent.create())
+    elif name == 'local':
+        # Each request is sent to the chat completion endpoint one by one,
+        # point OPENAI_BASE_URL to a local stub to run fully offline
+        client = agent.create()
+        return LocalTransport(root, lambda body: client.chat.completions.create(**body).model_dump())
+    else:
+        raise ValueError(f'Unknown batch transport: {name}')
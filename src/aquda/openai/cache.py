@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pydantic import BaseModel
+from typing import TYPE_CHECKING
+
+from ..cli import colour
+
+if TYPE_CHECKING:
+    from openai.types.chat import ParsedChatCompletion
+
+DEFAULT_DIR = '~/.cache/aquda'
+DB_NAME = 'completions.sqlite'
+# Expired entries are dropped every so many puts, while the cache is below `max_bytes`
+EXPIRE_EVERY = 1_000
+# Share of `max_bytes` left once full, so the next puts do not evict again straight away
+EVICT_TO = 0.9
+# Least recently used entries looked up per statement when evicting
+EVICT_PAGE = 1_000
+
+# Content-addressed store of chat completions on disk.
+# An entry is keyed by everything which determines the completion:
+# model, rendered messages and response format schema. Requests are sent
+# without sampling parameters, the defaults of the API apply to all of them.
+class CompletionCache(object):
+    def __init__(self, path: str, max_bytes: int, max_age: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS completions_accessed_at ON completions (accessed_at)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS completions_created_at ON completions (created_at)')
+        self.db.commit()
+        # Bytes of all entries, kept up to date by put() rather than summed up on every one
+        self.size = 0
+        self.puts = 0
+        self.evict()
+
+    @staticmethod
+    def key(model: str, messages: list[dict[str, str]], response_format: type[BaseModel]) -> str:
+        schema = json.dumps(response_format.model_json_schema(), sort_keys = True)
+        return hashlib.sha256(json.dumps({
+            'model': model,
+            'messages': messages,
+            'schema': hashlib.sha256(schema.encode('utf-8')).hexdigest()
+        }, sort_keys = True, ensure_ascii = False).encode('utf-8')).hexdigest()
+
+    def get(self, key: str, response_format: type[BaseModel]) -> 'ParsedChatCompletion | None':
+        from openai.types.chat import ParsedChatCompletion
+
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT value FROM completions WHERE key = ? AND created_at >= ?',
+                                  (key, now - self.max_age)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.db.execute('UPDATE completions SET accessed_at = ? WHERE key = ?', (now, key))
+            self.db.commit()
+        return ParsedChatCompletion[response_format].model_validate_json(row[0])
+
+    def put(self, key: str, completion: 'ParsedChatCompletion'):
+        # The parsed content type is unknown to the generic completion model at dump time
+        value = completion.model_dump_json(warnings = False)
+        now = time.time()
+        with self.lock:
+            replaced = self.db.execute('SELECT size FROM completions WHERE key = ?', (key,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)',
+                            (key, value, len(value), now, now))
+            self.db.commit()
+            self.size += len(value) - (replaced[0] if replaced is not None else 0)
+            self.puts += 1
+            full = self.size > self.max_bytes or self.puts % EXPIRE_EVERY == 0
+        if full:
+            self.evict()
+
+    # Drop expired entries, then when above `max_bytes` the least recently used ones
+    # down to EVICT_TO of it. The size is summed up again here, other processes may share the file
+    def evict(self):
+        with self.lock:
+            cursor = self.db.execute('DELETE FROM completions WHERE created_at < ?',
+                                     (time.time() - self.max_age,))
+            self.evictions += cursor.rowcount
+            total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM completions').fetchone()[0]
+            if total > self.max_bytes:
+                target = self.max_bytes * EVICT_TO
+                while total > target:
+                    rows = self.db.execute('SELECT key, size FROM completions ORDER BY accessed_at LIMIT ?',
+                                           (EVICT_PAGE,)).fetchall()
+                    if len(rows) == 0:
+                        break
+                    for key, size in rows:
+                        if total <= target:
+                            break
+                        self.db.execute('DELETE FROM completions WHERE key = ?', (key,))
+                        total -= size
+                        self.evictions += 1
+            self.db.commit()
+            self.size = total
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            entries, size = self.db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions').fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': size
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f'{colour.CYAN}Completion cache:{colour.DEFAULT} {stats["hits"]} hits, '
+              f'{stats["misses"]} misses, {stats["evictions"]} evicted, '
+              f'{stats["entries"]} entries ({stats["bytes"] / 1e6:.1f} MB) in {self.path}')
+
+    def close(self):
+        self.db.close()
+
+def create(cache_dir: str, max_mb: float, max_age_days: float) -> CompletionCache:
+    cache_dir = os.path.expanduser(cache_dir)
+    os.makedirs(cache_dir, exist_ok = True)
+    return CompletionCache(
+        os.path.join(cache_dir, DB_NAME),
+        int(max_mb * 1e6),
+        max_age_days * 24 * 3600
+    )
@@ -0,0 +1,127 @@
+import asyncio
+import math
+from collections.abc import Callable
+
+from . import agent
+from ..text import query, dedup
+from ..cli import colour, metrics
+
+# A large -gen is split into shards: prompts for up to `shard_size` queries of one language,
+# each focusing on another sub-intent (see agent.SUB_INTENTS). Shards run concurrently,
+# their queries are deduplicated as they arrive, and more shards are asked for
+# until every language has its `size` queries, or the request budget runs out.
+
+# Lower bound of the expected yield of a shard, so that a language with
+# many duplicates is not asked for huge shards
+MIN_YIELD = 0.2
+
+class Target(object):
+    def __init__(self, lang: str, size: int):
+        self.lang = lang
+        self.size = size
+        self.accepted = 0
+        # Queries asked for by finished shards, and by shards in flight
+        self.asked = 0
+        self.pending = 0
+        self.shards = 0
+        self.duplicates = 0
+        self.failed = 0
+
+    # Share of the queries asked for which turn out new, as shards return
+    # fewer queries than asked, and duplicates of earlier ones
+    def yield_rate(self) -> float:
+        return max(MIN_YIELD, self.accepted / self.asked) if self.asked > 0 else 1.0
+
+    # Queries still missing, expecting the shards in flight to yield like the finished ones
+    def missing(self) -> float:
+        return self.size - self.accepted - self.pending * self.yield_rate()
+
+    # Number of queries to ask for in the next shard
+    def shard_size(self, limit: int) -> int:
+        return min(limit, math.ceil(self.missing() / self.yield_rate()))
+
+# Twice the number of shards needed if every shard returned all its queries,
+# and a few more per language for small sizes
+def default_budget(langs: set[str], size: int, shard_size: int) -> int:
+    return len(langs) * (2 * math.ceil(size / shard_size) + 2)
+
+async def generate(create_client: Callable[[], object], langs: set[str], size: int, topic: str,
+                   shard_size: int, concurrency: int, max_requests: int, retries: int,
+                   no_prompt_prefix: bool, silence: bool, seen: dedup.SeenSet,
+                   write: Callable[[query.Query], None],
+                   cache: object | None = None) -> list[Target]:
+    targets = [Target(lng, size) for lng in sorted(langs)]
+    inflight: dict[asyncio.Task, tuple[Target, int]] = dict()
+    requests = 0
+
+    async with create_client() as client:
+        try:
+            while True:
+                # Top up the language furthest from its target, counting the queries in flight
+                while len(inflight) < concurrency and requests < max_requests:
+                    open_targets = [t for t in targets if t.missing() > 0]
+                    if len(open_targets) == 0:
+                        break
+                    t = max(open_targets, key = lambda t: t.missing())
+                    num = t.shard_size(shard_size)
+                    messages = agent.make_shard_prompts(t.lang, num, topic, t.shards, no_prompt_prefix)
+                    task = asyncio.create_task(agent.gen_queries_async(client, messages, retries, cache))
+                    inflight[task] = (t, num)
+                    t.pending += num
+                    t.shards += 1
+                    requests += 1
+                if len(inflight) == 0:
+                    break
+
+                done, _ = await asyncio.wait(inflight, return_when = asyncio.FIRST_COMPLETED)
+                for task in done:
+                    t, num = inflight.pop(task)
+                    t.pending -= num
+                    t.asked += num
+                    collect(t, task, seen, write)
+                    if not silence:
+                        print(f'{colour.CYAN}[{t.lang}]{colour.DEFAULT} {t.accepted}/{t.size} queries, '
+                              f'{t.duplicates} duplicates, {t.shards} requests')
+        finally:
+            for task in inflight:
+                task.cancel()
+            if len(inflight) > 0:
+                await asyncio.gather(*inflight, return_exceptions = True)
+    return targets
+
+# Queries of a finished shard, written unless seen before in its language
+def collect(t: Target, task: asyncio.Task, seen: dedup.SeenSet, write: Callable[[query.Query], None]):
+    metrics.count('gen.requests')
+    try:
+        parsed = task.result().choices[0].message.parsed
+    except Exception as e:
+        # Retries are exhausted, the budget tops up the language later.
+        # Other errors, e.g. a wrong API key or model, fail every request alike
+        if not agent.is_retryable(e):
+            raise
+        parsed = None
+        print(f'{colour.RED}Failed request [{t.lang}]:{colour.DEFAULT} {e}')
+    if parsed is None:
+        t.failed += 1
+        metrics.count('gen.failed_requests')
+        return
+    for q in parsed.queries:
+        if t.accepted >= t.size:
+            break
+        # Counted against the language asked for, which may be named unlike `q.lang`, e.g. english and en
+        if seen.add(query.Query(original = q.original, lang = t.lang)):
+            write(q)
+            t.accepted += 1
+        else:
+            t.duplicates += 1
+            metrics.count('gen.duplicates')
+    seen.commit()
+
+def gen_queries(langs: set[str], size: int, topic: str, shard_size: int, concurrency: int,
+                max_requests: int, retries: int, no_prompt_prefix: bool, silence: bool,
+                seen: dedup.SeenSet, write: Callable[[query.Query], None],
+                cache: object | None = None,
+                create_client: Callable[[], object] | None = None) -> list[Target]:
+    return asyncio.run(generate(create_client or agent.create_async, langs, size, topic,
+                                shard_size, concurrency, max_requests, retries,
+                                no_prompt_prefix, silence, seen, write, cache))
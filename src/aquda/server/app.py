@@ -0,0 +1,372 @@
+import asyncio
+import json
+import os
+import queue
+import socketserver
+import stat
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pydantic import BaseModel
+
+from . import client, protocol
+from ..spacy import conf
+from ..text import query, processor, storage, dedup
+from ..cli import colour, metrics
+
+# Augmentation server: the Spacy models of the languages served (see spacy.conf) are loaded once,
+# OpenAI requests share one client (and its connection pool) on one event loop,
+# and concurrent requests to Spacy are augmented together in micro-batches.
+#
+# GET  /health    languages, batching stats and the metrics so far
+# POST /augment   protocol.AugmentRequest -> query.QueryVariantSet
+# POST /generate  protocol.GenerateRequest -> protocol.GenerateResponse
+# POST /validate  protocol.ValidateRequest -> protocol.ValidateResponse
+
+# Seconds the first request of a micro-batch waits for others to join it
+DEFAULT_BATCH_WAIT = 0.005
+
+# Items of many submits processed in one call, by a thread of its own.
+# A batch closes when it has `max_batch` items, or `max_wait` seconds after its first submit
+class MicroBatcher(object):
+    def __init__(self, process: Callable[[list], list], max_batch: int, max_wait: float):
+        self.process = process
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending: queue.Queue[tuple[list, Future] | None] = queue.Queue()
+        self.batches = 0
+        self.submits = 0
+        self.items = 0
+        self.thread = threading.Thread(target = self.run, name = 'aquda-batcher', daemon = True)
+        self.thread.start()
+
+    def submit(self, items: list) -> Future:
+        future = Future()
+        self.pending.put((items, future))
+        return future
+
+    def run(self):
+        closing = False
+        while not closing:
+            first = self.pending.get()
+            if first is None:
+                return
+            batch = [first]
+            size = len(first[0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                try:
+                    submit = self.pending.get(timeout = max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if submit is None:
+                    closing = True
+                    break
+                batch.append(submit)
+                size += len(submit[0])
+
+            self.batches += 1
+            self.submits += len(batch)
+            self.items += size
+            metrics.count('server.batches')
+            try:
+                outputs = self.process([item for items, _ in batch for item in items])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for items, future in batch:
+                future.set_result(outputs[start:start + len(items)])
+                start += len(items)
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            'batches': self.batches,
+            'submits': self.submits,
+            'items': self.items,
+            'mean_batch': self.items / self.batches if self.batches > 0 else 0.0
+        }
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+
+# (Spacy augmentor, query) of all requests, one `process_batch` per augmentor.
+# Spacy runs on the batcher thread only, the models are not shared between threads
+def augment_items(items: list[tuple[processor.SpacyAugmentor, query.Query]], batch_size: int) -> list[object]:
+    outputs: list[object] = [None] * len(items)
+    indexes_by_aug: dict[processor.SpacyAugmentor, list[int]] = defaultdict(list)
+    for i, (aug, _) in enumerate(items):
+        indexes_by_aug[aug].append(i)
+    for aug, indexes in indexes_by_aug.items():
+        queries = [items[i][1] for i in indexes]
+        for i, output in zip(indexes, aug.process_batch(queries, 0, False, True, None, batch_size = batch_size)):
+            outputs[i] = output
+    return outputs
+
+# Spacy augmentor whose queries are augmented in the micro-batches of the server
+class BatchedAugmentor(processor.Augmentor):
+    def __init__(self, aug: processor.SpacyAugmentor, batcher: MicroBatcher):
+        self.aug = aug
+        self.batcher = batcher
+
+    def process(self, q: query.Query, num: int,
+                debug: bool, silence: bool, lang: set[str] | None, **kwargs) -> object:
+        return self.process_batch([q], num, debug, silence, lang)[0]
+
+    def process_batch(self, queries: list[query.Query], num: int,
+                      debug: bool, silence: bool, lang: set[str] | None, **kwargs) -> list[object]:
+        self.aug.check_vtypes()
+        return self.batcher.submit([(self.aug, q) for q in queries]).result()
+
+    def parse_output(self, output: object) -> query.QueryVariantSet:
+        return self.aug.parse_output(output)
+
+    def records_of(self, output: object) -> list[object]:
+        return self.aug.records_of(output)
+
+# Async context manager of the client shared by all requests, as expected of `create_client`.
+# The client is created on the event loop of the server when first used
+class SharedClient(object):
+    def __init__(self, service: 'Service'):
+        self.service = service
+
+    async def __aenter__(self) -> object:
+        if self.service.client is None:
+            from ..openai import agent
+            self.service.client = agent.create_async()
+        return self.service.client
+
+    async def __aexit__(self, *exc):
+        pass
+
+# Writer collecting the queries kept by validate.run
+class ListWriter(object):
+    def __init__(self):
+        self.records: list[BaseModel] = []
+
+    def write(self, r: BaseModel):
+        self.records.append(r)
+
+class Service(object):
+    def __init__(self, langs: set[str], silence: bool, batch_size: int, batch_wait: float,
+                 concurrency: int, retries: int, pack_size: int, cache: object | None,
+                 synonym_cache_size: int):
+        from ..spacy import wordnet
+
+        self.config = conf.load()
+        self.silence = silence
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.pack_size = pack_size
+        self.cache = cache
+        self.synonym_cache_size = synonym_cache_size
+
+        # Full pipelines, any variant type may be asked for
+        self.langs = sorted(langs)
+        with ThreadPoolExecutor(max_workers = max(1, len(self.langs))) as pool:
+            models = pool.map(lambda lng: wordnet.create(self.config.langs[lng].model, silence), self.langs)
+            self.apis: dict[str, object] = dict(zip(self.langs, models))
+        self.batcher = MicroBatcher(lambda items: augment_items(items, batch_size), batch_size, batch_wait)
+
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target = self.loop.run_forever, name = 'aquda-loop', daemon = True).start()
+        self.client = None
+
+        # Augmentors by engine and variant types, created on first request
+        self.augmentors: dict[tuple[str, frozenset[query.VariantType]], processor.Augmentor] = dict()
+        self.lock = threading.Lock()
+        metrics.add_source('batcher', self.batcher.stats)
+        metrics.add_source('synonym_caches', wordnet.cache_stats)
+
+    def shared_client(self) -> SharedClient:
+        return SharedClient(self)
+
+    def augmentor(self, engine: str, vtypes: set[query.VariantType]) -> processor.Augmentor:
+        key = (engine, frozenset(vtypes))
+        with self.lock:
+            aug = self.augmentors.get(key)
+            if aug is None:
+                aug = self.create_augmentor(engine, vtypes)
+                self.augmentors[key] = aug
+        return aug
+
+    def create_augmentor(self, engine: str, vtypes: set[query.VariantType]) -> processor.Augmentor:
+        if engine == 'spacy':
+            # The indexes the variant types require, before the first query needs them
+            for lng, nlp in self.apis.items():
+                processor.load_indexes(self.config, lng, nlp, vtypes, self.silence)
+            aug = processor.SpacyAugmentor(self.apis, vtypes, self.synonym_cache_size)
+            aug.check_vtypes()
+            return BatchedAugmentor(aug, self.batcher)
+        elif engine == 'hybrid':
+            local, remote = processor.split_vtypes(vtypes)
+            return processor.HybridAugmentor(self.create_augmentor('spacy', local) if len(local) > 0 else None,
+                                             self.create_augmentor('openai', remote) if len(remote) > 0 else None)
+        elif engine == 'openai':
+            return processor.get('openai', vtypes, set(self.langs), self.silence, self.concurrency,
+                                 self.retries, self.cache, pack_size = self.pack_size,
+                                 create_client = self.shared_client, loop = self.loop)
+        raise ValueError(f'Unknown augmentation engine: {engine}')
+
+    def augment(self, request: protocol.AugmentRequest) -> query.QueryVariantSet:
+        unknown = set(request.augmentors) - query.PARAMS
+        if len(unknown) > 0:
+            raise ValueError(f'Unknown augmentors: {sorted(unknown)}, expected any of {sorted(query.PARAMS)}')
+        if request.engine in {'spacy', 'hybrid'}:
+            missing = set(q.lang for q in request.queries) - set(self.apis)
+            if len(missing) > 0:
+                raise ValueError(f'No Spacy model loaded for {sorted(missing)}, the server has {self.langs}')
+
+        aug = self.augmentor(request.engine, set(map(query.from_str, request.augmentors)))
+        outputs = aug.process_batch(request.queries, request.size, False, True, set(request.lang) or None,
+                                    batch_size = self.batch_size)
+        out = query.QueryVariantSet(queries = [qv for output in outputs for qv in aug.parse_output(output).queries])
+        metrics.count('augment.queries', len(request.queries))
+        metrics.count('augment.variants', sum(len(qv.variants) for qv in out.queries))
+        return out
+
+    def generate(self, request: protocol.GenerateRequest) -> protocol.GenerateResponse:
+        from ..openai import shards
+
+        langs = set(request.lang)
+        budget = request.max_requests if request.max_requests > 0 else \
+            shards.default_budget(langs, request.size, request.shard_size)
+        written: list[query.Query] = []
+
+        # The keys seen are kept in SQLite, used by the thread which connected to it only
+        async def generate() -> list[shards.Target]:
+            with dedup.SeenSet() as seen:
+                return await shards.generate(
+                    self.shared_client, langs, request.size, request.topic, request.shard_size,
+                    self.concurrency, budget, self.retries, request.no_prompt_prefix, True, seen,
+                    written.append, self.cache)
+
+        targets = asyncio.run_coroutine_threadsafe(generate(), self.loop).result()
+        metrics.count('gen.queries', len(written))
+        return protocol.GenerateResponse(queries = written,
+                                         missing = {t.lang: t.size - t.accepted for t in targets
+                                                    if t.accepted < t.size})
+
+    def validate(self, request: protocol.ValidateRequest) -> protocol.ValidateResponse:
+        from ..text import validate
+
+        # validate.run streams a file in two passes
+        fd, path = tempfile.mkstemp(prefix = 'aquda-validate-', suffix = '.jsonl')
+        os.close(fd)
+        try:
+            with storage.open_writer(path, 'jsonl') as writer:
+                for r in request.queries:
+                    writer.write(r.output(r.variants))
+            kept = ListWriter()
+            report = validate.run(path, 'jsonl', kept, request.similarity, chunk_size = 1000)
+        finally:
+            os.remove(path)
+        return protocol.ValidateResponse(
+            queries = [query.Record.model_validate(r.model_dump()) for r in kept.records],
+            report = report.model_dump(exclude = {'input'}))
+
+    def health(self) -> dict:
+        return {
+            'status': 'ok',
+            'langs': self.langs,
+            'models': {lng: self.config.langs[lng].model for lng in self.langs},
+            'augmentors': sorted(f'{engine}:{",".join(sorted(v.name.lower() for v in vtypes))}'
+                                 for engine, vtypes in self.augmentors),
+            **metrics.METRICS.report()
+        }
+
+    def close(self):
+        self.batcher.close()
+        for aug in self.augmentors.values():
+            aug.close()
+        if self.client is not None:
+            asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+ROUTES: dict[str, tuple[type[BaseModel], Callable[['Service', BaseModel], BaseModel]]] = {
+    '/augment': (protocol.AugmentRequest, Service.augment),
+    '/generate': (protocol.GenerateRequest, Service.generate),
+    '/validate': (protocol.ValidateRequest, Service.validate),
+}
+
+class Handler(BaseHTTPRequestHandler):
+    # Connections are kept alive, the client sends many requests over one
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self.reply(404, protocol.ErrorResponse(error = f'Unknown path: {self.path}'))
+        self.reply(200, json.dumps(self.server.service.health(), default = str))
+
+    def do_POST(self):
+        route = ROUTES.get(self.path)
+        if route is None:
+            return self.reply(404, protocol.ErrorResponse(error = f'Unknown path: {self.path}'))
+        model, handle = route
+        metrics.count('server.requests')
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            with metrics.timer(f'server{self.path.replace("/", ".")}'):
+                out = handle(self.server.service, model.model_validate_json(body))
+        except ValueError as e:
+            # Bad requests, also those pydantic rejects
+            metrics.count('server.errors')
+            return self.reply(400, protocol.ErrorResponse(error = str(e)))
+        except Exception as e:
+            metrics.count('server.errors')
+            print(f'{colour.RED}Failed {self.path}:{colour.DEFAULT} {e!r}')
+            return self.reply(500, protocol.ErrorResponse(error = repr(e)))
+        self.reply(200, out)
+
+    def reply(self, status: int, body: BaseModel | str):
+        data = (body if isinstance(body, str) else body.model_dump_json()).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args):
+        # Unix socket peers have no address
+        if not self.server.silence:
+            print(f'{colour.GREY_DARK}{self.command} {self.path}: {format % args}{colour.DEFAULT}')
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+def create_server(address: str, service: Service, silence: bool) -> socketserver.BaseServer:
+    scheme, target = client.address_of(address)
+    if scheme == 'unix':
+        # A socket left over by a server which did not shut down cleanly, nothing else is replaced
+        if os.path.exists(target):
+            if not stat.S_ISSOCK(os.stat(target).st_mode):
+                raise ValueError(f'Cannot listen on {target}, it exists and is not a socket')
+            os.remove(target)
+        server = UnixHTTPServer(target, Handler)
+    else:
+        server = ThreadingHTTPServer(target, Handler)
+    server.service = service
+    server.silence = silence
+    return server
+
+# Until interrupted
+def serve(address: str, service: Service, silence: bool):
+    server = create_server(address, service, silence)
+    print(f'{colour.CYAN}Serving {service.langs} on:{colour.DEFAULT} {address}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        scheme, target = client.address_of(address)
+        if scheme == 'unix' and os.path.exists(target):
+            os.remove(target)
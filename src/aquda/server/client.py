@@ -0,0 +1,168 @@
+import http.client
+import itertools
+import json
+import os
+import socket
+from urllib.parse import urlparse
+from pydantic import BaseModel
+
+from . import protocol
+from ..text import query, storage
+from ..cli import colour, metrics
+
+# Thin client of the augmentation server, see `app`: -aug, -gen and -validate with --server
+# read and write the query files here and leave the models and API clients to the server.
+
+def address_of(address: str) -> tuple[str, str | tuple[str, int]]:
+    # http://<host>:<port> or unix://<path of the socket>
+    parsed = urlparse(address)
+    if parsed.scheme == 'unix':
+        return 'unix', parsed.netloc + parsed.path
+    if parsed.scheme == 'http':
+        return 'http', (parsed.hostname or '127.0.0.1', parsed.port or 80)
+    raise ValueError(f'Unsupported server address: {address}, expected http://<host>:<port> or unix://<path>')
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float | None = None):
+        super().__init__('localhost', timeout = timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class Client(object):
+    # Without `timeout`, requests wait as long as the server takes, e.g. for a large -gen
+    def __init__(self, address: str, timeout: float | None = None):
+        self.address = address
+        self.scheme, self.target = address_of(address)
+        self.timeout = timeout
+        self.connection = None
+
+    def connect(self) -> http.client.HTTPConnection:
+        if self.connection is None:
+            if self.scheme == 'unix':
+                self.connection = UnixConnection(self.target, self.timeout)
+            else:
+                self.connection = http.client.HTTPConnection(*self.target, timeout = self.timeout)
+        return self.connection
+
+    def request(self, method: str, path: str, body: BaseModel | None = None) -> bytes:
+        data = body.model_dump_json().encode('utf-8') if body is not None else None
+        # The connection is kept alive between requests, once reopened if the server closed it meanwhile
+        for attempt in range(2):
+            connection = self.connect()
+            try:
+                connection.request(method, path, body = data, headers = {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                content = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt == 1:
+                    raise
+        if response.status != 200:
+            raise ValueError(f'Server {self.address} failed {method} {path} ({response.status}): '
+                             f'{protocol.ErrorResponse.model_validate_json(content).error}')
+        return content
+
+    def health(self) -> dict:
+        return json.loads(self.request('GET', '/health'))
+
+    def augment(self, request: protocol.AugmentRequest) -> query.QueryVariantSet:
+        return query.QueryVariantSet.model_validate_json(self.request('POST', '/augment', request))
+
+    def generate(self, request: protocol.GenerateRequest) -> protocol.GenerateResponse:
+        return protocol.GenerateResponse.model_validate_json(self.request('POST', '/generate', request))
+
+    def validate(self, request: protocol.ValidateRequest) -> protocol.ValidateResponse:
+        return protocol.ValidateResponse.model_validate_json(self.request('POST', '/validate', request))
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self) -> 'Client':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# The input is sent chunk by chunk, the outputs are written as they come back
+def augment_file(address: str, silence: bool, size: int, input_path: str, output_path: str | None,
+                 engine: str, augmentors: list[str], lang: list[str] | None,
+                 read_format: str | None = None, write_format: str | None = None,
+                 chunk_size: int = 1000) -> int:
+    input_path = os.path.expanduser(input_path)
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f'File not found: {input_path}')
+    if not silence:
+        print(f'Augmenting query file: {input_path} with {engine} on {address}')
+
+    with Client(address) as client, storage.open_writer(output_path, write_format) as writer:
+        for chunk in itertools.batched(storage.read(input_path, query.Query, read_format), chunk_size):
+            with metrics.timer('client.augment'):
+                out = client.augment(protocol.AugmentRequest(
+                    queries = list(chunk), augmentors = augmentors, engine = engine, size = size,
+                    lang = list(lang or [])))
+            metrics.count('augment.queries', len(chunk))
+            for qv in out.queries:
+                metrics.count('augment.variants', len(qv.variants))
+                writer.write(qv)
+            writer.flush()
+    return writer.count
+
+def generate_file(address: str, silence: bool, size: int, topic: str, lang: list[str],
+                  output_path: str | None, no_prompt_prefix: bool,
+                  write_format: str | None = None, shard_size: int = 50, max_requests: int = 0) -> int:
+    if not silence:
+        print(f'Generating {size} queries in {lang} on {address}')
+    with Client(address) as client:
+        out = client.generate(protocol.GenerateRequest(
+            lang = sorted(lang), size = size, topic = topic, shard_size = shard_size,
+            max_requests = max_requests, no_prompt_prefix = no_prompt_prefix))
+    with storage.open_writer(output_path, write_format) as writer:
+        for q in out.queries:
+            writer.write(q)
+    metrics.count('gen.queries', writer.count)
+
+    for lng, missing in out.missing.items():
+        print(f'{colour.HIGHLIGHTED_GREY_LIGHT}WARNING:{colour.DEFAULT} {missing} queries missing in {lng} '
+              f'within the request budget, raise --max-requests for more')
+    return writer.count
+
+# Near-duplicates are found across the whole input, so it is sent at once
+def validate_file(address: str, silence: bool, input_path: str | None, output_path: str | None,
+                  report_path: str | None = None, similarity: float = 0.8,
+                  read_format: str | None = None, write_format: str | None = None) -> int:
+    if input_path is None:
+        raise ValueError('Requiring an input path via `--read` argument.')
+    input_path = os.path.expanduser(input_path)
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f'File not found: {input_path}')
+    if not silence:
+        print(f'Validating query file: {input_path} on {address}')
+
+    with Client(address) as client:
+        out = client.validate(protocol.ValidateRequest(
+            queries = list(storage.read(input_path, query.Record, read_format)), similarity = similarity))
+    report = out.report | {'input': input_path}
+    if output_path is not None:
+        with storage.open_writer(output_path, write_format) as writer:
+            for r in out.queries:
+                writer.write(r.output(r.variants))
+    if report_path is not None:
+        with open(os.path.expanduser(report_path), 'w', encoding = 'utf-8') as f:
+            json.dump(report, f, indent = 2)
+
+    if not silence:
+        print(f'{colour.CYAN}Queries:{colour.DEFAULT} {report["queries"]}, {report["dropped_queries"]} dropped, '
+              f'issues: {report["query_issues"]}')
+        print(f'{colour.CYAN}Variants:{colour.DEFAULT} {report["variants"]}, {report["dropped_variants"]} dropped, '
+              f'issues: {report["variant_issues"]}')
+        if output_path is not None:
+            print(f'Valid queries written to {output_path}')
+    return report['dropped_queries'] + report['dropped_variants']
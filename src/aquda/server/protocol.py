@@ -0,0 +1,44 @@
+from pydantic import BaseModel
+
+from ..text import query
+
+# Bodies of the requests to the augmentation server and of its responses, as JSON.
+# The client imports them too, so nothing heavy (spacy, openai, numpy) is imported here.
+
+DEFAULT_ADDRESS = 'http://127.0.0.1:8765'
+
+class AugmentRequest(BaseModel):
+    queries: list[query.Query]
+    # CLI -a parameters, see query.PARAMS
+    augmentors: list[str] = ['lemma']
+    engine: str = 'spacy'
+    size: int = 10
+    # Languages to translate into, for `transl`
+    lang: list[str] = []
+
+class GenerateRequest(BaseModel):
+    lang: list[str]
+    size: int = 10
+    topic: str = 'sport'
+    shard_size: int = 50
+    # 0 for the default budget, see shards.default_budget
+    max_requests: int = 0
+    no_prompt_prefix: bool = False
+
+class GenerateResponse(BaseModel):
+    queries: list[query.Query]
+    # Languages short of `size` within the budget, with the number of queries missing
+    missing: dict[str, int] = {}
+
+class ValidateRequest(BaseModel):
+    queries: list[query.Record]
+    similarity: float = 0.8
+
+class ValidateResponse(BaseModel):
+    # Queries which pass all checks, with their valid variants
+    queries: list[query.Record]
+    # See validate.Report
+    report: dict
+
+class ErrorResponse(BaseModel):
+    error: str
@@ -1,9 +1,31 @@
 from pydantic import BaseModel
+from pydantic_core import from_json
 from typing import Optional
 
+# Number of tokens per language to keep synonyms of, see wordnet.SynonymCache
+SYNONYM_CACHE_SIZE = 100_000
+# Number of lookups per language kept by the WordNet and spelling indexes,
+# see synsets.SynsetIndex and symspell.SpellingIndex
+LOOKUP_CACHE_SIZE = 100_000
+
 class LangConf(BaseModel):
     model: str
+    # Directory of the nearest-neighbour index of the model word vectors,
+    # defaults to a directory named after the model under neighbours.DEFAULT_DIR
+    neighbours: Optional[str] = None
+    # Directory of the word vectors shared by worker processes,
+    # defaults to a directory named after the model under shared.DEFAULT_DIR
+    vectors: Optional[str] = None
+    # Directory of the WordNet index of hypernyms and hyponyms of the language,
+    # defaults to a directory named after the language under synsets.DEFAULT_DIR
+    synsets: Optional[str] = None
+    # Directory of the spelling index of the model vocabulary,
+    # defaults to a directory named after the model under symspell.DEFAULT_DIR
+    spelling: Optional[str] = None
 
 class Conf(BaseModel):
     langs: dict[str, LangConf]
 
+def load(path: str = 'spacy.conf') -> Conf:
+    with open(path, 'r') as f:
+        return Conf.model_validate(from_json(f.read()))
@@ -0,0 +1,111 @@
+import hashlib
+import itertools
+import os
+import sqlite3
+from collections.abc import Iterable, Iterator
+
+import spacy
+from spacy.tokens import DocBin
+
+from ..cli import colour, metrics
+
+DB_NAME = 'docs.sqlite'
+# Keys looked up per statement, below the SQLite limit of bound parameters
+LOOKUP_SIZE = 500
+
+# The pipeline a Doc was parsed by: model name and version, Spacy version and the components
+# loaded, which depend on the variant types (see wordnet.excluded_pipes)
+def model_of(nlp: object) -> str:
+    meta = nlp.meta
+    return f'{meta["lang"]}_{meta["name"]}-{meta["version"]}/spacy-{spacy.__version__}/{",".join(nlp.pipe_names)}'
+
+def key_of(model: str, text: str) -> bytes:
+    return hashlib.blake2b(f'{model}\0{text}'.encode('utf-8'), digest_size = 16).digest()
+
+# Parsed queries on disk. The queries parsed together are stored in one DocBin,
+# as loading a DocBin costs about a millisecond however few docs it holds.
+# Worker processes open the same file, each with a connection of its own
+class DocCache(object):
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout = 60)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS bins (id INTEGER PRIMARY KEY, value BLOB NOT NULL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS docs ('
+                        'key BLOB PRIMARY KEY, bin INTEGER NOT NULL, position INTEGER NOT NULL) WITHOUT ROWID')
+        self.db.commit()
+        # nlp.meta is rebuilt on every access
+        self.models: dict[object, str] = dict()
+
+    def model(self, nlp: object) -> str:
+        model = self.models.get(nlp)
+        if model is None:
+            model = self.models[nlp] = model_of(nlp)
+        return model
+
+    # Bin and position of each key found
+    def find(self, keys: list[bytes]) -> dict[bytes, tuple[int, int]]:
+        found = dict()
+        for part in itertools.batched(keys, LOOKUP_SIZE):
+            for key, bin_id, position in self.db.execute(
+                    f'SELECT key, bin, position FROM docs WHERE key IN ({",".join("?" * len(part))})', part):
+                found[key] = (bin_id, position)
+        return found
+
+    def load(self, nlp: object, bin_ids: set[int]) -> dict[int, list[object]]:
+        docs = dict()
+        for part in itertools.batched(sorted(bin_ids), LOOKUP_SIZE):
+            for bin_id, value in self.db.execute(
+                    f'SELECT id, value FROM bins WHERE id IN ({",".join("?" * len(part))})', part):
+                docs[bin_id] = list(DocBin().from_bytes(value).get_docs(nlp.vocab))
+        return docs
+
+    def put(self, keys: list[bytes], docs: list[object]):
+        with self.db:
+            bin_id = self.db.execute('INSERT INTO bins (value) VALUES (?)',
+                                     (DocBin(docs = docs).to_bytes(),)).lastrowid
+            self.db.executemany('INSERT OR IGNORE INTO docs VALUES (?, ?, ?)',
+                                [(k, bin_id, i) for i, k in enumerate(keys)])
+
+    # Same as nlp.pipe(texts), the parser only runs on the texts not parsed before
+    def pipe(self, nlp: object, texts: Iterable[str], batch_size: int = 256, n_process: int = 1) -> Iterator[object]:
+        model = self.model(nlp)
+        texts = list(texts)
+        keys = [key_of(model, text) for text in texts]
+        found = self.find(keys)
+        loaded = self.load(nlp, set(bin_id for bin_id, _ in found.values()))
+        metrics.count('doc_cache.hits', sum(k in found for k in keys))
+        metrics.count('doc_cache.misses', sum(k not in found for k in keys))
+
+        parsed = nlp.pipe((text for text, k in zip(texts, keys) if k not in found),
+                          batch_size = batch_size, n_process = n_process)
+        added_keys, added_docs = [], []
+        for i, k in enumerate(keys):
+            if k in found:
+                bin_id, position = found[k]
+                doc = loaded[bin_id][position]
+            else:
+                doc = next(parsed)
+                added_keys.append(k)
+                added_docs.append(doc)
+            # Stored every batch and before the last doc, callers stop at it as in zip()
+            if len(added_docs) >= batch_size or (i == len(keys) - 1 and len(added_docs) > 0):
+                self.put(added_keys, added_docs)
+                added_keys, added_docs = [], []
+            yield doc
+
+    def close(self):
+        self.db.close()
+
+def path_of(cache_dir: str) -> str:
+    cache_dir = os.path.expanduser(cache_dir)
+    os.makedirs(cache_dir, exist_ok = True)
+    return os.path.join(cache_dir, DB_NAME)
+
+# Hits and misses are counted by the worker processes too, see metrics.Metrics.merge
+def print_stats(path: str):
+    counters = metrics.METRICS.counters
+    size = sum(os.path.getsize(p) for p in (path, f'{path}-wal') if os.path.exists(p))
+    print(f'{colour.CYAN}Doc cache:{colour.DEFAULT} {counters.get("doc_cache.hits", 0)} hits, '
+          f'{counters.get("doc_cache.misses", 0)} misses ({size / 1e6:.1f} MB) in {path}')
@@ -0,0 +1,141 @@
+import json
+import os
+import numpy as np
+from spacy.attrs import NORM
+
+from ..cli import colour
+
+# Top-k nearest neighbours of every word vector of a Spacy model,
+# precomputed once by brute force and memory-mapped afterwards.
+#
+# <dir>/neighbours.npy  uint64 [n_rows, k]  keys of the neighbours of each vector row, most similar first
+# <dir>/scores.npy      float16 [n_rows, k] cosine similarities
+# <dir>/meta.json       model and vector table the index was built from
+
+DEFAULT_DIR = '~/.cache/aquda/neighbours'
+# Vectors compared with all others at a time. Each one takes 12 bytes per vector of the model
+# (similarities and their argpartition), e.g. 256 rows of 500k vectors take 1.5 GB
+DEFAULT_BLOCK = 256
+
+# Loaded indexes by model name, see `model_name`
+INDEXES: dict[str, 'NeighbourIndex'] = dict()
+
+def model_name(nlp: object) -> str:
+    return f'{nlp.meta["lang"]}_{nlp.meta["name"]}'
+
+def default_path(model: str) -> str:
+    # `model` may also be a path to the model directory
+    return os.path.join(os.path.expanduser(DEFAULT_DIR), os.path.basename(os.path.normpath(model)))
+
+def meta_of(nlp: object, k: int) -> dict:
+    return {
+        'model': model_name(nlp),
+        'version': nlp.meta['version'],
+        'shape': list(nlp.vocab.vectors.shape),
+        'keys': len(nlp.vocab.vectors.key2row),
+        'k': k
+    }
+
+class NeighbourIndex(object):
+    def __init__(self, neighbours: np.ndarray, scores: np.ndarray, meta: dict):
+        self.neighbours = neighbours
+        self.scores = scores
+        self.meta = meta
+        self.k = meta['k']
+
+    def rows_of(self, nlp: object, tokens: list[str]) -> np.ndarray:
+        # Row of the token vector as in Token.vector, or -1 without vector
+        key2row = nlp.vocab.vectors.key2row
+        by_norm = nlp.vocab.vectors.attr == NORM
+        return np.array([key2row.get(nlp.vocab[t].norm if by_norm else nlp.vocab[t].orth, -1)
+                         for t in tokens], dtype = np.int64)
+
+    # Same output as brute-force `wordnet.similar_of`, in one gather over the whole `tokens`
+    def similar_of(self, nlp: object, tokens: list[str], num: int) -> dict[str, set[str]]:
+        tokens = list(tokens)
+        rows = self.rows_of(nlp, tokens)
+        found = rows >= 0
+        neighs = self.neighbours[rows[found], :num]
+
+        out = dict()
+        for token, nkeys in zip((t for t, f in zip(tokens, found) if f), neighs):
+            out[token] = set(nlp.vocab.strings[int(key)].lower() for key in nkeys if key != 0)
+        return out
+
+def build(nlp: object, path: str, k: int, silence: bool, block: int = DEFAULT_BLOCK) -> NeighbourIndex:
+    vectors = nlp.vocab.vectors
+    data = np.asarray(vectors.data, dtype = np.float32)
+
+    # Like Vectors.most_similar, only rows with a key are candidates,
+    # and a row shared by several keys is represented by one of them
+    row2key = {row: key for key, row in vectors.key2row.items()}
+    filled = np.array(sorted(row2key), dtype = np.int64)
+    if len(filled) < k:
+        raise ValueError(f'Cannot index {k} neighbours, only {len(filled)} vectors in {model_name(nlp)}')
+    filled_keys = np.array([row2key[row] for row in filled], dtype = np.uint64)
+
+    # The only copy of the table, normalised in place block by block
+    unit = data[filled]
+    for start in range(0, len(unit), block):
+        part = unit[start:start + block]
+        norms = np.linalg.norm(part, axis = 1, keepdims = True)
+        norms[norms == 0] = 1
+        part /= norms
+
+    os.makedirs(path, exist_ok = True)
+    neighbours = np.lib.format.open_memmap(os.path.join(path, 'neighbours.npy'), mode = 'w+',
+                                           dtype = np.uint64, shape = (data.shape[0], k))
+    scores = np.lib.format.open_memmap(os.path.join(path, 'scores.npy'), mode = 'w+',
+                                       dtype = np.float16, shape = (data.shape[0], k))
+    for start in range(0, len(filled), block):
+        rows = filled[start:start + block]
+        sims = unit[start:start + block] @ unit.T
+        best = np.argpartition(sims, -k, axis = 1)[:, -k:]
+        best_scores = np.take_along_axis(sims, best, axis = 1)
+        order = np.argsort(-best_scores, axis = 1)
+        neighbours[rows] = filled_keys[np.take_along_axis(best, order, axis = 1)]
+        scores[rows] = np.take_along_axis(best_scores, order, axis = 1)
+        # Freed before the next block is computed, not after
+        del sims, best
+        if not silence:
+            print(f'\r{colour.CYAN}Indexed{colour.DEFAULT} {min(start + block, len(filled))}/{len(filled)} vectors', end = '')
+    if not silence:
+        print()
+    neighbours.flush()
+    scores.flush()
+
+    meta = meta_of(nlp, k)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent = 2)
+    return load(nlp, path)
+
+def load(nlp: object, path: str) -> NeighbourIndex:
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    expected = meta_of(nlp, meta['k'])
+    if meta != expected:
+        raise ValueError(f'Neighbour index at {path} was built from a different model: {meta} (expected {expected})')
+    return NeighbourIndex(
+        np.load(os.path.join(path, 'neighbours.npy'), mmap_mode = 'r'),
+        np.load(os.path.join(path, 'scores.npy'), mmap_mode = 'r'),
+        meta
+    )
+
+# Make the index serve `wordnet.similar_of` of this model
+def register(nlp: object, index: NeighbourIndex):
+    INDEXES[model_name(nlp)] = index
+
+def get(nlp: object) -> NeighbourIndex | None:
+    return INDEXES.get(model_name(nlp))
+
+# Recall of the index against brute-force Vectors.most_similar, on `sample` random vectors
+def verify(nlp: object, index: NeighbourIndex, num: int, sample: int, seed: int = 0) -> float:
+    vectors = nlp.vocab.vectors
+    keys = np.array(list(vectors.key2row.keys()), dtype = np.uint64)
+    keys = np.random.default_rng(seed).choice(keys, size = min(sample, len(keys)), replace = False)
+    rows = np.array([vectors.key2row[int(key)] for key in keys])
+
+    expected, _, _ = vectors.most_similar(np.asarray(vectors.data)[rows].copy(), n = num)
+    actual = index.neighbours[rows, :num]
+    hits = sum(len(set(e.tolist()) & set(a.tolist())) for e, a in zip(expected, actual))
+    return hits / (len(rows) * num)
@@ -0,0 +1,65 @@
+import json
+import os
+import numpy as np
+
+from . import neighbours
+from ..cli import colour
+
+# Word vectors of a Spacy model, exported once to disk and memory-mapped
+# by every worker process of the language. The pages of the table are
+# shared through the OS page cache instead of being copied into each worker.
+#
+# <dir>/vectors      float32 [n_rows, dim], as saved by spacy Vectors.to_disk
+# <dir>/key2row      msgpack
+# <dir>/vectors.cfg
+# <dir>/meta.json    model and vector table the export was made from
+
+DEFAULT_DIR = '~/.cache/aquda/vectors'
+
+def default_path(model: str) -> str:
+    # `model` may also be a path to the model directory
+    return os.path.join(os.path.expanduser(DEFAULT_DIR), os.path.basename(os.path.normpath(model)))
+
+def meta_of(nlp: object) -> dict:
+    return {
+        'model': neighbours.model_name(nlp),
+        'version': nlp.meta['version'],
+        'shape': list(nlp.vocab.vectors.shape),
+        'keys': len(nlp.vocab.vectors.key2row)
+    }
+
+def exists(path: str) -> bool:
+    return os.path.exists(os.path.join(path, 'meta.json'))
+
+def export(nlp: object, path: str, silence: bool):
+    vectors = nlp.vocab.vectors
+    if vectors.mode != 'default':
+        raise ValueError(f'Cannot share {vectors.mode} vectors of {neighbours.model_name(nlp)}')
+    if not silence:
+        print(f'{colour.CYAN}Exporting word vectors:{colour.DEFAULT} {path}')
+    os.makedirs(path, exist_ok = True)
+    vectors.to_disk(path, exclude = ['strings'])
+    # Written last, an interrupted export is not mistaken for a complete one
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta_of(nlp), f, indent = 2)
+
+# Same as `export`, from a model which is not loaded yet
+def export_model(model: str, path: str, silence: bool):
+    from . import wordnet
+    export(wordnet.create(model, silence, set()), path, silence)
+
+# Attach the exported vectors to a model loaded without them, see `wordnet.create`
+def attach(nlp: object, path: str):
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    if meta['model'] != neighbours.model_name(nlp) or meta['version'] != nlp.meta['version']:
+        raise ValueError(f'Word vectors at {path} were exported from a different model: '
+                         f'{meta["model"]} {meta["version"]} (expected {neighbours.model_name(nlp)} '
+                         f'{nlp.meta["version"]}). Remove the directory to export them again.')
+
+    vectors = nlp.vocab.vectors
+    vectors.from_disk(path, exclude = ['strings', 'vectors'])
+    # Read-only, so that no worker gets a private copy of a page
+    vectors.data = np.load(os.path.join(path, 'vectors'), mmap_mode = 'r')
+    if meta_of(nlp) != meta:
+        raise ValueError(f'Word vectors at {path} do not match the model: {meta} (expected {meta_of(nlp)})')
@@ -0,0 +1,310 @@
+import hashlib
+import json
+import os
+import numpy as np
+from collections import OrderedDict
+
+from . import conf, neighbours
+from ..cli import colour
+
+# Spelling correction with symmetric deletes (SymSpell, https://github.com/wolfgarbe/SymSpell):
+# every word of the vocabulary is indexed under all strings made by deleting up to MAX_DISTANCE
+# characters from its prefix. A misspelled word and its correction share such a delete,
+# so candidates are found by lookups of the deletes of the misspelled word alone,
+# then ranked by edit distance and frequency.
+#
+# <dir>/words.npy           uint64 [n_words]    hashes of the words, sorted
+# <dir>/deletes.npy         uint64 [n_deletes]  hashes of the deletes, sorted
+# <dir>/delete_words.npy    int32 [n_deletes]   word of each delete
+# <dir>/strings.npy         uint8 [n_bytes]     UTF-8 of the words by frequency, concatenated
+# <dir>/string_offsets.npy  int64 [n_words + 1] word i is strings[offsets[i]:offsets[i + 1]]
+# <dir>/meta.json           model and vocabulary the index was built from
+
+VERSION = 1
+DEFAULT_DIR = '~/.cache/aquda/spelling'
+MAX_DISTANCE = 2
+# Only deletes of the prefix are indexed, which bounds the number of deletes per word
+PREFIX = 7
+# Words kept from the vocabulary, the most frequent ones
+MAX_WORDS = 100_000
+# Shorter words are neither corrected nor misspelled
+MIN_LENGTH = 3
+
+# Kinds of misspellings
+ADJACENT = 'adjacent'
+TRANSPOSE = 'transpose'
+DELETE = 'delete'
+DOUBLE = 'double'
+EDITS = [ADJACENT, TRANSPOSE, DELETE, DOUBLE]
+
+# Keys next to each other on a QWERTY keyboard, as typos go.
+# Other scripts are only misspelled by transposition, deletion and doubling
+KEYBOARD = ['qwertyuiop', 'asdfghjkl', 'zxcvbnm']
+
+def adjacent_keys() -> dict[str, str]:
+    adjacent = dict()
+    for r, row in enumerate(KEYBOARD):
+        for c, key in enumerate(row):
+            keys = [row[i] for i in (c - 1, c + 1) if 0 <= i < len(row)]
+            for other in (r - 1, r + 1):
+                if 0 <= other < len(KEYBOARD):
+                    keys += [KEYBOARD[other][i] for i in (c - 1, c, c + 1) if 0 <= i < len(KEYBOARD[other])]
+            adjacent[key] = ''.join(keys)
+    return adjacent
+
+ADJACENT_KEYS = adjacent_keys()
+
+# Loaded indexes by model name, see `neighbours.model_name`
+INDEXES: dict[str, 'SpellingIndex'] = dict()
+# and by model, as the name is looked up for every query and `nlp.meta` is rebuilt on each access
+RESOLVED: dict[object, 'SpellingIndex'] = dict()
+
+def default_path(model: str) -> str:
+    # `model` may also be a path to the model directory
+    return os.path.join(os.path.expanduser(DEFAULT_DIR), os.path.basename(os.path.normpath(model)))
+
+def exists(path: str) -> bool:
+    return os.path.exists(os.path.join(path, 'meta.json'))
+
+def hash_of(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size = 8).digest(), 'little')
+
+def deletes_of(word: str, distance: int) -> set[str]:
+    # The word itself and all strings with up to `distance` characters deleted
+    out = {word}
+    edge = {word}
+    for _ in range(distance):
+        edge = {w[:i] + w[i + 1:] for w in edge for i in range(len(w))} - out
+        out |= edge
+    return out
+
+# Optimal string alignment distance (Damerau-Levenshtein without repeated edits of a substring),
+# or `limit + 1` once it is known to be above `limit`
+def distance_of(a: str, b: str, limit: int) -> int:
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # Only the differing middle of the words is aligned, typos keep most of a word
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if len(a) == 0 or len(b) == 0:
+        return max(len(a), len(b))
+    # Cells further than `limit` from the diagonal are above `limit` anyway
+    big = limit + 1
+    prev2 = None
+    prev = [j if j <= limit else big for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        row = [big] * (len(b) + 1)
+        if i <= limit:
+            row[0] = i
+        smallest = row[0]
+        ai = a[i - 1]
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            bj = b[j - 1]
+            d = prev[j - 1] if ai == bj else prev[j - 1] + 1
+            if prev[j] + 1 < d:
+                d = prev[j] + 1
+            if row[j - 1] + 1 < d:
+                d = row[j - 1] + 1
+            if i > 1 and j > 1 and ai == b[j - 2] and a[i - 2] == bj and prev2[j - 2] + 1 < d:
+                d = prev2[j - 2] + 1
+            row[j] = d
+            if d < smallest:
+                smallest = d
+        if smallest > limit:
+            return big
+        prev2, prev = prev, row
+    return prev[-1] if prev[-1] <= limit else big
+
+def is_word(token: str) -> bool:
+    return len(token) >= MIN_LENGTH and token.isalpha()
+
+class SpellingIndex(object):
+    def __init__(self, words: np.ndarray, deletes: np.ndarray, delete_words: np.ndarray,
+                 strings: np.ndarray, string_offsets: np.ndarray, meta: dict):
+        self.words = words
+        self.deletes = deletes
+        self.delete_words = delete_words
+        self.strings = strings
+        self.string_offsets = string_offsets
+        self.meta = meta
+        # LRU of the corrections done so far, the same tokens come up again and again
+        self.memo: OrderedDict[str, str] = OrderedDict()
+
+    def word(self, i: int) -> str:
+        return str(memoryview(self.strings)[self.string_offsets[i]:self.string_offsets[i + 1]], 'utf-8')
+
+    def __contains__(self, word: str) -> bool:
+        key = np.uint64(hash_of(word))
+        i = int(np.searchsorted(self.words, key))
+        return i < len(self.words) and self.words[i] == key
+
+    # The most frequent word of the vocabulary closest to `word` (lowercase),
+    # or `word` itself when known or nothing is close enough
+    def correct(self, word: str) -> str:
+        corrected = self.memo.get(word)
+        if corrected is not None:
+            self.memo.move_to_end(word)
+            return corrected
+        corrected = word
+        if is_word(word) and word not in self:
+            # Short words are closer to many others, they are corrected by 1 edit at most
+            limit = 1 if len(word) <= 4 else self.meta['max_distance']
+            keys = np.array([hash_of(d) for d in deletes_of(word[:self.meta['prefix']], limit)],
+                            dtype = np.uint64)
+            starts = np.searchsorted(self.deletes, keys, side = 'left')
+            ends = np.searchsorted(self.deletes, keys, side = 'right')
+            # Candidates by frequency, the first one at the smallest distance wins
+            candidates = np.unique(np.concatenate(
+                [self.delete_words[s:e] for s, e in zip(starts.tolist(), ends.tolist()) if e > s] or
+                [np.empty(0, dtype = np.int32)]))
+            best = limit + 1
+            for i in candidates.tolist():
+                candidate = self.word(i)
+                d = distance_of(word, candidate, best - 1) if best > 1 else best
+                if d < best:
+                    corrected, best = candidate, d
+                    if best == 1:
+                        break
+        self.memo[word] = corrected
+        if len(self.memo) > conf.LOOKUP_CACHE_SIZE:
+            self.memo.popitem(last = False)
+        return corrected
+
+# Lowercase words of the vocabulary of a model, the most frequent first.
+# The vector tables of `_lg` models are in the order of frequency of their words
+def vocabulary(nlp: object, max_words: int) -> list[str]:
+    vectors = nlp.vocab.vectors
+    keys = [key for key, _ in sorted(vectors.key2row.items(), key = lambda e: e[1])]
+    words = dict()
+    for key in keys:
+        word = nlp.vocab.strings[key].lower()
+        if is_word(word):
+            words.setdefault(word, None)
+            if len(words) == max_words:
+                break
+    return list(words)
+
+def build(nlp: object, path: str, silence: bool, max_words: int = MAX_WORDS,
+          max_distance: int = MAX_DISTANCE, prefix: int = PREFIX) -> 'SpellingIndex':
+    words = vocabulary(nlp, max_words)
+    if len(words) == 0:
+        raise ValueError(f'No words to index in the vocabulary of {neighbours.model_name(nlp)}')
+
+    delete_keys, delete_words = [], []
+    for i, word in enumerate(words):
+        for d in deletes_of(word[:prefix], max_distance):
+            delete_keys.append(hash_of(d))
+            delete_words.append(i)
+    delete_keys = np.array(delete_keys, dtype = np.uint64)
+    delete_words = np.array(delete_words, dtype = np.int32)
+    # Words of the same delete stay in order of frequency
+    order = np.lexsort((delete_words, delete_keys))
+
+    encoded = [w.encode('utf-8') for w in words]
+    os.makedirs(path, exist_ok = True)
+    np.save(os.path.join(path, 'words.npy'), np.sort(np.array([hash_of(w) for w in words], dtype = np.uint64)))
+    np.save(os.path.join(path, 'deletes.npy'), delete_keys[order])
+    np.save(os.path.join(path, 'delete_words.npy'), delete_words[order])
+    np.save(os.path.join(path, 'strings.npy'), np.frombuffer(b''.join(encoded), dtype = np.uint8))
+    np.save(os.path.join(path, 'string_offsets.npy'),
+            np.concatenate([[0], np.cumsum([len(e) for e in encoded])]).astype(np.int64))
+
+    meta = meta_of(nlp, len(words), max_distance, prefix)
+    # Written last, an interrupted build is not mistaken for a complete one
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent = 2)
+    if not silence:
+        print(f'{colour.CYAN}Indexed {len(words)} words of {meta["model"]}:{colour.DEFAULT} {len(delete_keys)} deletes')
+    return load(nlp, path)
+
+def meta_of(nlp: object, words: int, max_distance: int, prefix: int) -> dict:
+    return {
+        'version': VERSION,
+        'model': neighbours.model_name(nlp),
+        'model_version': nlp.meta['version'],
+        'words': words,
+        'max_distance': max_distance,
+        'prefix': prefix
+    }
+
+def load(nlp: object, path: str) -> SpellingIndex:
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    expected = meta_of(nlp, meta['words'], meta['max_distance'], meta['prefix'])
+    if meta != expected:
+        raise ValueError(f'Spelling index at {path} was built from a different model: {meta} (expected {expected})')
+    # Still memory-mapped, without the overhead of np.memmap on every lookup
+    column = lambda name: np.load(os.path.join(path, name + '.npy'), mmap_mode = 'r').view(np.ndarray)
+    return SpellingIndex(column('words'), column('deletes'), column('delete_words'),
+                         column('strings'), column('string_offsets'), meta)
+
+def register(nlp: object, index: SpellingIndex):
+    INDEXES[neighbours.model_name(nlp)] = index
+    RESOLVED.clear()
+
+def clear():
+    INDEXES.clear()
+    RESOLVED.clear()
+
+def get(nlp: object) -> SpellingIndex:
+    index = RESOLVED.get(nlp)
+    if index is None:
+        index = INDEXES.get(neighbours.model_name(nlp))
+        if index is None:
+            raise ValueError(f'No spelling index loaded for {neighbours.model_name(nlp)}')
+        RESOLVED[nlp] = index
+    return index
+
+# Random numbers of misspellings, drawn from a hash of the text so that the same text
+# is misspelled alike in every run and process, and much cheaper to seed than `random`
+class Draws(object):
+    def __init__(self, text: str):
+        self.bytes = hashlib.blake2b(text.encode('utf-8'), digest_size = 64).digest()
+        self.i = 0
+
+    def below(self, n: int) -> int:
+        # Bytes are reused once all drawn, misspellings of a text are only a few
+        b = self.bytes[self.i % len(self.bytes)]
+        self.i += 1
+        return b % n
+
+def misspell(word: str, edit: str, draws: Draws) -> str | None:
+    i = draws.below(len(word))
+    if edit == ADJACENT:
+        keys = ADJACENT_KEYS.get(word[i].lower())
+        if keys is None:
+            return None
+        key = keys[draws.below(len(keys))]
+        return word[:i] + (key.upper() if word[i].isupper() else key) + word[i + 1:]
+    elif edit == TRANSPOSE:
+        i = min(i, len(word) - 2)
+        if word[i] == word[i + 1]:
+            return None
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    elif edit == DELETE:
+        return word[:i] + word[i + 1:]
+    elif edit == DOUBLE:
+        return word[:i + 1] + word[i] + word[i + 1:]
+    raise ValueError(f'Unknown misspelling: {edit}')
+
+# Up to `num` distinct (token index, misspelled token) of `tokens`, the same for the same tokens
+def misspellings(tokens: list[str], num: int) -> list[tuple[int, str]]:
+    words = [i for i, t in enumerate(tokens) if is_word(t)]
+    if len(words) == 0:
+        return []
+    draws = Draws(' '.join(tokens))
+    out = dict()
+    # Each edit in turn, a few attempts more as some edits don't apply to every word
+    for attempt in range(num * 3):
+        i = words[draws.below(len(words))]
+        misspelled = misspell(tokens[i], EDITS[attempt % len(EDITS)], draws)
+        if misspelled is not None and misspelled != tokens[i]:
+            out.setdefault((i, misspelled), None)
+            if len(out) == num:
+                break
+    return list(out)
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import numpy as np
+from collections import OrderedDict
+
+from . import conf
+from ..cli import colour
+
+# Hypernyms and hyponyms of every lemma of a language in WordNet (NLTK, with the
+# Open Multilingual Wordnet for other languages than English), precomputed once
+# from the synsets of the lemma and memory-mapped afterwards.
+#
+# <dir>/keys.npy              uint64 [n_keys]        hash of (WordNet POS, lemma), sorted
+# <dir>/<relation>_offsets.npy int64 [n_keys + 1]    related lemmas of key i are ids[offsets[i]:offsets[i + 1]]
+# <dir>/<relation>_ids.npy    int32 [n_related]      index in the string table, most common sense first
+# <dir>/strings.npy           uint8 [n_bytes]        UTF-8 of all related lemmas, concatenated
+# <dir>/string_offsets.npy    int64 [n_strings + 1]
+# <dir>/meta.json             language and WordNet version the index was built from
+#
+# <relation> is one of RELATIONS.
+
+VERSION = 1
+DEFAULT_DIR = '~/.cache/aquda/synsets'
+RELATIONS = ['hypernym', 'hyponym']
+
+# Related lemmas kept per (POS, lemma) and relation
+MAX_RELATED = 16
+
+# Spacy language code -> Open Multilingual Wordnet language code.
+# NOTE: Not all languages have a wordnet in OMW, e.g. German has none.
+OMW_LANGS = {
+    'en': 'eng',
+    'bg': 'bul',
+    'ca': 'cat',
+    'da': 'dan',
+    'el': 'ell',
+    'es': 'spa',
+    'eu': 'eus',
+    'fi': 'fin',
+    'fr': 'fra',
+    'gl': 'glg',
+    'he': 'heb',
+    'hr': 'hrv',
+    'id': 'ind',
+    'is': 'isl',
+    'it': 'ita',
+    'ja': 'jpn',
+    'lt': 'lit',
+    'nb': 'nob',
+    'nl': 'nld',
+    'pl': 'pol',
+    'pt': 'por',
+    'ro': 'ron',
+    'sk': 'slk',
+    'sl': 'slv',
+    'sq': 'als',
+    'sv': 'swe',
+    'th': 'tha',
+    'zh': 'cmn'
+}
+
+# Loaded indexes by language
+INDEXES: dict[str, 'SynsetIndex'] = dict()
+
+def default_path(lang: str) -> str:
+    return os.path.join(os.path.expanduser(DEFAULT_DIR), lang)
+
+def exists(path: str) -> bool:
+    return os.path.exists(os.path.join(path, 'meta.json'))
+
+def key_of(pos: str, lemma: str) -> int:
+    return int.from_bytes(hashlib.blake2b(f'{pos}\0{lemma}'.encode('utf-8'), digest_size = 8).digest(), 'little')
+
+class SynsetIndex(object):
+    def __init__(self, keys: np.ndarray, relations: dict[str, tuple[np.ndarray, np.ndarray]],
+                 strings: np.ndarray, string_offsets: np.ndarray, meta: dict):
+        self.keys = keys
+        self.relations = relations
+        self.strings = strings
+        self.string_offsets = string_offsets
+        self.meta = meta
+        # LRU of the lookups done so far, the same lemmas come up again and again
+        self.memo: OrderedDict[tuple[str, str, str], list[str]] = OrderedDict()
+
+    def text(self, i: int) -> str:
+        return str(memoryview(self.strings)[self.string_offsets[i]:self.string_offsets[i + 1]], 'utf-8')
+
+    # Up to `num` lemmas related to `lemma` (lowercase) by `relation`, most common sense first
+    def related(self, relation: str, pos: str, lemma: str, num: int) -> list[str]:
+        memo_key = (relation, pos, lemma)
+        found = self.memo.get(memo_key)
+        if found is not None:
+            self.memo.move_to_end(memo_key)
+            return found[:num]
+        key = np.uint64(key_of(pos, lemma))
+        i = int(np.searchsorted(self.keys, key))
+        found = []
+        if i < len(self.keys) and self.keys[i] == key:
+            offsets, ids = self.relations[relation]
+            found = [self.text(int(j)) for j in ids[offsets[i]:offsets[i + 1]]]
+        self.memo[memo_key] = found
+        if len(self.memo) > conf.LOOKUP_CACHE_SIZE:
+            self.memo.popitem(last = False)
+        return found[:num]
+
+def lemma_of(name: str) -> str:
+    # WordNet joins the words of a lemma with underscores
+    return name.replace('_', ' ')
+
+# `wn` is the NLTK WordNet corpus reader, which needs the wordnet corpus
+# (and omw-1.4 for other languages than English) downloaded with nltk.download()
+def build(lang: str, path: str, silence: bool, wn: object | None = None,
+          max_related: int = MAX_RELATED) -> SynsetIndex:
+    if wn is None:
+        from nltk.corpus import wordnet as wn
+    if lang not in OMW_LANGS:
+        raise ValueError(f'No WordNet language code known for {lang}, supported: {sorted(OMW_LANGS)}')
+    omw = OMW_LANGS[lang]
+    if omw not in wn.langs():
+        raise ValueError(f'No WordNet of {lang} ({omw}) in the installed corpora. Download them with '
+                         f'`python -m nltk.downloader wordnet omw-1.4`')
+
+    # (pos, lemma) -> relation -> related lemma -> rank, the most common senses of the lemma first.
+    # Sense counts are only known for English, elsewhere synsets are in WordNet order
+    related: dict[tuple[str, str], dict[str, dict[str, tuple[int, int]]]] = dict()
+    order = 0
+    for synset in wn.all_synsets():
+        lemmas = synset.lemmas(lang = omw)
+        if len(lemmas) == 0:
+            continue
+        # Adjective satellites are adjectives to the tagger
+        pos = 'a' if synset.pos() == 's' else synset.pos()
+        by_relation = {
+            'hypernym': [lemma_of(n) for s in synset.hypernyms() + synset.instance_hypernyms()
+                         for n in s.lemma_names(lang = omw)],
+            'hyponym': [lemma_of(n) for s in synset.hyponyms() + synset.instance_hyponyms()
+                        for n in s.lemma_names(lang = omw)]
+        }
+        for lemma in lemmas:
+            name = lemma_of(lemma.name()).lower()
+            entry = related.setdefault((pos, name), {r: dict() for r in RELATIONS})
+            rank = (-lemma.count(), order)
+            for relation, names in by_relation.items():
+                for n in names:
+                    if n.lower() != name:
+                        entry[relation][n] = min(entry[relation].get(n, rank), rank)
+        order += 1
+
+    keys = np.array([key_of(pos, name) for pos, name in related], dtype = np.uint64)
+    if len(np.unique(keys)) != len(keys):
+        raise ValueError(f'Hash collision among the lemmas of {lang}')
+    sorted_entries = [entry for _, entry in sorted(zip(keys.tolist(), related.values()), key = lambda e: e[0])]
+    keys.sort()
+
+    strings: dict[str, int] = dict()
+    columns = dict()
+    for relation in RELATIONS:
+        offsets = [0]
+        ids = []
+        for entry in sorted_entries:
+            ranked = sorted(entry[relation], key = lambda n: entry[relation][n])[:max_related]
+            ids.extend(strings.setdefault(n, len(strings)) for n in ranked)
+            offsets.append(len(ids))
+        columns[f'{relation}_offsets'] = np.array(offsets, dtype = np.int64)
+        columns[f'{relation}_ids'] = np.array(ids, dtype = np.int32)
+    encoded = [s.encode('utf-8') for s in strings]
+    columns['strings'] = np.frombuffer(b''.join(encoded), dtype = np.uint8)
+    columns['string_offsets'] = np.concatenate([[0], np.cumsum([len(e) for e in encoded])]).astype(np.int64)
+    columns['keys'] = keys
+
+    os.makedirs(path, exist_ok = True)
+    for name, column in columns.items():
+        np.save(os.path.join(path, name + '.npy'), column)
+    meta = {
+        'version': VERSION,
+        'lang': lang,
+        'omw': omw,
+        'wordnet': wn.get_version(),
+        'keys': len(keys),
+        'max_related': max_related
+    }
+    # Written last, an interrupted build is not mistaken for a complete one
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent = 2)
+    if not silence:
+        print(f'{colour.CYAN}Indexed {len(keys)} lemmas of {lang}:{colour.DEFAULT} ' + \
+              ', '.join([f'{len(columns[f"{r}_ids"])} {r}s' for r in RELATIONS]))
+    return load(path)
+
+def load(path: str) -> SynsetIndex:
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    if meta['version'] != VERSION:
+        raise ValueError(f'Unsupported WordNet index version {meta["version"]} at {path}, build it again')
+    column = lambda name: np.load(os.path.join(path, name + '.npy'), mmap_mode = 'r')
+    return SynsetIndex(
+        column('keys'),
+        {r: (column(f'{r}_offsets'), column(f'{r}_ids')) for r in RELATIONS},
+        column('strings'),
+        column('string_offsets'),
+        meta
+    )
+
+def register(lang: str, index: SynsetIndex):
+    INDEXES[lang] = index
+
+def get(lang: str) -> SynsetIndex:
+    index = INDEXES.get(lang)
+    if index is None:
+        raise ValueError(f'No WordNet index loaded for language {lang}')
+    return index
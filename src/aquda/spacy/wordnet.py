@@ -1,13 +1,33 @@
 import spacy
 import numpy as np
+from collections import OrderedDict
 
-from ..text import query
-from ..cli import colour
+from . import conf, neighbours, synsets, symspell
+from ..text import query, records
+from ..cli import colour, metrics
 
-def create(model: str, silence: bool) -> object:
+# Pipeline components which are left out, unless a variant type needs them
+OPTIONAL_PIPES = {'parser', 'ner'}
+REQUIRED_PIPES: dict[query.VariantType, set[str]] = {
+    query.VariantType.NER_SYN: {'ner'},
+}
+
+def excluded_pipes(vtypes: set[query.VariantType] | None) -> list[str]:
+    if vtypes is None:
+        return []
+    required = set().union(*[REQUIRED_PIPES.get(v, set()) for v in vtypes])
+    return sorted(OPTIONAL_PIPES - required)
+
+# Without `vtypes`, the full pipeline is loaded.
+# Without `vectors`, the word vectors are left out to be attached later, see `shared.attach`
+def create(model: str, silence: bool, vtypes: set[query.VariantType] | None = None,
+           vectors: bool = True) -> object:
+    exclude = excluded_pipes(vtypes) + ([] if vectors else ['vectors'])
     if not silence:
-        print(f'{colour.CYAN}Loading Spacy model:{colour.DEFAULT} {model}')
-    nlp = spacy.load(model)
+        print(f'{colour.CYAN}Loading Spacy model:{colour.DEFAULT} {model}' + \
+              (f' (without {", ".join(exclude)})' if len(exclude) > 0 else ''))
+    with metrics.timer('spacy.load'):
+        nlp = spacy.load(model, exclude = exclude)
     return nlp
 
 def get_spacer(lang: str) -> str:
@@ -17,7 +37,8 @@ def get_spacer(lang: str) -> str:
         return ' '
     
 def vector_of(nlp: object, token: str) -> np.array:
-    return nlp(token).vector
+    # Same as nlp(token).vector of a single token, without running the pipeline
+    return nlp.vocab.get_vector(token)
 
 def index_of(nlp: object, token: str) -> int:
     return nlp.vocab.strings[token]
@@ -25,7 +46,13 @@ def index_of(nlp: object, token: str) -> int:
 def str_from_index(nlp: object, idx: int) -> str:
     return nlp.vocab.strings[idx]
 
+@metrics.timed('spacy.similar_of')
 def similar_of(nlp: object, tokens: set[str], num: int=2) -> dict[str, set[str]]:
+    # Served from the prebuilt neighbour index when there is one
+    index = neighbours.get(nlp)
+    if index is not None and num <= index.k:
+        return index.similar_of(nlp, tokens, num)
+
     out = dict()
 
     # https://spacy.io/api/vectors#most_similar
@@ -46,46 +73,107 @@ def similar_of(nlp: object, tokens: set[str], num: int=2) -> dict[str, set[str]]
 
     return out
 
-def ner(nlp: object, text: str) -> list[str]:
-    return list(nlp(text).ents)
+# Bounded LRU of (token, number of neighbours) -> cleaned synonyms
+class SynonymCache(object):
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries: OrderedDict[tuple[str, int], list[str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-def lemmatize(lang: str, nlp: object, text: str) -> query.QueryVariant:
-    doc = nlp(text)
-    lemma = get_spacer(lang).join([token.lemma_ for token in doc])
-    return query.QueryVariant(
-        original = text,
-        lang = lang,
-        variants = [
-            query.VariantElement(
-                text = lemma,
-                lang = lang,
-                variant_type = query.VariantType.LEMMA
-            )
-        ]
-    )
-
-def synonym_repl(lang: str, nlp: object, text: str) -> query.QueryVariant:
-    doc = nlp(text)
-    words = list(token.text for token in doc)
-    similar_words: dict[str, list[str]] = similar_of(nlp, words, num=4)
+    def get(self, key: tuple[str, int]) -> list[str] | None:
+        synonyms = self.entries.get(key)
+        if synonyms is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return synonyms
+
+    def put(self, key: tuple[str, int], synonyms: list[str]):
+        self.entries[key] = synonyms
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last = False)
+            self.evictions += 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+# One cache per language, as each language has its own model
+SYNONYM_CACHES: dict[str, SynonymCache] = dict()
+
+def synonym_cache(lang: str) -> SynonymCache:
+    if lang not in SYNONYM_CACHES:
+        SYNONYM_CACHES[lang] = SynonymCache(conf.SYNONYM_CACHE_SIZE)
+    return SYNONYM_CACHES[lang]
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    return { lang: cache.stats() for lang, cache in SYNONYM_CACHES.items() }
+
+def synonyms_of(lang: str, nlp: object, tokens: list[str], num: int) -> dict[str, list[str]]:
+    cache = synonym_cache(lang)
+    out = dict()
+    missing = []
+    for token in dict.fromkeys(tokens):
+        # The synonyms depend on the number of neighbours asked for
+        synonyms = cache.get((token, num))
+        if synonyms is None:
+            missing.append(token)
+        else:
+            out[token] = synonyms
+    if len(missing) == 0:
+        return out
+
+    similar_words: dict[str, set[str]] = similar_of(nlp, missing, num=num)
 
     # Clean similar words
     # - Lemmatize
     # - Remove duplicates
-    def clean(w: str, swords: list[str]) -> list[str]:
-        return list(set(sw.lemma_ for sw in nlp(get_spacer(lang).join(swords)) if sw.lemma_ != w))
+    # The neighbours of all missing tokens are lemmatized in one pass
+    spacer = get_spacer(lang)
+    docs = nlp.pipe(spacer.join(sorted(swords)) for swords in similar_words.values())
+    for (w, swords), doc in zip(similar_words.items(), docs):
+        out[w] = sorted(set(sw.lemma_ for sw in doc if sw.lemma_ != w))
+
+    # Tokens without vectors have no synonyms
+    for w in missing:
+        cache.put((w, num), out.setdefault(w, []))
+    return out
+
+def ner(nlp: object, text: str) -> list[str]:
+    return list(nlp(text).ents)
+
+# `doc` may be passed in when the text was already parsed, e.g. by nlp.pipe()
+def lemmatize(lang: str, nlp: object, text: str, doc: object | None = None) -> records.QueryVariant:
+    doc = doc if doc is not None else nlp(text)
+    lemma = get_spacer(lang).join([token.lemma_ for token in doc])
+    return records.QueryVariant(text, lang, [
+        records.VariantElement(lemma, lang, query.VariantType.LEMMA)
+    ])
+
+def synonym_repl(lang: str, nlp: object, text: str, doc: object | None = None) -> records.QueryVariant:
+    doc = doc if doc is not None else nlp(text)
+    words = list(token.text for token in doc)
 
     """
-    similar_words: expanded synonyms or close neighbours through vectorspace.
-    They could look like:
-
-    {'best': ['most', 'great', 'good'],
-    'Christmas': ['christmas', 'valentine', 'xmas', 'easter'],
-    'gifts': ['gift', 'valentines', 'gifting'],
-    'for': ['make', 'and', 'with'],
-    'kids': ['kid', 'child', 'toddler']}
+    similar_words: expanded synonyms or close neighbours through vectorspace,
+    lemmatized and deduplicated. They could look like:
+
+    {'best': ['good', 'great', 'most'],
+    'Christmas': ['christmas', 'easter', 'valentine', 'xmas'],
+    'gifts': ['gift', 'gifting', 'valentines'],
+    'for': ['and', 'make', 'with'],
+    'kids': ['child', 'kid', 'toddler']}
     """
-    similar_words = { w: clean(w, swords) for w, swords in similar_words.items() }
+    similar_words: dict[str, list[str]] = synonyms_of(lang, nlp, words, num=4)
 
     # Only these POSes will be expanded with synonyms
     REPL_POS = {'DT', 'CC', 'IN', 'JJ', 'JJS', 'JJR', 'NN', 'NNS', 'NNP', 'NNPS', 
@@ -93,22 +181,87 @@ def synonym_repl(lang: str, nlp: object, text: str) -> query.QueryVariant:
                 'VBP', 'VBZ'}
 
     # POS tag + NER and replacement of other synnonyms
-    output = query.QueryVariant(
-        original = text,
-        lang = lang,
-        variants = []
-        )
+    output = records.QueryVariant(text, lang, [])
+    spacer = get_spacer(lang)
     ttokens = [tok.text for tok in doc] # text tokens
     for i, tok in enumerate(doc):
-        if tok.tag_ in REPL_POS:
-            if tok.text in similar_words:
-                for syn in similar_words[tok.text]:
-                    variant = query.VariantElement(
-                        text = get_spacer(lang).join(ttokens[:i] + [syn] + ttokens[i+1:]),
-                        lang = lang,
-                        variant_type = query.VariantType.SYN_REPL
-                    )
-                    output.variants.append(variant)
+        if tok.tag_ in REPL_POS and len(similar_words.get(tok.text, [])) > 0:
+            # Text around the replaced token is the same for all its synonyms
+            head = spacer.join(ttokens[:i]) + spacer if i > 0 else ''
+            tail = spacer + spacer.join(ttokens[i+1:]) if i < len(ttokens) - 1 else ''
+            for syn in similar_words[tok.text]:
+                output.variants.append(records.VariantElement(head + syn + tail, lang, query.VariantType.SYN_REPL))
     
     return output
 
+# WordNet POS by universal POS tag, and by Penn Treebank tag prefix for taggers without one
+WORDNET_POS = {'NOUN': 'n', 'PROPN': 'n', 'VERB': 'v', 'ADJ': 'a', 'ADV': 'r'}
+WORDNET_TAG_PREFIXES = {'NN': 'n', 'VB': 'v', 'JJ': 'a', 'RB': 'r'}
+
+# Related lemmas to replace each token with
+RELATED_PER_TOKEN = 3
+
+def wordnet_pos(token: object) -> str | None:
+    if token.pos_:
+        return WORDNET_POS.get(token.pos_)
+    return WORDNET_TAG_PREFIXES.get(token.tag_[:2])
+
+# Each token replaced by the lemmas related to it in WordNet, see `synsets`
+def related_repl(lang: str, nlp: object, text: str, doc: object | None,
+                 relation: str, vtype: query.VariantType) -> records.QueryVariant:
+    index = synsets.get(lang)
+    doc = doc if doc is not None else nlp(text)
+
+    output = records.QueryVariant(text, lang, [])
+    spacer = get_spacer(lang)
+    ttokens = [tok.text for tok in doc] # text tokens
+    for i, tok in enumerate(doc):
+        pos = wordnet_pos(tok)
+        if pos is None:
+            continue
+        related = index.related(relation, pos, tok.lemma_.lower(), RELATED_PER_TOKEN)
+        if len(related) == 0:
+            continue
+        head = spacer.join(ttokens[:i]) + spacer if i > 0 else ''
+        tail = spacer + spacer.join(ttokens[i+1:]) if i < len(ttokens) - 1 else ''
+        for r in related:
+            output.variants.append(records.VariantElement(head + r + tail, lang, vtype))
+    return output
+
+def hypernym_repl(lang: str, nlp: object, text: str, doc: object | None = None) -> records.QueryVariant:
+    return related_repl(lang, nlp, text, doc, 'hypernym', query.VariantType.HYPERNYM)
+
+def hyponym_repl(lang: str, nlp: object, text: str, doc: object | None = None) -> records.QueryVariant:
+    return related_repl(lang, nlp, text, doc, 'hyponym', query.VariantType.HYPONYM)
+
+# Misspellings per query, besides the correction of misspelled queries
+MISSPELLINGS_PER_QUERY = 4
+
+def case_of(token: str, word: str) -> str:
+    if token.isupper():
+        return word.upper()
+    return word.capitalize() if token[:1].isupper() else word
+
+# The query with misspelled words corrected from the vocabulary of the model, if any,
+# and misspellings of it as typos go, see `symspell`
+def spelling(lang: str, nlp: object, text: str, doc: object | None = None) -> records.QueryVariant:
+    index = symspell.get(nlp)
+    doc = doc if doc is not None else nlp(text)
+
+    output = records.QueryVariant(text, lang, [])
+    spacer = get_spacer(lang)
+    ttokens = [tok.text for tok in doc] # text tokens
+    corrected = list(ttokens)
+    for i, t in enumerate(ttokens):
+        if symspell.is_word(t):
+            lower = t.lower()
+            c = index.correct(lower)
+            if c != lower:
+                corrected[i] = case_of(t, c)
+    if corrected != ttokens:
+        output.variants.append(records.VariantElement(spacer.join(corrected), lang, query.VariantType.SPELLING))
+    for i, misspelled in symspell.misspellings(ttokens, MISSPELLINGS_PER_QUERY):
+        head = spacer.join(ttokens[:i]) + spacer if i > 0 else ''
+        tail = spacer + spacer.join(ttokens[i+1:]) if i < len(ttokens) - 1 else ''
+        output.variants.append(records.VariantElement(head + misspelled + tail, lang, query.VariantType.SPELLING))
+    return output
@@ -0,0 +1,155 @@
+import hashlib
+import os
+from collections.abc import Iterable, Iterator
+from pydantic import BaseModel
+
+from ..text import query
+
+# Progress of an augmentation run, kept next to its output file.
+# Only whole chunks are committed: `queries` input queries are done,
+# and their `records` output records end at byte `offset` of the output.
+class Manifest(BaseModel):
+    input: str
+    engine: str
+    augmentors: list[str]
+    size: int
+    format: str
+    queries: int = 0
+    records: int = 0
+    offset: int = 0
+    # Running sha256 over (lang, original) of the first `queries` input queries
+    digest: str = hashlib.sha256().hexdigest()
+    complete: bool = False
+    # With `-aug --shard`, the input queries are those of shard `shard` of `shards`, see `shard_of`.
+    # `source_queries` and `source_digest` are of all queries of the input file, as `digest`,
+    # and `output_digest` is the checksum of the complete output, see `checksum_of`
+    shard: int = 0
+    shards: int = 1
+    # Spacy model of each language, and the OpenAI model
+    models: dict[str, str] = {}
+    source_queries: int = 0
+    source_digest: str = ''
+    output_digest: str = ''
+
+def path_of(output_path: str) -> str:
+    return os.path.expanduser(output_path) + '.manifest.json'
+
+def create(input_path: str, engine: str, augmentor: set[query.VariantType],
+           size: int, fmt: str, shard: int = 0, shards: int = 1,
+           models: dict[str, str] | None = None) -> Manifest:
+    return Manifest(
+        input = os.path.abspath(os.path.expanduser(input_path)),
+        engine = engine,
+        augmentors = sorted(v.name for v in augmentor),
+        size = size,
+        format = fmt,
+        shard = shard,
+        shards = shards,
+        models = models or {}
+    )
+
+def load(path: str) -> Manifest | None:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return Manifest.model_validate_json(f.read())
+
+def save(manifest: Manifest, path: str):
+    # Atomic replace, a crash never leaves a partially written manifest
+    with open(path + '.tmp', 'w') as f:
+        f.write(manifest.model_dump_json(indent = 2))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+# Raises when the checkpoint was made by a different run configuration
+def check(manifest: Manifest, expected: Manifest):
+    for field in ['input', 'engine', 'augmentors', 'size', 'format', 'shard', 'shards', 'models']:
+        if getattr(manifest, field) != getattr(expected, field):
+            raise ValueError(f'Cannot resume, {field} differs from the checkpoint: '
+                             f'{getattr(manifest, field)} (checkpoint) != {getattr(expected, field)}')
+
+def update(digest: object, q: query.Query):
+    digest.update(q.lang.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(q.original.encode('utf-8'))
+    digest.update(b'\0')
+
+# `i/N` of --shard, with 0 <= i < N
+def parse_shard(value: str) -> tuple[int, int]:
+    try:
+        shard, shards = map(int, value.split('/'))
+    except ValueError:
+        raise ValueError(f'Invalid shard: {value}, expected i/N, e.g. 0/4')
+    if not 0 <= shard < shards:
+        raise ValueError(f'Invalid shard: {value}, expected 0 <= i < N')
+    return shard, shards
+
+# Stable across processes, machines and Python versions, unlike hash()
+def shard_of(q: query.Query, shards: int) -> int:
+    key = hashlib.blake2b(f'{q.lang}\0{q.original}'.encode('utf-8'), digest_size = 8).digest()
+    return int.from_bytes(key, 'big') % shards
+
+# Queries of one shard, while all queries of the input are counted and digested
+class ShardReader(object):
+    def __init__(self, queries: Iterable[query.Query], shard: int, shards: int):
+        self.queries = queries
+        self.shard = shard
+        self.shards = shards
+        self.count = 0
+        self.digest = hashlib.sha256()
+
+    def __iter__(self) -> Iterator[query.Query]:
+        for q in self.queries:
+            self.count += 1
+            update(self.digest, q)
+            if shard_of(q, self.shards) == self.shard:
+                yield q
+
+# sha256 of a file, or of the names and contents of the files of a directory (columnar)
+def checksum_of(path: str) -> str:
+    path = os.path.expanduser(path)
+    digest = hashlib.sha256()
+    files = [path] if not os.path.isdir(path) else \
+        sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    for file in files:
+        if file != path:
+            digest.update(os.path.relpath(file, path).encode('utf-8'))
+            digest.update(b'\0')
+        with open(file, 'rb') as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+# Manifests of the outputs of all shards of one run, in shard order.
+# Raises unless they are complete and intact, and together cover every query of the same input
+def check_shards(output_paths: list[str]) -> list[tuple[str, Manifest]]:
+    shards = []
+    for path in output_paths:
+        manifest = load(path_of(path))
+        if manifest is None:
+            raise ValueError(f'Missing manifest of shard output: {path}')
+        if not manifest.complete:
+            raise ValueError(f'Incomplete shard {manifest.shard}/{manifest.shards}, resume it first: {path}')
+        if checksum_of(path) != manifest.output_digest:
+            raise ValueError(f'Shard output differs from its manifest: {path}')
+        shards.append((path, manifest))
+
+    first = shards[0][1]
+    # Shards may run on different machines, their input files are compared by content
+    for path, manifest in shards:
+        for field in ['shards', 'engine', 'augmentors', 'size', 'models', 'source_queries', 'source_digest']:
+            if getattr(manifest, field) != getattr(first, field):
+                raise ValueError(f'Cannot merge shards, {field} differs: {getattr(manifest, field)} ({path}) '
+                                 f'!= {getattr(first, field)} ({shards[0][0]})')
+
+    shards.sort(key = lambda s: s[1].shard)
+    indexes = [manifest.shard for _, manifest in shards]
+    if indexes != list(range(first.shards)):
+        missing = sorted(set(range(first.shards)) - set(indexes))
+        raise ValueError(f'Cannot merge shards, expected each of 0-{first.shards - 1} once, '
+                         f'missing {missing}, got {indexes}')
+    queries = sum(manifest.queries for _, manifest in shards)
+    if queries != first.source_queries:
+        raise ValueError(f'Cannot merge shards, they hold {queries} of {first.source_queries} input queries')
+    return shards
@@ -0,0 +1,205 @@
+import json
+import os
+import shutil
+import numpy as np
+from collections.abc import Iterator
+from pydantic import BaseModel
+
+from ..text import query, records
+from ..cli import metrics
+
+# Query files stored column-wise, as a directory of .npy files which are memory-mapped when read.
+# Texts are interned in one string table, `lang` and `variant_type` are dictionary-encoded.
+#
+# <dir>/meta.json             version, kind (queries or variants), lang and variant type dictionaries
+# <dir>/strings.npy           uint8 [n_bytes]        UTF-8 of all distinct texts, concatenated
+# <dir>/string_offsets.npy    int64 [n_strings + 1]  text i is strings[offsets[i]:offsets[i + 1]]
+# <dir>/query_text.npy        int64 [n_queries]      string of the original query
+# <dir>/query_lang.npy        uint16 [n_queries]
+# <dir>/variant_offsets.npy   int64 [n_queries + 1]  variants of query i are rows offsets[i]:offsets[i + 1]
+# <dir>/variant_text.npy      int64 [n_variants]
+# <dir>/variant_lang.npy      uint16 [n_variants]
+# <dir>/variant_type.npy      uint8 [n_variants]     index in VARIANT_TYPES
+#
+# The variant columns are only there for files of QueryVariant.
+
+VERSION = 1
+EXTENSION = '.cols'
+
+VARIANT_TYPES = list(query.VariantType)
+VARIANT_CODES = {v: code for code, v in enumerate(VARIANT_TYPES)}
+
+COLUMNS = {
+    'strings': np.uint8,
+    'string_offsets': np.int64,
+    'query_text': np.int64,
+    'query_lang': np.uint16,
+    'variant_offsets': np.int64,
+    'variant_text': np.int64,
+    'variant_lang': np.uint16,
+    'variant_type': np.uint8
+}
+
+def is_columnar(path: str) -> bool:
+    return path.rstrip('/').endswith(EXTENSION) or os.path.exists(os.path.join(path, 'meta.json'))
+
+# Appends each column to a raw file as records come,
+# which become .npy files once the number of rows is known
+class ColumnarWriter(object):
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self.kind = None
+        self.langs: dict[str, int] = dict()
+        self.strings: dict[str, int] = dict()
+        self.string_bytes = 0
+        self.variants = 0
+        os.makedirs(path, exist_ok = True)
+        # An overwritten directory is incomplete until closed
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            os.remove(os.path.join(path, 'meta.json'))
+        self.files = {name: open(self.raw_path(name), 'wb') for name in COLUMNS}
+        self.append('string_offsets', [0])
+        self.append('variant_offsets', [0])
+
+    def raw_path(self, name: str) -> str:
+        return os.path.join(self.path, name + '.raw')
+
+    def append(self, name: str, values: list[int]):
+        self.files[name].write(np.asarray(values, dtype = COLUMNS[name]).tobytes())
+
+    def intern(self, text: str) -> int:
+        index = self.strings.get(text)
+        if index is None:
+            index = self.strings[text] = len(self.strings)
+            encoded = text.encode('utf-8')
+            self.files['strings'].write(encoded)
+            self.string_bytes += len(encoded)
+            self.append('string_offsets', [self.string_bytes])
+        return index
+
+    def lang(self, lang: str) -> int:
+        return self.langs.setdefault(lang, len(self.langs))
+
+    @metrics.timed('io.write')
+    def write(self, record: BaseModel | records.QueryVariant):
+        # The first record decides whether the file has variants
+        if self.kind is None:
+            self.kind = 'variants' if isinstance(record, (query.QueryVariant, records.QueryVariant)) else 'queries'
+        self.append('query_text', [self.intern(record.original)])
+        self.append('query_lang', [self.lang(record.lang)])
+        if self.kind == 'variants':
+            variants = record.variants
+            self.append('variant_text', [self.intern(v.text) for v in variants])
+            self.append('variant_lang', [self.lang(v.lang) for v in variants])
+            self.append('variant_type', [VARIANT_CODES[v.variant_type] for v in variants])
+            self.variants += len(variants)
+            self.append('variant_offsets', [self.variants])
+        self.count += 1
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+    def sync(self) -> int:
+        self.flush()
+        for f in self.files.values():
+            os.fsync(f.fileno())
+        return 0
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        kind = self.kind or 'queries'
+        for name, dtype in COLUMNS.items():
+            raw = self.raw_path(name)
+            if kind == 'queries' and name.startswith('variant_'):
+                os.remove(raw)
+                continue
+            rows = os.path.getsize(raw) // np.dtype(dtype).itemsize
+            with open(os.path.join(self.path, name + '.npy'), 'wb') as out, open(raw, 'rb') as f:
+                np.lib.format.write_array_header_1_0(out, {
+                    'descr': np.lib.format.dtype_to_descr(np.dtype(dtype).newbyteorder('<')),
+                    'fortran_order': False,
+                    'shape': (rows,)
+                })
+                shutil.copyfileobj(f, out)
+            os.remove(raw)
+        # Written last, the directory is only readable once complete
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump({
+                'version': VERSION,
+                'kind': kind,
+                'langs': list(self.langs),
+                'variant_types': [v.name for v in VARIANT_TYPES]
+            }, f, indent = 2)
+
+    def __enter__(self) -> 'ColumnarWriter':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Memory-mapped query file. Columns are numpy arrays which are not read
+# into memory until used, texts are decoded only when accessed.
+class Columns(object):
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != VERSION:
+            raise ValueError(f'Unsupported columnar format version {self.meta["version"]} at {path}')
+        self.kind = self.meta['kind']
+        self.langs: list[str] = self.meta['langs']
+        self.variant_types = [query.VariantType[name] for name in self.meta['variant_types']]
+        for name in COLUMNS:
+            column = os.path.join(path, name + '.npy')
+            setattr(self, name, np.load(column, mmap_mode = 'r') if os.path.exists(column) else None)
+
+    def __len__(self) -> int:
+        return len(self.query_text)
+
+    def text(self, index: int) -> str:
+        return self.texts(np.array([index]))[0]
+
+    def texts(self, indexes: np.ndarray) -> list[str]:
+        # Only the bytes of these texts are read from the string table
+        buf = memoryview(self.strings)
+        starts = self.string_offsets[indexes].tolist()
+        ends = self.string_offsets[indexes + 1].tolist()
+        return [str(buf[s:e], 'utf-8') for s, e in zip(starts, ends)]
+
+    def variants_of(self, i: int) -> list[query.VariantElement]:
+        return [query.VariantElement.model_validate(v) for v in self.records(i, i + 1)[0]['variants']]
+
+    # Queries [start, stop) as dicts of the fields of Query or QueryVariant
+    def records(self, start: int, stop: int) -> list[dict]:
+        originals = self.texts(np.asarray(self.query_text[start:stop]))
+        langs = [self.langs[code] for code in self.query_lang[start:stop].tolist()]
+        records = [{'original': o, 'lang': lang} for o, lang in zip(originals, langs)]
+        if self.kind != 'variants':
+            return records
+
+        offsets = self.variant_offsets[start:stop + 1].tolist()
+        rows = slice(offsets[0], offsets[-1])
+        texts = self.texts(np.asarray(self.variant_text[rows]))
+        vlangs = self.variant_lang[rows].tolist()
+        vtypes = self.variant_type[rows].tolist()
+        base = offsets[0]
+        for record, begin, end in zip(records, offsets[:-1], offsets[1:]):
+            record['variants'] = [
+                {
+                    'text': texts[j - base],
+                    'lang': self.langs[vlangs[j - base]],
+                    'variant_type': self.variant_types[vtypes[j - base]]
+                }
+                for j in range(begin, end)
+            ]
+        return records
+
+    def __iter__(self, block: int = 4096) -> Iterator[dict]:
+        for start in range(0, len(self), block):
+            yield from self.records(start, min(start + block, len(self)))
+
+def open_columns(path: str) -> Columns:
+    return Columns(os.path.expanduser(path))
@@ -0,0 +1,56 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import unicodedata
+
+from ..text import query
+
+# Two queries are duplicates when their normalised (lang, original) are equal:
+# Unicode NFKC, case-folded and with whitespace collapsed
+def normalise(text: str) -> str:
+    return ' '.join(unicodedata.normalize('NFKC', text).casefold().split())
+
+def key_of(q: query.Query) -> bytes:
+    return hashlib.blake2b(f'{normalise(q.lang)}\0{normalise(q.original)}'.encode('utf-8'),
+                           digest_size = 16).digest()
+
+# Set of query keys kept on disk, so memory stays bounded however many queries are seen.
+# Without `path`, a temporary file is used and removed on close.
+class SeenSet(object):
+    def __init__(self, path: str | None = None, tmp_dir: str | None = None):
+        self.tmp = None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix = 'aquda-seen-', suffix = '.sqlite', dir = tmp_dir)
+            os.close(fd)
+            self.tmp = path
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('CREATE TABLE IF NOT EXISTS seen (key BLOB PRIMARY KEY) WITHOUT ROWID')
+        self.size = self.db.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+
+    # True when the query was not seen before, and from now on it is
+    def add(self, q: query.Query) -> bool:
+        added = self.db.execute('INSERT OR IGNORE INTO seen VALUES (?)', (key_of(q),)).rowcount == 1
+        self.size += added
+        return added
+
+    def __contains__(self, q: query.Query) -> bool:
+        return self.db.execute('SELECT 1 FROM seen WHERE key = ?', (key_of(q),)).fetchone() is not None
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+        if self.tmp is not None:
+            os.remove(self.tmp)
+
+    def __enter__(self) -> 'SeenSet':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,10 +1,16 @@
+import asyncio
+import math
+import multiprocessing
+import os
+from collections import defaultdict
 from collections.abc import Callable
-from pydantic_core import from_json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from ..openai import agent
-from ..spacy import wordnet, conf
-from ..text import query
-from ..cli import colour
+from ..spacy import conf
+from ..text import query, records
+from ..cli import colour, metrics
+
+# NOTE: Each engine imports its own heavy dependencies (openai or spacy) only when used
 
 class Augmentor(object):
     def process(self, query: query.Query, num: int, 
@@ -14,15 +20,31 @@ class Augmentor(object):
     def parse_output(self, output: object) -> query.QueryVariantSet:
         pass
 
+    # What to write of an output, the queries of `parse_output` unless the output can be written as it is
+    def records_of(self, output: object) -> list[query.QueryVariant | records.QueryVariant]:
+        return self.parse_output(output).queries
+
+    def process_batch(self, queries: list[query.Query], num: int,
+                      debug: bool, silence: bool, lang: set[str] | None, **kwargs) -> list[object]:
+        # Default batch path, one `process` call per query.
+        # Outputs are in the same order as `queries`, each one to be passed to `parse_output`
+        return [self.process(q, num, debug, silence, lang, **kwargs) for q in queries]
+
+    def close(self):
+        pass
+
 # Generative LLM
 class OpenAIAugmentor(Augmentor):
-    def __init__(self, client: object, vtypes: set[query.VariantType], lang: set[str]):
+    def __init__(self, client: object, vtypes: set[query.VariantType], lang: set[str],
+                 cache: object | None = None):
         self.client = client
         self.vtypes = vtypes
         self.lang = lang
+        self.cache = cache
 
     def process(self, query: query.Query, num: int, 
                 debug: bool, silence: bool, lang: set[str] | None, **kwargs) -> str:
+        from ..openai import agent
         return agent.augment_query(
             self.client,
             query,
@@ -30,38 +52,234 @@ class OpenAIAugmentor(Augmentor):
             num,
             debug,
             silence,
-            lang
+            lang,
+            self.cache
         )
     
     def parse_output(self, completion: object) -> query.QueryVariantSet:
         # taotodo handle error
         return completion.choices[0].message.parsed
 
+# Generative LLM, with many requests in flight at once
+class AsyncOpenAIAugmentor(Augmentor):
+    # `create_client` makes the async client of each batch, defaults to agent.create_async.
+    # With `loop`, batches run on that running event loop instead of a new one each
+    def __init__(self, vtypes: set[query.VariantType], lang: set[str],
+                 concurrency: int, retries: int, cache: object | None = None,
+                 create_client: Callable[[], object] | None = None,
+                 loop: asyncio.AbstractEventLoop | None = None):
+        self.vtypes = vtypes
+        self.lang = lang
+        self.concurrency = concurrency
+        self.retries = retries
+        self.cache = cache
+        self.create_client = create_client
+        self.loop = loop
+
+    def process(self, query: query.Query, num: int, 
+                debug: bool, silence: bool, lang: set[str] | None, **kwargs) -> object:
+        return self.process_batch([query], num, debug, silence, lang)[0]
+
+    def process_batch(self, queries: list[query.Query], num: int,
+                      debug: bool, silence: bool, lang: set[str] | None, **kwargs) -> list[object]:
+        coro = self.augment_all(queries, num, debug, silence, lang)
+        if self.loop is not None:
+            return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+        return asyncio.run(coro)
+
+    async def augment_all(self, queries: list[query.Query], num: int,
+                          debug: bool, silence: bool, lang: set[str] | None) -> list[object]:
+        from ..openai import agent
+
+        # The async client is bound to the running event loop, so it lives
+        # only as long as the batch
+        async with (self.create_client or agent.create_async)() as client:
+            inflight = asyncio.Semaphore(self.concurrency)
+
+            async def augment(q: query.Query) -> object:
+                async with inflight:
+                    return await agent.augment_query_async(
+                        client, q, self.vtypes, num, debug, silence, lang, self.retries, self.cache)
+
+            # gather() keeps the input order
+            return await asyncio.gather(*[augment(q) for q in queries])
+
+    def parse_output(self, completion: object) -> query.QueryVariantSet:
+        return completion.choices[0].message.parsed
+
+# Generative LLM, with many queries per request. Queries the model left out
+# of an answer are sent again in packs half the size, down to one query per request.
+class PackedOpenAIAugmentor(AsyncOpenAIAugmentor):
+    def __init__(self, vtypes: set[query.VariantType], lang: set[str],
+                 concurrency: int, retries: int, pack_size: int, cache: object | None = None,
+                 create_client: Callable[[], object] | None = None,
+                 loop: asyncio.AbstractEventLoop | None = None):
+        super().__init__(vtypes, lang, concurrency, retries, cache, create_client, loop)
+        self.pack_size = pack_size
+        self.queries = 0
+        self.requests = 0
+        self.fallback_requests = 0
+        self.dropped = 0
+        # Characters of the prompts sent, and of the prompts of one query each instead
+        self.prompt_chars = 0
+        self.unpacked_prompt_chars = 0
+        metrics.add_source('packing', self.stats)
+
+    async def augment_all(self, queries: list[query.Query], num: int,
+                          debug: bool, silence: bool, lang: set[str] | None) -> list[object]:
+        from ..openai import agent
+
+        outputs: list[query.QueryVariantSet | None] = [None] * len(queries)
+        async with (self.create_client or agent.create_async)() as client:
+            inflight = asyncio.Semaphore(self.concurrency)
+
+            async def augment(pack: list[int]):
+                self.requests += 1
+                if len(pack) == 1:
+                    q = queries[pack[0]]
+                    async with inflight:
+                        completion = await agent.augment_query_async(
+                            client, q, self.vtypes, num, debug, silence, lang, self.retries, self.cache)
+                    self.prompt_chars += self.unpacked_chars(q, num, lang)
+                    outputs[pack[0]] = completion.choices[0].message.parsed
+                    return
+
+                messages = agent.make_packed_prompts(num, [queries[i] for i in pack], self.vtypes,
+                                                     debug, silence, lang)
+                async with inflight:
+                    completion = await agent.parse_async(client, agent.get_model(), messages,
+                                                         query.PackedVariantSet, self.retries, self.cache)
+                self.prompt_chars += len(messages[-1]['content'])
+
+                # Map the answers back to their queries by index, unknown and repeated indexes are ignored
+                parsed = completion.choices[0].message.parsed
+                for entry in parsed.queries if parsed is not None else []:
+                    if 0 <= entry.index < len(pack) and outputs[pack[entry.index]] is None \
+                            and len(entry.variants) > 0:
+                        q = queries[pack[entry.index]]
+                        outputs[pack[entry.index]] = query.QueryVariantSet(queries = [
+                            query.QueryVariant(original = q.original, lang = q.lang, variants = entry.variants)
+                        ])
+                dropped = [i for i in pack if outputs[i] is None]
+                if len(dropped) > 0:
+                    self.dropped += len(dropped)
+                    size = max(1, len(pack) // 2)
+                    packs = [dropped[start:start + size] for start in range(0, len(dropped), size)]
+                    self.fallback_requests += len(packs)
+                    await asyncio.gather(*[augment(p) for p in packs])
+
+            self.queries += len(queries)
+            self.unpacked_prompt_chars += sum(self.unpacked_chars(q, num, lang) for q in queries)
+            indexes = list(range(len(queries)))
+            await asyncio.gather(*[augment(indexes[start:start + self.pack_size])
+                                   for start in range(0, len(queries), self.pack_size)])
+        return outputs
+
+    def unpacked_chars(self, q: query.Query, num: int, lang: set[str] | None) -> int:
+        from ..openai import agent
+        return len(agent.make_augmenting_prompts(num, q.original, self.vtypes, False, True, lang)[-1]['content'])
+
+    def parse_output(self, output: query.QueryVariantSet) -> query.QueryVariantSet:
+        return output
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            'pack_size': self.pack_size,
+            'queries': self.queries,
+            'requests': self.requests,
+            'fallback_requests': self.fallback_requests,
+            'dropped': self.dropped,
+            # against one request per query
+            'requests_saved': self.queries - self.requests,
+            'prompt_chars': self.prompt_chars,
+            'unpacked_prompt_chars': self.unpacked_prompt_chars,
+            'prompt_chars_saved': self.unpacked_prompt_chars - self.prompt_chars
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f'{colour.CYAN}Packing:{colour.DEFAULT} {stats["queries"]} queries in {stats["requests"]} requests '
+              f'({stats["fallback_requests"]} for {stats["dropped"]} dropped), '
+              f'{stats["prompt_chars_saved"]} prompt characters saved')
+
+# Variant types Spacy augments locally, see `SpacyAugmentor.VMAP`
+SPACY_VTYPES = {
+    query.VariantType.LEMMA,
+    query.VariantType.SYN_REPL,
+    query.VariantType.HYPERNYM,
+    query.VariantType.HYPONYM,
+    query.VariantType.SPELLING,
+}
+
 # Transformer-based (mainly RoBERTa)
 class SpacyAugmentor(Augmentor):
     # NOTE: supports only 1 language, unlike other augmentors
-    def __init__(self, apis: dict[str, object], vtypes: set[query.VariantType]):
+    # With `docs`, queries parsed before are read from that cache instead, see spacy.docs
+    def __init__(self, apis: dict[str, object], vtypes: set[query.VariantType],
+                 synonym_cache_size: int = conf.SYNONYM_CACHE_SIZE, docs: object | None = None):
+        from ..spacy import wordnet
+
         self.apis = apis
-        self.vtypes = vtypes
-        self.VMAP: dict[query.VariantType, Callable[[str, object, str], query.QueryVariant]] = {
+        # Applied in a fixed order, the output must not depend on the hash seed, e.g. when resumed
+        self.vtypes = query.ordered(vtypes)
+        self.docs = docs
+        # Augmentors of other variant types of the same models share their caches
+        for lng in apis:
+            if lng not in wordnet.SYNONYM_CACHES or wordnet.SYNONYM_CACHES[lng].maxsize != synonym_cache_size:
+                wordnet.SYNONYM_CACHES[lng] = wordnet.SynonymCache(synonym_cache_size)
+        self.VMAP: dict[query.VariantType, Callable[[str, object, str, object | None], records.QueryVariant]] = {
             query.VariantType.LEMMA: wordnet.lemmatize,
             query.VariantType.SYN_REPL: wordnet.synonym_repl,
+            query.VariantType.HYPERNYM: wordnet.hypernym_repl,
+            query.VariantType.HYPONYM: wordnet.hyponym_repl,
+            query.VariantType.SPELLING: wordnet.spelling,
         }
         self.SUPPORTED_VTYPES = self.VMAP.keys()
 
     def process(self, q: query.Query, num: int, 
                 debug: bool, silence: bool,
-                lang: set[str] | None, **kwargs) -> query.QueryVariant:
+                lang: set[str] | None, **kwargs) -> records.QueryVariant:
+        # Parsed once for all variant types
+        return self.process_batch([q], num, debug, silence, lang)[0]
+
+    def process_batch(self, queries: list[query.Query], num: int,
+                      debug: bool, silence: bool, lang: set[str] | None,
+                      batch_size: int = 256, n_process: int = 1, **kwargs) -> list[records.QueryVariant]:
+        self.check_vtypes()
+
+        # Group queries by language so each group streams through its own pipeline
+        indexes_by_lang: dict[str, list[int]] = defaultdict(list)
+        for i, q in enumerate(queries):
+            indexes_by_lang[q.lang].append(i)
+
+        outputs: list[records.QueryVariant | None] = [None] * len(queries)
+        for lng, indexes in indexes_by_lang.items():
+            nlp = self.apis[lng]
+            texts = (queries[i].original for i in indexes)
+            # https://spacy.io/api/language#pipe
+            docs = self.docs.pipe(nlp, texts, batch_size, n_process) if self.docs is not None else \
+                nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+            docs = metrics.timed_iter('spacy.parse', docs)
+            for i, doc in zip(indexes, docs):
+                outputs[i] = self.apply(queries[i], doc, debug, silence)
+        return outputs
+
+    def check_vtypes(self):
         if any([v not in self.SUPPORTED_VTYPES for v in self.vtypes]):
-            raise ValueError(f'Some variant types are not supported by Spacy. It only supports any of {self.SUPPORTED_VTYPES}. (Got {self.vtypes} instead)')
-        
+            raise ValueError(f'Some variant types are not supported by Spacy. It only supports any of {self.SUPPORTED_VTYPES}. (Got {self.vtypes} instead, '
+                             f'use --engine=hybrid to augment the others with OpenAI)')
+
+    # Apply all variant types to a query, each given the same parsed `doc`
+    def apply(self, q: query.Query, doc: object | None,
+              debug: bool, silence: bool) -> records.QueryVariant:
         output_variant = None
         if not silence:
             print('────────────────')
         for vtype in self.vtypes:
             if not silence:
                 print(f'{colour.CYAN}Applying {vtype}, lang={q.lang}: {colour.DEFAULT}{q.original}')
-            processed = self.VMAP[vtype](q.lang, self.apis[q.lang], q.original)
+            with metrics.timer(f'augment.{vtype.name.lower()}'):
+                processed = self.VMAP[vtype](q.lang, self.apis[q.lang], q.original, doc)
 
             if debug:
                 print(f'Processing variant = {vtype}, try inspecting `q`, `processed`')
@@ -77,26 +295,278 @@ class SpacyAugmentor(Augmentor):
             print('────────────────')
         return output_variant
     
-    def parse_output(self, output: query.QueryVariant) -> query.QueryVariantSet:
+    def parse_output(self, output: records.QueryVariant) -> query.QueryVariantSet:
+        # The internal records become pydantic models only here, e.g. for the server
+        return query.QueryVariantSet(
+            queries = [records.to_model(output)]
+        )
+
+    # Written as they are, see records.dump_json
+    def records_of(self, output: records.QueryVariant) -> list[records.QueryVariant]:
+        return [output]
+
+    def close(self):
+        if self.docs is not None:
+            self.docs.close()
+
+# The augmentor of a worker process, see `init_worker`
+WORKER: SpacyAugmentor | None = None
+
+def init_worker(lng: str, model: str, vtypes: set[query.VariantType],
+                vectors_path: str, neighbours_path: str | None, synsets_path: str | None,
+                spelling_path: str | None, silence: bool, synonym_cache_size: int,
+                doc_cache_path: str | None):
+    from ..spacy import docs, wordnet, neighbours, shared, synsets, symspell
+
+    global WORKER
+    nlp = wordnet.create(model, silence, vtypes, vectors = False)
+    shared.attach(nlp, vectors_path)
+    if neighbours_path is not None:
+        neighbours.register(nlp, neighbours.load(nlp, neighbours_path))
+    if synsets_path is not None:
+        synsets.register(lng, synsets.load(synsets_path))
+    if spelling_path is not None:
+        symspell.register(nlp, symspell.load(nlp, spelling_path))
+    WORKER = SpacyAugmentor({lng: nlp}, vtypes, synonym_cache_size,
+                            docs.DocCache(doc_cache_path) if doc_cache_path is not None else None)
+
+# Outputs, with the metrics of the worker since its last task
+def process_in_worker(queries: list[query.Query], num: int, silence: bool,
+                      batch_size: int) -> tuple[list[records.QueryVariant], dict]:
+    outputs = WORKER.process_batch(queries, num, False, silence, None, batch_size = batch_size)
+    return outputs, metrics.METRICS.drain()
+
+# Transformer-based, with worker processes per language, each holding a warm model.
+# The word vectors of a language are memory-mapped by all its workers, not copied.
+class SpacyPoolAugmentor(Augmentor):
+    def __init__(self, pools: dict[str, ProcessPoolExecutor], workers: int):
+        self.pools = pools
+        self.workers = workers
+
+    def process(self, q: query.Query, num: int, 
+                debug: bool, silence: bool,
+                lang: set[str] | None, **kwargs) -> records.QueryVariant:
+        return self.process_batch([q], num, debug, silence, lang, **kwargs)[0]
+
+    def process_batch(self, queries: list[query.Query], num: int,
+                      debug: bool, silence: bool, lang: set[str] | None,
+                      batch_size: int = 256, **kwargs) -> list[records.QueryVariant]:
+        if debug:
+            raise ValueError('Debugging is not supported with worker processes, run without `--workers`')
+
+        # Route queries to the workers of their language,
+        # split evenly so that all workers of all languages run at once
+        indexes_by_lang: dict[str, list[int]] = defaultdict(list)
+        for i, q in enumerate(queries):
+            indexes_by_lang[q.lang].append(i)
+
+        tasks = []
+        for lng, indexes in indexes_by_lang.items():
+            if lng not in self.pools:
+                raise ValueError(f'No worker for language {lng}')
+            size = math.ceil(len(indexes) / self.workers)
+            for start in range(0, len(indexes), size):
+                part = indexes[start:start + size]
+                future = self.pools[lng].submit(process_in_worker, [queries[i] for i in part],
+                                                num, silence, batch_size)
+                tasks.append((part, future))
+
+        outputs: list[records.QueryVariant | None] = [None] * len(queries)
+        for part, future in tasks:
+            part_outputs, worker_metrics = future.result()
+            metrics.METRICS.merge(worker_metrics)
+            for i, output in zip(part, part_outputs):
+                outputs[i] = output
+        return outputs
+
+    def parse_output(self, output: records.QueryVariant) -> query.QueryVariantSet:
+        # The internal records become pydantic models only here, e.g. for the server
         return query.QueryVariantSet(
-            queries = [output]
+            queries = [records.to_model(output)]
+        )
+
+    # Written as they are, see records.dump_json
+    def records_of(self, output: records.QueryVariant) -> list[records.QueryVariant]:
+        return [output]
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.shutdown()
+
+def neighbours_path(config: conf.Conf, lng: str) -> str | None:
+    from ..spacy import neighbours
+
+    path = os.path.expanduser(config.langs[lng].neighbours or \
+                              neighbours.default_path(config.langs[lng].model))
+    return path if os.path.exists(os.path.join(path, 'meta.json')) else None
+
+# The WordNet index of the language, if a variant type needs it
+def synsets_path(config: conf.Conf, lng: str, vtypes: set[query.VariantType]) -> str | None:
+    from ..spacy import synsets
+
+    if not vtypes & {query.VariantType.HYPERNYM, query.VariantType.HYPONYM}:
+        return None
+    path = os.path.expanduser(config.langs[lng].synsets or synsets.default_path(lng))
+    if not synsets.exists(path):
+        raise ValueError(f'Missing WordNet index of {lng} at {path}, '
+                         f'build it with `python -m aquda -index --index-type=synsets -l{lng}`')
+    return path
+
+# The spelling index of the model of the language, if a variant type needs it
+def spelling_path(config: conf.Conf, lng: str, vtypes: set[query.VariantType]) -> str | None:
+    from ..spacy import symspell
+
+    if query.VariantType.SPELLING not in vtypes:
+        return None
+    path = os.path.expanduser(config.langs[lng].spelling or symspell.default_path(config.langs[lng].model))
+    if not symspell.exists(path):
+        raise ValueError(f'Missing spelling index of {lng} at {path}, '
+                         f'build it with `python -m aquda -index --index-type=spelling -l{lng}`')
+    return path
+
+# Nearest-neighbour index of the model, if built, and the indexes the variant types require
+def load_indexes(config: conf.Conf, lng: str, nlp: object, vtypes: set[query.VariantType], silence: bool):
+    from ..spacy import neighbours, synsets, symspell
+
+    path = neighbours_path(config, lng)
+    if path is not None:
+        if not silence:
+            print(f'{colour.CYAN}Loading neighbour index:{colour.DEFAULT} {path}')
+        neighbours.register(nlp, neighbours.load(nlp, path))
+    path = synsets_path(config, lng, vtypes)
+    if path is not None:
+        if not silence:
+            print(f'{colour.CYAN}Loading WordNet index:{colour.DEFAULT} {path}')
+        synsets.register(lng, synsets.load(path))
+    path = spelling_path(config, lng, vtypes)
+    if path is not None:
+        if not silence:
+            print(f'{colour.CYAN}Loading spelling index:{colour.DEFAULT} {path}')
+        symspell.register(nlp, symspell.load(nlp, path))
+
+def create_pools(config: conf.Conf, vtypes: set[query.VariantType], langs: list[str],
+                 workers: int, silence: bool, synonym_cache_size: int,
+                 doc_cache_path: str | None = None) -> SpacyPoolAugmentor:
+    from ..spacy import shared
+
+    # Workers are spawned, not forked, so they start without the state of this process
+    context = multiprocessing.get_context('spawn')
+    pools = dict()
+    for lng in langs:
+        model = config.langs[lng].model
+        vectors_path = os.path.expanduser(config.langs[lng].vectors or shared.default_path(model))
+        if not shared.exists(vectors_path):
+            # Exported in a short-lived process, this one never holds a whole model
+            with ProcessPoolExecutor(max_workers = 1, mp_context = context) as exporter:
+                exporter.submit(shared.export_model, model, vectors_path, silence).result()
+        if not silence:
+            print(f'{colour.CYAN}Starting {workers} workers [{lng}]:{colour.DEFAULT} {model}')
+        pools[lng] = ProcessPoolExecutor(
+            max_workers = workers,
+            mp_context = context,
+            initializer = init_worker,
+            initargs = (lng, model, vtypes, vectors_path, neighbours_path(config, lng),
+                        synsets_path(config, lng, vtypes), spelling_path(config, lng, vtypes),
+                        silence, synonym_cache_size, doc_cache_path)
         )
+    return SpacyPoolAugmentor(pools, workers)
+
+# Local variant types with Spacy, the others with the LLM, merged into one query variant per query.
+# The requests of a batch are in flight while Spacy augments it
+class HybridAugmentor(Augmentor):
+    def __init__(self, local: Augmentor | None, remote: Augmentor | None):
+        self.local = local
+        self.remote = remote
+
+    def process(self, q: query.Query, num: int, 
+                debug: bool, silence: bool, lang: set[str] | None, **kwargs) -> tuple[object, object]:
+        return self.process_batch([q], num, debug, silence, lang, **kwargs)[0]
+
+    def process_batch(self, queries: list[query.Query], num: int,
+                      debug: bool, silence: bool, lang: set[str] | None,
+                      **kwargs) -> list[tuple[object, object]]:
+        remote_outputs = [None] * len(queries)
+        with ThreadPoolExecutor(max_workers = 1) as pool:
+            future = pool.submit(self.remote.process_batch, queries, num, debug, silence, lang, **kwargs) \
+                if self.remote is not None else None
+            local_outputs = self.local.process_batch(queries, num, debug, silence, lang, **kwargs) \
+                if self.local is not None else [None] * len(queries)
+            if future is not None:
+                remote_outputs = future.result()
+        return list(zip(local_outputs, remote_outputs))
+
+    def parse_output(self, output: tuple[object, object]) -> query.QueryVariantSet:
+        local, remote = output
+        if self.local is None:
+            return self.remote.parse_output(remote)
+        out = self.local.parse_output(local)
+        parsed = self.remote.parse_output(remote) if self.remote is not None else None
+        # Variants from the LLM are added to the query as augmented locally,
+        # also if the model answered with more than one query
+        if parsed is not None:
+            for qv in parsed.queries:
+                out.queries[0].variants += qv.variants
+        return out
+
+    def close(self):
+        for aug in (self.local, self.remote):
+            if aug is not None:
+                aug.close()
+
+# (local, remote) variant types of the hybrid engine
+def split_vtypes(vtypes: set[query.VariantType]) -> tuple[set[query.VariantType], set[query.VariantType]]:
+    return vtypes & SPACY_VTYPES, vtypes - SPACY_VTYPES
 
 # lang is only used for language translation mode
 def get(engine: str, vtypes: set[query.VariantType], 
-        lang: set[str], silence: bool) -> Augmentor:
-    if engine == 'spacy':
-        with open('spacy.conf', 'r') as f:
-            config = conf.Conf.model_validate(from_json(f.read()))
+        lang: set[str], silence: bool,
+        concurrency: int = 1, retries: int = 5,
+        cache: object | None = None,
+        synonym_cache_size: int = conf.SYNONYM_CACHE_SIZE,
+        workers: int = 0,
+        pack_size: int = 1,
+        create_client: Callable[[], object] | None = None,
+        loop: asyncio.AbstractEventLoop | None = None,
+        doc_cache_path: str | None = None) -> Augmentor:
+    if engine == 'spacy' and workers > 0:
+        return create_pools(conf.load(), vtypes, sorted(lang), workers, silence, synonym_cache_size,
+                            doc_cache_path)
+    elif engine == 'spacy':
+        from ..spacy import docs, wordnet
+
+        config = conf.load()
         
-        # load Spacy models, one per language
-        api_by_lang: dict[str, object] = {lng: wordnet.create(config.langs[lng].model, \
-                                                              silence) \
-                                                                for lng in lang}
+        # load Spacy models, one per language and in parallel,
+        # with only the pipeline components the variant types need
+        langs = sorted(lang)
+        with ThreadPoolExecutor(max_workers = max(1, len(langs))) as pool:
+            models = pool.map(lambda lng: wordnet.create(config.langs[lng].model, silence, vtypes), langs)
+            api_by_lang: dict[str, object] = dict(zip(langs, models))
+
+        # and their indexes
+        for lng, nlp in api_by_lang.items():
+            load_indexes(config, lng, nlp, vtypes, silence)
         
-        return SpacyAugmentor(api_by_lang, vtypes)
+        return SpacyAugmentor(api_by_lang, vtypes, synonym_cache_size,
+                              docs.DocCache(doc_cache_path) if doc_cache_path is not None else None)
+    elif engine == 'hybrid':
+        local, remote = split_vtypes(vtypes)
+        if not silence:
+            print(f'{colour.CYAN}Hybrid engine:{colour.DEFAULT} ' + \
+                  f'{sorted(v.name for v in local)} with Spacy, {sorted(v.name for v in remote)} with OpenAI')
+        return HybridAugmentor(
+            get('spacy', local, lang, silence, concurrency, retries, cache, synonym_cache_size, workers,
+                pack_size, doc_cache_path = doc_cache_path) if len(local) > 0 else None,
+            get('openai', remote, lang, silence, concurrency, retries, cache, synonym_cache_size, workers,
+                pack_size, create_client, loop) if len(remote) > 0 else None
+        )
+    elif engine == 'openai' and pack_size > 1:
+        return PackedOpenAIAugmentor(vtypes, lang, concurrency, retries, pack_size, cache, create_client, loop)
+    elif engine == 'openai' and (concurrency > 1 or loop is not None):
+        return AsyncOpenAIAugmentor(vtypes, lang, concurrency, retries, cache, create_client, loop)
     elif engine == 'openai':
+        from ..openai import agent
         client = agent.create()
-        return OpenAIAugmentor(client, vtypes, lang)
+        return OpenAIAugmentor(client, vtypes, lang, cache)
     else:
         raise ValueError(f'Unknown augmentation engine: {engine}')
@@ -31,7 +31,7 @@ PARAMS = set(PARAM_MAP.keys())
 
 def to_str(lang: set[str] | None, vtype: VariantType) -> str:
     if vtype == VariantType.TRANSL:
-        return ', '.join([f'{vtype.value} to {ln}' for ln in lang or []])
+        return ', '.join([f'{vtype.value} to {ln}' for ln in sorted(lang or [])])
     else:
         return vtype.value
     
@@ -39,6 +39,11 @@ def to_str(lang: set[str] | None, vtype: VariantType) -> str:
 def from_str(s: str) -> VariantType:
     return PARAM_MAP[s]
 
+# In the order of definition. Sets of enum members iterate in an order
+# which changes with PYTHONHASHSEED, so outputs and prompts would too
+def ordered(vtypes: set[VariantType]) -> tuple[VariantType, ...]:
+    return tuple(v for v in VariantType if v in vtypes)
+
 # https://platform.openai.com/docs/guides/structured-outputs
 class Query(BaseModel):
     original: str
@@ -58,6 +63,24 @@ class QueryVariant(Query):
 class QueryVariantSet(BaseModel):
     queries: list[QueryVariant]
 
+# Variants of many queries from one request, each keyed by the index of its query in the prompt
+class PackedVariant(BaseModel):
+    index: int
+    variants: list[VariantElement]
+
+class PackedVariantSet(BaseModel):
+    queries: list[PackedVariant]
+
+
+
+    
 
+# Query of either a QuerySet or QueryVariantSet file
+class Record(Query):
+    variants: list[VariantElement] | None = None
 
-    
\ No newline at end of file
+    # The same kind of query as read, with the given variants
+    def output(self, variants: list[VariantElement] | None) -> Query:
+        if self.variants is None:
+            return Query(original = self.original, lang = self.lang)
+        return QueryVariant(original = self.original, lang = self.lang, variants = variants)
@@ -0,0 +1,74 @@
+from json.encoder import encode_basestring
+
+from ..text import query
+
+# Plain slotted counterparts of the models in `query`, used on the hot path of augmentation
+# where a query expands to dozens of variants. They are not validated, and are written
+# as they are, see `dump_json`. Only the server converts them to pydantic models, see `to_model`.
+
+class VariantElement(object):
+    __slots__ = ('text', 'lang', 'variant_type')
+
+    def __init__(self, text: str, lang: str, variant_type: query.VariantType):
+        self.text = text
+        self.lang = lang
+        self.variant_type = variant_type
+
+class QueryVariant(object):
+    __slots__ = ('original', 'lang', 'variants')
+
+    def __init__(self, original: str, lang: str, variants: list[VariantElement]):
+        self.original = original
+        self.lang = lang
+        self.variants = variants
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, QueryVariant) and self.original == other.original and \
+            self.lang == other.lang and \
+            [(v.text, v.lang, v.variant_type) for v in self.variants] == \
+            [(v.text, v.lang, v.variant_type) for v in other.variants]
+
+    def __getstate__(self) -> tuple:
+        # Compact pickles, e.g. from worker processes
+        return (self.original, self.lang,
+                [(v.text, v.lang, v.variant_type) for v in self.variants])
+
+    def __setstate__(self, state: tuple):
+        self.original, self.lang, variants = state
+        self.variants = [VariantElement(*v) for v in variants]
+
+# Validated in one call from plain dicts, which is faster
+# than constructing each VariantElement on its own
+def to_model(record: QueryVariant) -> query.QueryVariant:
+    return query.QueryVariant.model_validate({
+        'original': record.original,
+        'lang': record.lang,
+        'variants': [
+            {'text': v.text, 'lang': v.lang, 'variant_type': v.variant_type}
+            for v in record.variants
+        ]
+    })
+
+# Same as `model_dump_json()` of the pydantic model, without building one
+def dump_json(record: QueryVariant) -> str:
+    return '{"original":' + encode_basestring(record.original) + \
+        ',"lang":' + encode_basestring(record.lang) + ',"variants":[' + \
+        ','.join(['{"text":' + encode_basestring(v.text) + ',"lang":' + encode_basestring(v.lang) +
+                  ',"variant_type":' + encode_basestring(v.variant_type.value) + '}' for v in record.variants]) + ']}'
+
+# Same as `textwrap.indent(model.model_dump_json(indent = 2), prefix)`
+def dump_json_indented(record: QueryVariant, prefix: str) -> str:
+    if len(record.variants) == 0:
+        variants = '[]'
+    else:
+        variants = '[\n' + ',\n'.join([
+            f'{prefix}    {{\n'
+            f'{prefix}      "text": {encode_basestring(v.text)},\n'
+            f'{prefix}      "lang": {encode_basestring(v.lang)},\n'
+            f'{prefix}      "variant_type": {encode_basestring(v.variant_type.value)}\n'
+            f'{prefix}    }}' for v in record.variants]) + f'\n{prefix}  ]'
+    return f'{prefix}{{\n' \
+           f'{prefix}  "original": {encode_basestring(record.original)},\n' \
+           f'{prefix}  "lang": {encode_basestring(record.lang)},\n' \
+           f'{prefix}  "variants": {variants}\n' \
+           f'{prefix}}}'
@@ -0,0 +1,177 @@
+import json
+import os
+import sys
+import textwrap
+from collections.abc import Iterator
+from pydantic import BaseModel
+from typing import TextIO, TYPE_CHECKING
+
+from . import records
+from ..cli import metrics
+
+# numpy is only imported for the columnar format
+if TYPE_CHECKING:
+    from . import columnar
+
+# Query files are either
+# - json: one document `{"queries": [...]}`, as dumped by QuerySet/QueryVariantSet
+# - jsonl: one Query/QueryVariant per line
+# - columnar: a directory of memory-mapped columns, see `columnar`
+FORMATS = ['json', 'jsonl', 'columnar']
+
+# Number of characters read at a time when streaming a JSON document
+READ_CHUNK = 1 << 16
+
+def format_of(path: str | None, fmt: str | None = None) -> str:
+    if fmt is not None:
+        return fmt
+    if path is not None and path.endswith('.jsonl'):
+        return 'jsonl'
+    if path is not None and path.rstrip('/').endswith('.cols'):
+        return 'columnar'
+    return 'json'
+
+def iter_json_items(f: TextIO, field: str = 'queries') -> Iterator[object]:
+    # Decode the items of the top-level array `field` one by one,
+    # without loading the whole document into memory
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+
+    def fill() -> bool:
+        nonlocal buf, pos
+        chunk = f.read(READ_CHUNK)
+        buf = buf[pos:] + chunk
+        pos = 0
+        return chunk != ''
+
+    # Seek to the opening bracket of the array
+    key = f'"{field}"'
+    while key not in buf:
+        if not fill():
+            raise ValueError(f'Missing field `{field}` in JSON document')
+    pos = buf.index(key) + len(key)
+    while buf.find('[', pos) < 0:
+        if not fill():
+            raise ValueError(f'Field `{field}` is not an array')
+    pos = buf.index('[', pos) + 1
+
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos == len(buf):
+            if not fill():
+                raise ValueError(f'Unterminated array `{field}` in JSON document')
+            continue
+        if buf[pos] == ']':
+            return
+        try:
+            item, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # Incomplete item, read more
+            if not fill():
+                raise
+            continue
+        yield item
+
+# Each record is timed as read, with its parsing and validation
+def read(path: str, model: type[BaseModel], fmt: str | None = None) -> Iterator[BaseModel]:
+    return metrics.timed_iter('io.read', read_records(path, model, fmt))
+
+def read_records(path: str, model: type[BaseModel], fmt: str | None = None) -> Iterator[BaseModel]:
+    fmt = format_of(path, fmt)
+    if fmt == 'columnar':
+        from . import columnar
+        for record in columnar.open_columns(path):
+            yield model.model_validate(record)
+        return
+    with open(os.path.expanduser(path), 'r', encoding = 'utf-8') as f:
+        if fmt == 'jsonl':
+            for line in f:
+                if line.strip():
+                    yield model.model_validate_json(line)
+        else:
+            for item in iter_json_items(f):
+                yield model.model_validate(item)
+
+class Writer(object):
+    def __init__(self, f: TextIO, close_file: bool):
+        self.f = f
+        self.close_file = close_file
+        self.count = 0
+
+    def write(self, record: BaseModel | records.QueryVariant):
+        pass
+
+    def finish(self):
+        pass
+
+    def flush(self):
+        self.f.flush()
+
+    # Flush to disk and return the byte offset where the next record goes
+    def sync(self) -> int:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return self.f.tell()
+
+    def close(self):
+        self.finish()
+        self.flush()
+        if self.close_file:
+            self.f.close()
+
+    def __enter__(self) -> 'Writer':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Records of `records` are written as they are, the same as their pydantic models
+class JsonlWriter(Writer):
+    @metrics.timed('io.write')
+    def write(self, record: BaseModel | records.QueryVariant):
+        self.f.write(records.dump_json(record) if isinstance(record, records.QueryVariant)
+                     else record.model_dump_json())
+        self.f.write('\n')
+        self.count += 1
+
+# Writes records as they come, byte-identical to `model_dump_json(indent = 2)`
+# of the whole QuerySet/QueryVariantSet
+class JsonWriter(Writer):
+    @metrics.timed('io.write')
+    def write(self, record: BaseModel | records.QueryVariant):
+        self.f.write('{\n  "queries": [\n' if self.count == 0 else ',\n')
+        self.f.write(records.dump_json_indented(record, '    ') if isinstance(record, records.QueryVariant)
+                     else textwrap.indent(record.model_dump_json(indent = 2), '    '))
+        self.count += 1
+
+    def finish(self):
+        self.f.write('{\n  "queries": []\n}' if self.count == 0 else '\n  ]\n}')
+
+# Writes to stdout when `path` is not given.
+# Given `offset`, an existing file is truncated to that byte offset
+# and writing continues after the `count` records already in there.
+def open_writer(path: str | None, fmt: str | None = None,
+                offset: int | None = None, count: int = 0) -> 'Writer | columnar.ColumnarWriter':
+    fmt = format_of(path, fmt)
+    if fmt == 'columnar':
+        from . import columnar
+        if path is None:
+            raise ValueError('Requiring an output path via `--write` argument to write columnar format.')
+        if offset is not None:
+            raise ValueError('Cannot resume writing columnar format, use json or jsonl instead.')
+        return columnar.ColumnarWriter(os.path.expanduser(path))
+    cls = JsonlWriter if fmt == 'jsonl' else JsonWriter
+    if path is None:
+        return cls(sys.stdout, False)
+    path = os.path.expanduser(path)
+    if offset is None:
+        return cls(open(path, 'w', encoding = 'utf-8'), True)
+
+    f = open(path, 'r+', encoding = 'utf-8')
+    f.truncate(offset)
+    f.seek(offset)
+    writer = cls(f, True)
+    writer.count = count
+    return writer
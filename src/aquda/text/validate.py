@@ -0,0 +1,240 @@
+import itertools
+import tempfile
+import numpy as np
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Executor
+from pydantic import BaseModel
+
+from ..text import query, dedup, storage
+
+# Near-duplicates are found by MinHash over character shingles of the normalised text,
+# with LSH banding: items whose signatures agree on all rows of any band become candidates,
+# which are then kept only when their estimated Jaccard similarity is above the threshold.
+#
+# With 16 bands of 8 rows, a pair of similarity 0.8 becomes a candidate with ~95% chance,
+# a pair of similarity 0.5 with ~6%.
+NUM_PERM = 128
+BANDS = 16
+SHINGLE = 3
+
+# Multiply-shift hashing ((a * x + b) mod 2^64) >> 32 of shingle hashes, one (a, b) per permutation.
+# uint64 arithmetic wraps around, so no modulo is needed
+_rng = np.random.default_rng(1)
+PERM_A = _rng.integers(1, 1 << 63, size = NUM_PERM, dtype = np.uint64) | np.uint64(1)
+PERM_B = _rng.integers(0, 1 << 63, size = NUM_PERM, dtype = np.uint64)
+SHINGLE_BASE = np.uint64(0x100000001b3)
+
+# Issues of a query or variant, as bit flags
+EMPTY = 1
+LANG_MISMATCH = 2
+SAME_AS_ORIGINAL = 4
+NEAR_DUPLICATE = 8
+ISSUES = {
+    EMPTY: 'empty',
+    LANG_MISMATCH: 'lang_mismatch',
+    SAME_AS_ORIGINAL: 'same_as_original',
+    NEAR_DUPLICATE: 'near_duplicate'
+}
+
+class Report(BaseModel):
+    input: str
+    queries: int = 0
+    variants: int = 0
+    # Number of queries and variants with each issue
+    query_issues: dict[str, int] = {}
+    variant_issues: dict[str, int] = {}
+    dropped_queries: int = 0
+    dropped_variants: int = 0
+    # Largest clusters of near-duplicates, the kept text first
+    clusters: list[list[str]] = []
+
+def minhash(texts: list[str], block: int = 1024) -> np.ndarray:
+    # One signature row per text, computed over all shingles of `block` texts at once
+    signatures = np.empty((len(texts), NUM_PERM), dtype = np.uint32)
+    for start in range(0, len(texts), block):
+        # Texts shorter than a shingle are one shingle, padded
+        padded = [t.ljust(SHINGLE, '\0') for t in texts[start:start + block]]
+        sizes = np.array([len(t) for t in padded], dtype = np.int64)
+        codes = np.frombuffer((''.join(padded) + '\0' * (SHINGLE - 1)).encode('utf-32-le'),
+                              dtype = np.uint32).astype(np.uint64)
+
+        # Polynomial hash of the window of SHINGLE characters at every position
+        total = int(sizes.sum())
+        hashes = np.zeros(total, dtype = np.uint64)
+        for i in range(SHINGLE):
+            hashes = hashes * SHINGLE_BASE + codes[i:i + total]
+        # but only windows within a text are shingles
+        ends = np.cumsum(sizes)
+        offsets = np.arange(total) - np.repeat(ends - sizes, sizes)
+        hashes = hashes[offsets <= np.repeat(sizes - SHINGLE, sizes)]
+
+        permuted = ((PERM_A[:, None] * hashes[None, :] + PERM_B[:, None]) >> np.uint64(32)).astype(np.uint32)
+        counts = sizes - SHINGLE + 1
+        firsts = np.cumsum(counts) - counts
+        signatures[start:start + len(padded)] = np.minimum.reduceat(permuted, firsts, axis = 1).T
+    return signatures
+
+# Signatures and issue flags of the items of `records`: each original, followed by its variants
+def check(records: list[query.Record]) -> tuple[np.ndarray, np.ndarray]:
+    texts = []
+    flags = []
+    for r in records:
+        original = dedup.normalise(r.original)
+        texts.append(original)
+        flags.append(EMPTY if original == '' else 0)
+        for v in r.variants or []:
+            text = dedup.normalise(v.text)
+            texts.append(text)
+            flags.append((EMPTY if text == '' else 0) |
+                         (LANG_MISMATCH if v.variant_type != query.VariantType.TRANSL and \
+                          dedup.normalise(v.lang) != dedup.normalise(r.lang) else 0) |
+                         (SAME_AS_ORIGINAL if v.variant_type != query.VariantType.ORIGINAL and \
+                          text == original else 0))
+    return minhash(texts), np.array(flags, dtype = np.uint8)
+
+class UnionFind(object):
+    # The root of a set is always its smallest item, i.e. the earliest in the input
+    def __init__(self, size: int):
+        self.parent = np.arange(size, dtype = np.int64)
+
+    def find(self, i: int) -> int:
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i: int, j: int):
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj:
+            self.parent[max(ri, rj)] = min(ri, rj)
+
+    def roots(self) -> np.ndarray:
+        for i in range(len(self.parent)):
+            self.parent[i] = self.parent[self.parent[i]]
+        return self.parent
+
+# Pairs of candidates from LSH buckets, each member paired with the first one of its bucket.
+# Items only collide within the same group, and never when masked out
+def candidates(signatures: np.ndarray, groups: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    items = np.flatnonzero(mask)
+    if len(items) < 2:
+        return np.empty((0, 2), dtype = np.int64)
+    rows = NUM_PERM // BANDS
+    pairs = []
+    for band in range(BANDS):
+        keys = signatures[items, band * rows:(band + 1) * rows]
+        # lexsort sorts by the last key first
+        order = np.lexsort(tuple(keys[:, c] for c in reversed(range(rows))) + (groups[items],))
+        sorted_keys = np.column_stack([groups[items][order], keys[order]])
+        same = np.all(sorted_keys[1:] == sorted_keys[:-1], axis = 1)
+        starts = np.concatenate([[True], ~same])
+        first = np.maximum.accumulate(np.where(starts, np.arange(len(order)), 0))
+        members = np.flatnonzero(~starts)
+        pairs.append(np.column_stack([items[order[first[members]]], items[order[members]]]))
+    return np.unique(np.sort(np.concatenate(pairs), axis = 1), axis = 0)
+
+def near_duplicates(signatures: np.ndarray, groups: np.ndarray, mask: np.ndarray,
+                    threshold: float, block: int = 65536) -> np.ndarray:
+    # Root of the cluster of each item
+    clusters = UnionFind(len(groups))
+    pairs = candidates(signatures, groups, mask)
+    for start in range(0, len(pairs), block):
+        a, b = pairs[start:start + block, 0], pairs[start:start + block, 1]
+        similarity = np.mean(signatures[a] == signatures[b], axis = 1)
+        for i, j in zip(a[similarity >= threshold], b[similarity >= threshold]):
+            clusters.union(int(i), int(j))
+    return clusters.roots()
+
+def chunks_of(path: str, fmt: str | None, size: int) -> Iterator[list[query.Record]]:
+    for chunk in itertools.batched(storage.read(path, query.Record, fmt), size):
+        yield list(chunk)
+
+# Chunks with their `check` results, in order. With a pool, at most `window`
+# chunks are in flight, so the input is never read ahead as a whole
+def checked(chunks: Iterator[list[query.Record]], pool: Executor | None,
+            window: int) -> Iterator[tuple[list[query.Record], tuple[np.ndarray, np.ndarray]]]:
+    if pool is None:
+        for chunk in chunks:
+            yield chunk, check(chunk)
+        return
+    inflight = deque()
+    for chunk in chunks:
+        inflight.append((chunk, pool.submit(check, chunk)))
+        if len(inflight) >= window:
+            chunk, future = inflight.popleft()
+            yield chunk, future.result()
+    while len(inflight) > 0:
+        chunk, future = inflight.popleft()
+        yield chunk, future.result()
+
+# Two streaming passes over the input. The first one computes the signatures
+# (kept on disk) and flags of all items, the second one writes the records
+# which are kept to `writer`, if given.
+def run(path: str, fmt: str | None, writer: object | None, threshold: float,
+        chunk_size: int, pool: Executor | None = None, window: int = 1,
+        clusters: int = 20) -> Report:
+    report = Report(input = path)
+    langs: dict[str, int] = dict()
+    groups, flags = [], []
+    with tempfile.TemporaryFile() as f:
+        for chunk, (signatures, chunk_flags) in checked(chunks_of(path, fmt, chunk_size), pool, window):
+            # Originals are near-duplicates within their language,
+            # variants within their query
+            for r in chunk:
+                groups.append(-1 - langs.setdefault(dedup.normalise(r.lang), len(langs)))
+                groups.extend([report.queries] * len(r.variants or []))
+                report.queries += 1
+                report.variants += len(r.variants or [])
+            f.write(signatures.tobytes())
+            flags.append(chunk_flags)
+        f.flush()
+
+        groups = np.array(groups, dtype = np.int64)
+        flags = np.concatenate(flags) if len(flags) > 0 else np.empty(0, dtype = np.uint8)
+        signatures = np.memmap(f, dtype = np.uint32, mode = 'r', shape = (len(flags), NUM_PERM)) \
+            if len(flags) > 0 else np.empty((0, NUM_PERM), dtype = np.uint32)
+        # Items with other issues are dropped anyway, they do not count as originals of near-duplicates
+        roots = near_duplicates(signatures, groups, flags == 0, threshold)
+    flags[roots != np.arange(len(flags))] |= NEAR_DUPLICATE
+
+    # Largest clusters, to show their texts in the report
+    sizes = np.bincount(roots, minlength = len(flags))
+    largest = np.argsort(-sizes, kind = 'stable')[:clusters]
+    texts: dict[int, list[str]] = {int(root): [] for root in largest if sizes[root] > 1}
+
+    item = 0
+    for r in (r for chunk in chunks_of(path, fmt, chunk_size) for r in chunk):
+        query_flags = flags[item]
+        count_issues(report.query_issues, query_flags)
+        if roots[item] in texts:
+            texts[roots[item]].append(r.original)
+        item += 1
+
+        kept = []
+        for v in r.variants or []:
+            count_issues(report.variant_issues, flags[item])
+            if roots[item] in texts:
+                texts[roots[item]].append(v.text)
+            if flags[item] == 0:
+                kept.append(v)
+            item += 1
+
+        # A dropped query takes all its variants with it
+        if query_flags != 0:
+            report.dropped_queries += 1
+            report.dropped_variants += len(r.variants or [])
+            continue
+        report.dropped_variants += len(r.variants or []) - len(kept)
+        if writer is not None:
+            writer.write(r.output(kept))
+
+    report.clusters = sorted(texts.values(), key = len, reverse = True)
+    return report
+
+def count_issues(counts: dict[str, int], flags: int):
+    for flag, name in ISSUES.items():
+        if flags & flag:
+            counts[name] = counts.get(name, 0) + 1